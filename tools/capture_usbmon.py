@@ -170,15 +170,9 @@ class USBInterface(UDevObject):
 	def get_name(self):
 		return "{0}_{1}".format(self.parent.get_name(), self.intf_number)
 
-	def write_hid_file(self):
-		"convert the usbmon recording into a hid recording"
-		intf = self.intf_number.split(".")[-1]
-		usbmon = self.parent.get_usbmon_filename()
-		usbmon_command = "python {0} {1} --intf {2}".format(usbmon2hid_replay, usbmon, intf)
-		f = open(self.get_name() + ".hid", "w")
-		p = subprocess.Popen(shlex.split(usbmon_command), stdout=f)
-		p.wait()
-		print "written", self.get_name() + ".hid"
+	def get_hid_filename(self):
+		"return the hid file name were the events of the interface are written"
+		return self.get_name() + ".hid"
 
 	def removed(self):
 		self.parent.remove_interface(self)
@@ -235,19 +229,34 @@ class USBDev(UDevObject):
 		"when an interface is removed, this method is called"
 		self.removed_intf.append(intf)
 
+	def write_hid_files(self):
+		"""convert the usbmon recording into one hid recording per removed
+		interface: the capture is parsed only once, all the interfaces being
+		written at the same time"""
+		if not self.removed_intf:
+			return
+		# the interfaces share the configuration, only their number differs
+		config = self.removed_intf[0].intf_number.split(".")[0]
+		template = "{0}_{1}.{{0}}.hid".format(self.get_name(), config)
+		usbmon_command = "python3 {0} {1} --demux".format(usbmon2hid_replay, self.get_usbmon_filename())
+		p = subprocess.Popen(shlex.split(usbmon_command) + [template])
+		p.wait()
+		for intf in self.removed_intf:
+			if os.path.exists(intf.get_hid_filename()):
+				print "written", intf.get_hid_filename()
+
 	def terminate(self):
 		"""clean up and terminate the usb device:
 		- stop the usbmon capture for this device
 		- remove any zombi child
-		- ask for each known interface to translate the usbmon capture into a hid one
+		- translate the usbmon capture into a hid one for each known interface
 		"""
 		number = self.device.device_node.split('/')[-1]
 		bus = int(self.device.device_node.split('/')[-2])
 		USBMon.remove_listener(bus, number)
 		self.usbmon_file.close()
 		self.clean()
-		for intf in self.removed_intf:
-			intf.write_hid_file()
+		self.write_hid_files()
 
 class USBMon(threading.Thread):
 	"""usbmon recorder class:
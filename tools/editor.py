@@ -29,6 +29,8 @@ except AttributeError:
 
 import parse_rdesc
 import parse_hid
+import rdesc_cache
+import recording
 
 
 class Main(QtGui.QMainWindow):
@@ -163,14 +165,14 @@ class Main(QtGui.QMainWindow):
 	def openFile(self, filename):
 		if not os.path.exists(filename):
 			raise IOError, filename
-		f = open(filename)
+		f = recording.open_recording(filename)
 		rdesc = None
 		events = []
 		file_content = []
 		original_rdesc = None
 		for line in f.readlines():
 			if line.startswith("R:"):
-				rdesc = parse_rdesc.parse_rdesc(line.lstrip("R: "), None)
+				rdesc = rdesc_cache.parse(line, None)
 				if not rdesc:
 					raise IOError, filename
 				rdesc = self.update_rdesc(rdesc)
@@ -179,7 +181,7 @@ class Main(QtGui.QMainWindow):
 				if line.startswith("E:") or line.startswith("#"):
 					events.append(line.strip())
 				elif line.startswith("O:"):
-					original_rdesc = parse_rdesc.parse_rdesc(line.lstrip("O: "), None)
+					original_rdesc = rdesc_cache.parse(line, None)
 		f.close()
 		# everything went fine, store the new configuration
 		self.filename = filename
@@ -192,14 +194,8 @@ class Main(QtGui.QMainWindow):
 		self.redrawRaw()
 
 	def update_rdesc(self, rdesc):
-		self.rdesc_dict = {}
-		self.maybe_numbered = False
-		for k in rdesc.reports.keys():
-			if len(rdesc.reports[k][0]):
-				if k == -1:
-					self.maybe_numbered = True
-				key = parse_hid.build_rkey(k, rdesc.reports[k][1])
-				self.rdesc_dict[key] = rdesc.reports[k][0]
+		self.rdesc_dict = parse_hid.ReportIndex()
+		self.maybe_numbered = parse_hid.update_rdesc_dict(rdesc, self.rdesc_dict)
 		self.rdesc = rdesc
 
 	def redrawRaw(self):
@@ -0,0 +1,369 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Hid replay / hidbin.py: compact binary container of hid-recorder
+# recordings
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# A binary recording starts with the magic "HIDB" and a version byte,
+# followed by one record per line of the text recording. Each record starts
+# with a one byte tag, the integers are unsigned LEB128 varints:
+#
+#   'D' device                          D: device
+#   'R' device size bytes               R: size bytes
+#   'N' length utf-8                    N: name
+#   'P' length utf-8                    P: phys
+#   'I' length utf-8                    I: bus vid pid
+#   'E' delta device size bytes         E: timestamp size bytes
+#   'T' length bytes                    any other line, verbatim
+#   'X' count interval                  the previous event repeated count
+#                                       times, every interval microseconds
+#
+# The timestamp of an event is stored as the zigzag encoded difference in
+# microseconds with the previous event. The lines which would not be
+# written back identically (comments, non canonical timestamps, ...) are
+# stored verbatim in 'T' records, so the conversion is lossless.
+#
+# 'X' records are optional, they are only written when asked for. They keep
+# the recordings of idle devices, which send the same report over and
+# over, small.
+#
+
+import argparse
+import mmap
+import os
+import sys
+import recording
+
+MAGIC = b'HIDB'
+VERSION = 1
+
+DEVICE = ord('D')
+RDESC = ord('R')
+NAME = ord('N')
+PHYS = ord('P')
+INFO = ord('I')
+EVENT = ord('E')
+TEXT = ord('T')
+REPEAT = ord('X')
+
+_headers = {b'N: ': NAME, b'P: ': PHYS, b'I: ': INFO}
+_prefixes = {v: k for k, v in _headers.items()}
+
+
+def is_binary(data):
+    """
+    Return True if data, the beginning of a file, is a binary recording.
+    """
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def encode_varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return out
+
+
+def decode_varint(data, pos):
+    """
+    Return (value, position after the varint) of the varint at pos.
+    """
+    value = data[pos]
+    pos += 1
+    if value < 0x80:
+        return value, pos
+    value &= 0x7f
+    shift = 7
+    while True:
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7f) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+
+def format_event(timestamp, report):
+    return (f'E: {recording.format_time(timestamp)} {len(report)}'
+            f'{"".join(f" {b:02x}" for b in report)}\n').encode()
+
+
+def format_rdesc(rdesc):
+    return (f'R: {len(rdesc)}'
+            f'{"".join(f" {b:02x}" for b in rdesc)}\n').encode()
+
+
+class Writer(object):
+    """
+    Convert the lines of a text recording into binary records written to
+    f_out, a binary file.
+
+    If run_length is set, the runs of identical reports sent at a constant
+    interval are collapsed in 'X' records. close() must then be called once
+    all the lines are written.
+    """
+
+    def __init__(self, f_out, run_length=False):
+        self.f_out = f_out
+        self.run_length = run_length
+        self.device = 0
+        self.timestamp = 0
+        self.last_event = None
+        self.repeat = 0
+        self.interval = 0
+        f_out.write(MAGIC + bytes((VERSION,)))
+
+    def write(self, record):
+        if self.repeat:
+            self.f_out.write(bytes((REPEAT,)) + encode_varint(self.repeat) +
+                             encode_varint(self.interval))
+            self.repeat = 0
+        self.last_event = None
+        self.f_out.write(record)
+
+    def close(self):
+        """
+        Write the pending 'X' record, if any.
+        """
+        self.write(b'')
+
+    def write_text(self, line):
+        self.write(bytes((TEXT,)) + encode_varint(len(line)) + line)
+
+    def write_line(self, line):
+        """
+        Write the record of line, given as bytes including its newline.
+        """
+        tag = line[:3]
+        try:
+            if tag == b'E: ':
+                timestamp, size, report = recording.split_event(line)
+                if size == len(report) and \
+                        format_event(timestamp, report) == line:
+                    self.write_event(timestamp, self.device, report)
+                    return
+            elif tag == b'R: ':
+                size, rdesc = recording.split_rdesc(line)
+                if size == len(rdesc) and format_rdesc(rdesc) == line:
+                    self.write_rdesc(self.device, rdesc)
+                    return
+            elif tag == b'D: ':
+                device = int(line[3:])
+                if f'D: {device}\n'.encode() == line:
+                    self.write_device(device)
+                    return
+            elif tag in _headers and line.endswith(b'\n'):
+                text = line[3:-1]
+                text.decode('utf-8')
+                self.write(bytes((_headers[tag],)) +
+                           encode_varint(len(text)) + text)
+                return
+        except ValueError:
+            pass
+        if line.startswith(b'D:'):
+            # not written back identically, but it still switches the
+            # device of the following events, as in parse_hid
+            try:
+                self.device = int(line[2:])
+            except ValueError:
+                pass
+        self.write_text(line)
+
+    def write_device(self, device):
+        self.device = device
+        self.write(bytes((DEVICE,)) + encode_varint(device))
+
+    def write_rdesc(self, device, rdesc):
+        self.write(bytes((RDESC,)) + encode_varint(device) +
+                   encode_varint(len(rdesc)) + rdesc)
+
+    def write_event(self, timestamp, device, report):
+        delta = timestamp - self.timestamp
+        if self.last_event == (device, report) and delta >= 0 and \
+                (not self.repeat or delta == self.interval):
+            # same report again, extend the current run
+            self.repeat += 1
+            self.interval = delta
+            self.timestamp = timestamp
+            return
+        self.timestamp = timestamp
+        # zigzag, the timestamps may go back
+        delta = delta << 1 if delta >= 0 else (-delta << 1) - 1
+        self.write(bytes((EVENT,)) + encode_varint(delta) +
+                   encode_varint(device) +
+                   encode_varint(len(report)) + report)
+        if self.run_length:
+            self.last_event = (device, report)
+
+
+def read_records(data, pos=None, timestamp=0):
+    """
+    Yield the records of data, the content of a binary recording (bytes or
+    mmap), as (tag, device, timestamp, payload) tuples. payload is a
+    memoryview slice of data: the report of the events, the report
+    descriptor of 'R' records and the text of the other records. device
+    and timestamp are None for the records which do not have them.
+
+    The payload of the 'X' records is (report, count, interval), and
+    their timestamp is the one of the first repetition. expand() turns them
+    into the events they stand for.
+
+    pos and timestamp allow to start reading in the middle of data, they
+    are the position of a record and the timestamp of the last event
+    before it, its repetitions included. The record at pos can not be an
+    'X' one: the event it repeats is not known, a ValueError is raised.
+    """
+    view = memoryview(data)
+    if pos is None:
+        if not is_binary(data):
+            raise ValueError('not a binary hid recording')
+        if data[len(MAGIC)] != VERSION:
+            raise ValueError(f'unsupported version {data[len(MAGIC)]}')
+        pos = len(MAGIC) + 1
+    end = len(data)
+    report = None
+    while pos < end:
+        tag = data[pos]
+        pos += 1
+        if tag == EVENT:
+            # most of the varints of an event fit in a single byte
+            delta = data[pos]
+            if delta < 0x80:
+                pos += 1
+            else:
+                delta, pos = decode_varint(data, pos)
+            timestamp += (delta >> 1) ^ -(delta & 1)
+            device = data[pos]
+            if device < 0x80:
+                pos += 1
+            else:
+                device, pos = decode_varint(data, pos)
+            size = data[pos]
+            if size < 0x80:
+                pos += 1
+            else:
+                size, pos = decode_varint(data, pos)
+            report = view[pos:pos + size]
+            yield EVENT, device, timestamp, report
+            pos += size
+        elif tag == REPEAT:
+            if report is None:
+                # at the start of data, or at the start position
+                raise ValueError(f'repeat without event at {pos - 1}')
+            count, pos = decode_varint(data, pos)
+            interval, pos = decode_varint(data, pos)
+            yield (REPEAT, device, timestamp + interval,
+                   (report, count, interval))
+            timestamp += count * interval
+        elif tag == DEVICE:
+            device, pos = decode_varint(data, pos)
+            yield DEVICE, device, None, None
+        elif tag == RDESC:
+            device, pos = decode_varint(data, pos)
+            size, pos = decode_varint(data, pos)
+            yield RDESC, device, None, view[pos:pos + size]
+            pos += size
+        elif tag in (NAME, PHYS, INFO, TEXT):
+            size, pos = decode_varint(data, pos)
+            yield tag, None, None, view[pos:pos + size]
+            pos += size
+        else:
+            raise ValueError(f'invalid record {tag:#x} at {pos - 1}')
+
+
+def expand(records):
+    """
+    Replace the 'X' records given by read_records() by the events they
+    stand for. The events are generated one at a time.
+    """
+    for record in records:
+        if record[0] == REPEAT:
+            tag, device, timestamp, (report, count, interval) = record
+            for i in range(count):
+                yield EVENT, device, timestamp + i * interval, report
+        else:
+            yield record
+
+
+def format_record(tag, device, timestamp, payload):
+    """
+    Return the line of the text recording of the given record, as bytes.
+    'X' records have to be expanded first.
+    """
+    if tag == EVENT:
+        return format_event(timestamp, payload)
+    if tag == DEVICE:
+        return f'D: {device}\n'.encode()
+    if tag == RDESC:
+        return format_rdesc(payload)
+    if tag == TEXT:
+        return bytes(payload)
+    return _prefixes[tag] + bytes(payload) + b'\n'
+
+
+def text_to_binary(f_in, f_out, run_length=False):
+    """
+    Convert a text recording read from f_in into a binary one written to
+    f_out. Both files are binary files.
+    """
+    writer = Writer(f_out, run_length)
+    for line in f_in:
+        writer.write_line(line)
+    writer.close()
+
+
+def binary_to_text(data, f_out):
+    """
+    Convert data, the content of a binary recording, into a text recording
+    written to f_out, a binary file.
+    """
+    for record in expand(read_records(data)):
+        f_out.write(format_record(*record))
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description="Convert a hid-recorder recording between the text "
+                    "and the binary formats. The direction is guessed "
+                    "from the input file.")
+    parser.add_argument("input", help="the recording to convert")
+    parser.add_argument("output", nargs="?",
+                        help="the converted recording, stdout if omitted")
+    parser.add_argument("-r", "--run-length", action="store_true",
+                        help="collapse the runs of identical reports when "
+                             "converting to the binary format")
+    return parser.parse_args()
+
+
+def main():
+    options = get_options()
+    f_out = sys.stdout.buffer
+    if options.output:
+        f_out = open(options.output, 'wb')
+    with open(options.input, 'rb') as f_in:
+        if os.fstat(f_in.fileno()).st_size and is_binary(f_in.read(4)):
+            with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                binary_to_text(data, f_out)
+        else:
+            f_in.seek(0)
+            text_to_binary(f_in, f_out, options.run_length)
+    f_out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -20,159 +20,282 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import argparse
+import bisect
+import collections
+import heapq
+import io
+import itertools
+import mmap
+import multiprocessing
+import os
+import pickle
 import sys
-import parse_rdesc
-import hid
+import tempfile
+from collections.abc import MutableMapping
+import hidbin
+import rdesc_cache
+import recording
+import recording_index
+import report_stats
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def get_usage(usage):
-    usage_page = usage >> 16
-    if usage_page in hid.inv_usage_pages and \
-            hid.inv_usage_pages[usage_page] == "Button":
-        usage = f'B{str(usage & 0xFF)}'
-    elif usage in hid.inv_usages:
-        usage = hid.inv_usages[usage]
-    else:
-        usage = f'0x{usage:04x}'
-    return usage
-
-
-def get_value(report, start, size, twos_comp):
-    value = 0
-    start_bit = start
-    end_bit = start_bit + size
-    data = report[int(start_bit / 8): int(end_bit / 8 + 1)]
-    if len(data) == 0:
-        return "<.>", end_bit
-    for d in range(len(data)):
-        value |= data[d] << (8 * d)
-
-    bit_offset = start % 8
-    value = value >> bit_offset
-    garbage = (value >> size) << size
-    value = value - garbage
-    if twos_comp and size > 1:
-        value = parse_rdesc.twos_comp(value, size)
-    return value, end_bit
 
-
-def get_report(time, report, rdesc, numbered):
+def get_report(time, report, plan):
     """
     Translate the given report to a human readable format.
     """
-    total_bit_offset = 0
-
     output = f'{time:>10s} '
-    sep = ''
-    report_descriptor = rdesc
-    if numbered:
+    if plan.numbered:
         output += f'ReportID: {report[0]} '
-        sep = '/'
-        # first byte is report ID, actual data starts at 8
-        total_bit_offset = 8
-    prev = None
-    usages_printed = {}
-    indent_2nd_line = len(output)
-    for report_item in report_descriptor:
-        size = report_item["size"]
-        array = not (report_item["type"] & (0x1 << 1))  # Variable
-        const = report_item["type"] & (0x1 << 0)
-        values = []
-        usage_page_name = ''
-        usage_page = report_item["usage page"] >> 16
-        if usage_page in hid.inv_usage_pages:
-            usage_page_name = hid.inv_usage_pages[usage_page]
-
-        # get the value and consumes bits
-        for i in range(report_item["count"]):
-            value, total_bit_offset = get_value(
-                report, total_bit_offset, size, report_item["logical min"] < 0)
-            values.append(value)
-
-        if const:
-            output += f'{sep} # '
-        elif not array:
-            value_format = "{:d}"
-            if size > 1:
-                value_format = f'{{:{str(len(str(1 << size)) + 1)}d}}'
-            if isinstance(values[0], str):
-                value_format = "{}"
-            usage = f' {get_usage(report_item["usage"])}:'
-
-            # if we don't get a key error this is a duplicate in
-            # this report descriptor and we need a linebreak
-            try:
-                usages_printed[usage]
-                usages_printed = {}
-                output += '\n' + indent_2nd_line * ' '
-            except KeyError:
-                pass
-            finally:
-                usages_printed[usage] = True
-
-            if (prev and
-               prev["type"] == report_item["type"] and
-               prev["usage"] == report_item["usage"]):
-                sep = ","
-                usage = ""
-            output += f'{sep}{usage} {value_format.format(values[0])} '
+    indent_2nd_line = '\n' + len(output) * ' '
+    values = plan.decode(report)
+    output = [output]
+    for field in plan.fields:
+        if field.const:
+            output.append(field.prefix)
+        elif not field.array:
+            if field.linebreak:
+                output.append(indent_2nd_line)
+            value = values[field.index]
+            if not isinstance(value, str):
+                value = field.value_format.format(value)
+            output.append(f'{field.prefix} {value} ')
         else:
-            if not usage_page_name:
-                usage_page_name = "Array"
             usages = []
-            for v in values:
-                if (v < report_item["logical min"] or
-                   v > report_item["logical max"]):
-                    usages.append('')
+            for v in values[field.index:field.index + field.count]:
+                if isinstance(v, str):
+                    usages.append(v)
                 else:
-                    usage = ""
-                    if isinstance(values[0], str):
-                        usage = v
-                    else:
-                        usage = f'{v:02x}'
-                    if ('vendor' not in usage_page_name.lower() and
-                       v > 0 and
-                       v < len(report_item["usages"])):
-                        usage = get_usage(report_item["usages"][v])
-                        if "no event indicated" in usage.lower():
-                            usage = ''
-                    usages.append(usage)
-            output += f'{sep}{usage_page_name} [{", ".join(usages)}] '
-        sep = '|'
-        prev = report_item
-    return output
+                    usages.append(field.array_name(v))
+            output.append(f'{field.prefix}{", ".join(usages)}] ')
+    return ''.join(output)
 
 
 def build_rkey(reportID, length):
-    return f'{reportID}:{length}'
+    return (reportID, length)
 
 
-def parse_event(line, rdesc, rdesc_dict, maybe_numbered):
-    e, time, size, report = line.split(' ', 3)
-    size = int(size)
-    report = [int(item, 16) for item in report.split(' ')]
-    numbered = True
-    key = build_rkey(report[0], size)
-    if key not in rdesc_dict and maybe_numbered:
+class ReportIndex(MutableMapping):
+    """
+    The decode plans of the known reports, indexed by (report ID, size).
+
+    The declared sizes of each report ID are also kept sorted, so the
+    layout of a report longer than declared is found with a bisection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.plans = {}
+        self.sizes = {}
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self.plans[key]
+
+    def __contains__(self, key):
+        return key in self.plans
+
+    def get(self, key, default=None):
+        return self.plans.get(key, default)
+
+    def __setitem__(self, key, plan):
+        if key not in self.plans:
+            report_ID, size = key
+            bisect.insort(self.sizes.setdefault(report_ID, []), size)
+        self.plans[key] = plan
+
+    def __delitem__(self, key):
+        del self.plans[key]
+        report_ID, size = key
+        sizes = self.sizes[report_ID]
+        sizes.pop(bisect.bisect_left(sizes, size))
+        if not sizes:
+            del self.sizes[report_ID]
+
+    def clear(self):
+        self.plans.clear()
+        self.sizes.clear()
+
+    def __iter__(self):
+        return iter(self.plans)
+
+    def __len__(self):
+        return len(self.plans)
+
+    def __repr__(self):
+        return f'ReportIndex({self.plans!r})'
+
+
+def update_rdesc_dict(rdesc_object, rdesc_dict, usages=None):
+    """
+    Store the decode plans of the given report descriptor in rdesc_dict,
+    a ReportIndex. If usages is given, the plans only decode these usages.
+    Returns True if some reports of the device are not numbered.
+    """
+    maybe_numbered = False
+    for (report_ID, size), plan in rdesc_object.plans(usages).items():
+        if report_ID == -1:
+            maybe_numbered = True
+        rdesc_dict[build_rkey(report_ID, size)] = plan
+    return maybe_numbered
+
+
+def find_rkey(report_ID, size, rdesc_dict, maybe_numbered):
+    """
+    Return the key in rdesc_dict of the layout matching a report of the
+    given size starting with report_ID, or None.
+    """
+    key = (report_ID, size)
+    if key in rdesc_dict:
+        return key
+    if maybe_numbered:
         # the report is maybe not numbered
-        numbered = False
-        key = build_rkey(-1, size)
-    if key not in rdesc_dict:
-        # mabe the report is larger than it should
-        key = None
-        current_size = 0
-        for k in list(rdesc_dict.keys()):
-            id, id_size = k.split(":")
-            id = int(id)
-            id_size = int(id_size)
-            if id == report[0] and id_size < size and current_size < size:
-                current_size = id_size
-                key = k
+        key = (-1, size)
+        if key in rdesc_dict:
+            return key
+    # maybe the report is larger than it should, take the largest declared
+    # size below the actual one
+    for id in (report_ID, -1) if maybe_numbered else (report_ID,):
+        sizes = rdesc_dict.sizes.get(id)
+        if sizes:
+            i = bisect.bisect_left(sizes, size)
+            if i:
+                return (id, sizes[i - 1])
+    return None
+
+
+def parse_event(line, rdesc, rdesc_dict, maybe_numbered):
+    timestamp, size, report = recording.split_event(line)
+    key = find_rkey(report[0], size, rdesc_dict, maybe_numbered)
     if key in rdesc_dict:
-        return get_report(time, report, rdesc_dict[key], numbered)
+        time = recording.format_time(timestamp)
+        return get_report(time, report, rdesc_dict[key])
     return None
 
 
+def _column_dtype(size, signed):
+    for bits in (8, 16, 32):
+        if size <= bits:
+            break
+    else:
+        bits = 64
+    return numpy.dtype(f'{"int" if signed else "uint"}{bits}')
+
+
+def _extract_column(data, offset, size, signed):
+    """
+    Extract the value stored at the given bit offset of each row of data,
+    a 2-D array of uint8 with one report per row.
+    """
+    first = offset >> 3
+    last = (offset + size - 1) >> 3
+    shift = offset & 0x7
+    value = numpy.zeros(len(data), dtype=numpy.uint64)
+    for i in range(min(last - first + 1, 8)):
+        value |= data[:, first + i].astype(numpy.uint64) << numpy.uint64(8 * i)
+    value >>= numpy.uint64(shift)
+    if last - first == 8:
+        # unaligned 64 bits value, the high bits are in a 9th byte
+        high = data[:, last].astype(numpy.uint64)
+        value |= high << numpy.uint64(64 - shift)
+    if size < 64:
+        value &= numpy.uint64((1 << size) - 1)
+    if signed:
+        value = value.astype(numpy.int64)
+        if size < 64:
+            sign = numpy.int64(1 << (size - 1))
+            value = (value ^ sign) - sign
+    return value.astype(_column_dtype(size, signed))
+
+
+def _extract_wide_column(reports, offset, size, signed):
+    """
+    Same as _extract_column() for values wider than 64 bits, which do not
+    fit in a numpy integer: the column holds python ints.
+    """
+    mask = (1 << size) - 1
+    sign = 1 << (size - 1)
+    values = []
+    for report in reports:
+        value = (int.from_bytes(report, 'little') >> offset) & mask
+        if signed:
+            value = (value ^ sign) - sign
+        values.append(value)
+    return numpy.array(values, dtype=object)
+
+
+def get_columns(plan, timestamps, reports):
+    """
+    Decode all the reports of a same layout at once.
+
+    reports is the list of the raw reports as bytes. Returns a dict of
+    numpy arrays: "timestamp" in microseconds, then one column per usage.
+    Array fields give a 2-D column with one raw value per report count.
+    The columns are named after the fields of the plan. The fields wider
+    than 64 bits give columns of python ints (dtype object).
+    """
+    if numpy is None:
+        raise ImportError("numpy is required to decode events in batch")
+    width = 0
+    for field in plan.data_fields:
+        width = max(width, (field.offset + field.size * field.count + 7) >> 3)
+
+    buf = bytearray()
+    for report in reports:
+        report = report[:width]
+        buf += report
+        if len(report) < width:
+            buf += bytes(width - len(report))
+    data = numpy.frombuffer(bytes(buf), dtype=numpy.uint8)
+    data = data.reshape(len(reports), width)
+
+    columns = {"timestamp": numpy.array(timestamps, dtype=numpy.int64)}
+    for field in plan.data_fields:
+        if field.size > 64:
+            values = [_extract_wide_column(reports, field.offset +
+                                           i * field.size, field.size,
+                                           field.signed)
+                      for i in range(field.count)]
+        else:
+            values = [_extract_column(data, field.offset + i * field.size,
+                                      field.size, field.signed)
+                      for i in range(field.count)]
+        if field.array:
+            columns[field.name] = numpy.stack(values, axis=1)
+        else:
+            columns[field.name] = values[0]
+    return columns
+
+
+def parse_events(lines, rdesc_dict, maybe_numbered):
+    """
+    Batch decode all the E: lines of the given iterable of lines.
+    The events are grouped by report layout and each group is decoded
+    with get_columns().
+    Returns a dict of columns indexed by the rdesc_dict key of the layout.
+    """
+    groups = {}
+    for line in lines:
+        if not line.startswith("E:"):
+            continue
+        timestamp, size, report = recording.split_event(line)
+        key = find_rkey(report[0], size, rdesc_dict, maybe_numbered)
+        if key not in rdesc_dict:
+            continue
+        try:
+            timestamps, reports = groups[key]
+        except KeyError:
+            timestamps, reports = groups[key] = [], []
+        timestamps.append(timestamp)
+        reports.append(report)
+    return {key: get_columns(rdesc_dict[key], timestamps, reports)
+            for key, (timestamps, reports) in groups.items()}
+
+
 def dump_report(line, rdesc, rdesc_dict, maybe_numbered, f_out):
     """
     Translate the given report to a human readable format.
@@ -183,46 +306,938 @@ def dump_report(line, rdesc, rdesc_dict, maybe_numbered, f_out):
         f_out.write("\n")
 
 
-def parse_hid(f_in, f_out):
-    rdesc_dict = {}
-    rdesc = None
-    maybe_numbered = False
+class Descriptor(object):
+    """
+    A report descriptor found in a recording.
+    """
+    __slots__ = ("device", "rdesc_object")
+
+    def __init__(self, device, rdesc_object):
+        self.device = device
+        self.rdesc_object = rdesc_object
+
+
+class Event(object):
+    """
+    A decoded event of a recording.
+
+    timestamp is in microseconds, report_ID is -1 for reports that are not
+    numbered. The values of the event are only decoded when accessed.
+    """
+    __slots__ = ("timestamp", "device", "report_ID", "report", "plan")
+
+    def __init__(self, timestamp, device, report, plan):
+        self.timestamp = timestamp
+        self.device = device
+        self.report_ID = plan.report_ID
+        self.report = report
+        self.plan = plan
+
+    @property
+    def values(self):
+        """
+        The dict of the values of the event, indexed by usage name.
+        Array fields give the list of their active usages.
+        """
+        return self.plan.values(self.report)
+
+    def __repr__(self):
+        return (f'Event({recording.format_time(self.timestamp)}, '
+                f'device={self.device}, report_ID={self.report_ID}, '
+                f'{self.values!r})')
+
+
+class Repeat(object):
+    """
+    An event repeated count times, every interval microseconds. event is
+    the first repetition, the others are only generated when iterating
+    over events().
+    """
+    __slots__ = ("event", "count", "interval")
+
+    def __init__(self, event, count, interval):
+        self.event = event
+        self.count = count
+        self.interval = interval
+
+    def events(self):
+        event = self.event
+        for i in range(self.count):
+            yield Event(event.timestamp + i * self.interval, event.device,
+                        event.report, event.plan)
+
+
+class Change(object):
+    """
+    The fields of an event which differ from the previous report with the
+    same report ID of the device.
+
+    changes is a list of (field, value) for the Variable fields, and of
+    (field, pressed, released) for the Array fields, pressed and released
+    being the lists of usages which appeared or disappeared. The empty
+    slots of the Array fields are neither pressed nor released.
+    """
+    __slots__ = ("timestamp", "device", "report_ID", "plan", "changes")
+
+    def __init__(self, event, values, previous=None):
+        self.timestamp = event.timestamp
+        self.device = event.device
+        self.report_ID = event.report_ID
+        self.plan = event.plan
+        self.changes = []
+        for field in self.plan.data_fields:
+            if field.array:
+                end = field.index + field.count
+                new = values[field.index:end]
+                old = previous[field.index:end] if previous else ()
+                if new == old:
+                    continue
+                new = self.active_usages(field, new)
+                old = self.active_usages(field, old)
+                pressed = [u for u in new if u not in old]
+                released = [u for u in old if u not in new]
+                if pressed or released:
+                    self.changes.append((field, pressed, released))
+            else:
+                value = values[field.index]
+                if previous is None or previous[field.index] != value:
+                    self.changes.append((field, value))
+
+    @staticmethod
+    def active_usages(field, values):
+        usages = {}
+        for v in values:
+            if not isinstance(v, str):
+                v = field.active_name(v)
+                if v:
+                    usages[v] = True
+        return usages
+
+    def __repr__(self):
+        changes = []
+        for change in self.changes:
+            if len(change) == 2:
+                changes.append(f'{change[0].name}={change[1]!r}')
+            else:
+                field, pressed, released = change
+                changes.append(f'{field.name}=+{pressed!r}-{released!r}')
+        return (f'Change({recording.format_time(self.timestamp)}, '
+                f'device={self.device}, report_ID={self.report_ID}, '
+                f'{", ".join(changes)})')
+
+
+def get_change(time, change):
+    """
+    Translate the given Change to a human readable format.
+    """
+    output = f'{time:>10s} '
+    if change.plan.numbered:
+        output += f'ReportID: {change.report_ID} '
+    fields = []
+    for c in change.changes:
+        field = c[0]
+        if len(c) == 2:
+            value = c[1]
+            if not isinstance(value, str):
+                value = field.value_format.format(value)
+            fields.append(f'{field.name}: {value}')
+        else:
+            field, pressed, released = c
+            text = field.name
+            if pressed:
+                text += f' +[{", ".join(pressed)}]'
+            if released:
+                text += f' -[{", ".join(released)}]'
+            fields.append(text)
+    sep = '/ ' if change.plan.numbered else ''
+    return f'{output}{sep}{" | ".join(fields)}'
+
+
+def delta_records(records):
+    """
+    Replace the Event objects given by read_records() by Change objects
+    holding only the fields which changed since the previous report of the
+    same report ID of the device. The other records are passed through.
+
+    The raw reports are compared first, so repeated reports are dropped
+    without being decoded, as are the reports where only constant or
+    unselected bits changed.
+    """
+    last = {}
+    for record in records:
+        if isinstance(record, Repeat):
+            # the repetitions are identical to the first one, only the
+            # first one may have changed
+            record = record.event
+        if isinstance(record, Event):
+            key = (record.device, record.report_ID)
+            previous = last.get(key)
+            if previous is not None and previous[0] == record.report:
+                continue
+            values = record.plan.decode(record.report)
+            last[key] = (record.report, record.plan, values)
+            if previous is not None and previous[1] is not record.plan:
+                # the layout changed, all the fields are new
+                previous = None
+            change = Change(record, values, previous and previous[2])
+            if change.changes:
+                yield change
+        else:
+            if isinstance(record, Descriptor):
+                # new layouts, the previous reports of the device are stale
+                last = {k: v for k, v in last.items()
+                        if k[0] != record.device}
+            yield record
+
+
+_rdesc_objects = {}
+
+
+def load_rdesc(rdesc):
+    """
+    Return the parsed ReportDescriptor of the given bytes. Descriptors are
+    only parsed once per process.
+    """
+    try:
+        return _rdesc_objects[rdesc]
+    except KeyError:
+        rdesc_object = rdesc_cache.parse_bytes(rdesc)
+        _rdesc_objects[rdesc] = rdesc_object
+        return rdesc_object
+
+
+def load_layouts(rdesc_object, usages=None):
+    """
+    Return the layouts of a device: the ReportIndex of the plans of its
+    report descriptor, and whether some reports are not numbered.
+    """
+    rdesc_dict = ReportIndex()
+    maybe_numbered = update_rdesc_dict(rdesc_object, rdesc_dict, usages)
+    return rdesc_dict, maybe_numbered
+
+
+def read_records(f_in, rdescs=(), device=0, devices=None, usages=None,
+                 layouts=None):
+    """
+    Read a recording and yield its content, one record at a time:
+     - a Descriptor for each R: line
+     - an Event for each E: line matching a known report
+     - the line itself for any other line
+
+    Each device of the recording (switched by the D: lines) gets its own
+    layouts, given by its last R: line.
+
+    rdescs and device give the state of the decoder when f_in does not start
+    at the beginning of the recording: the (device, report descriptor)
+    pairs already seen, the descriptors being bytes, and the current device
+    index. layouts may give some of them already loaded, as a dict of the
+    load_layouts() of each device.
+    If devices is not None, only the events and descriptors of the devices
+    it contains are decoded.
+    If usages is not None, only the fields of these usages are decoded, and
+    the events without any of them are skipped.
+    """
+    layouts = dict(layouts) if layouts else {}
+    for dev, rdesc in rdescs:
+        layouts[dev] = load_layouts(load_rdesc(rdesc), usages)
     while True:
         try:
             line = f_in.readline()
         except KeyboardInterrupt:
             break
-        if line.startswith("R:"):
-            rdesc_object = parse_rdesc.parse_rdesc(line.lstrip("R: "), f_out)
-            rdesc = rdesc_object.reports
-            win8 = rdesc_object.win8
-            for k in list(rdesc.keys()):
-                if len(rdesc[k][0]):
-                    if k == -1:
-                        maybe_numbered = True
-                    key = build_rkey(k, rdesc[k][1])
-                    rdesc_dict[key] = rdesc[k][0]
-            if win8:
-                f_out.write("**** win 8 certified ****\n")
-        elif line.startswith("E:"):
-            dump_report(line, rdesc, rdesc_dict, maybe_numbered, f_out)
+        if line.startswith("E:"):
+            if devices is not None and device not in devices:
+                continue
+            try:
+                rdesc_dict, maybe_numbered = layouts[device]
+            except KeyError:
+                continue
+            timestamp, size, report = recording.split_event(line)
+            key = find_rkey(report[0], size, rdesc_dict, maybe_numbered)
+            if key in rdesc_dict:
+                plan = rdesc_dict[key]
+                if usages is not None and not plan.fields:
+                    continue
+                yield Event(timestamp, device, report, plan)
+        elif line.startswith("R:"):
+            if devices is not None and device not in devices:
+                continue
+            size, rdesc = recording.split_rdesc(line)
+            rdesc_object = load_rdesc(rdesc)
+            layouts[device] = load_layouts(rdesc_object, usages)
+            yield Descriptor(device, rdesc_object)
         elif line == '':
             # End of file
             break
-        elif line.startswith("N:") or \
-                line.startswith("P:") or \
-                line.startswith("I:"):
+        else:
+            if line.startswith("D:"):
+                device = int(line[2:])
+            yield line
+
+
+def read_binary_records(data, devices=None, usages=None):
+    """
+    Same as read_records() for data, the content of a binary recording
+    (see hidbin). The header lines are given back in their text form, and
+    the repeated events as Repeat objects.
+    """
+    yield from decode_records(hidbin.read_records(data), devices, usages)
+
+
+def decode_records(records, devices=None, usages=None):
+    """
+    Same as read_binary_records() for records already split, given as the
+    (tag, device, timestamp, payload) tuples of hidbin.read_records(). The
+    payloads may be bytes or memoryviews.
+
+    The E:, R: and D: lines stored verbatim in 'T' records are decoded as
+    read_records() does.
+    """
+    layouts = {}
+    current = 0
+    for tag, device, timestamp, payload in records:
+        size = None
+        if tag == hidbin.TEXT:
+            line = bytes(payload).decode()
+            if line.startswith("E:"):
+                timestamp, size, payload = recording.split_event(line)
+                tag = hidbin.EVENT
+                device = current
+            elif line.startswith("R:"):
+                payload = recording.split_rdesc(line)[1]
+                tag = hidbin.RDESC
+                device = current
+            else:
+                if line.startswith("D:"):
+                    current = int(line[2:])
+                yield line
+                continue
+        elif tag == hidbin.DEVICE:
+            current = device
+        if tag == hidbin.EVENT or tag == hidbin.REPEAT:
+            if devices is not None and device not in devices:
+                continue
+            try:
+                rdesc_dict, maybe_numbered = layouts[device]
+            except KeyError:
+                continue
+            if tag == hidbin.REPEAT:
+                payload, count, interval = payload
+            report = bytes(payload)
+            if size is None:
+                size = len(report)
+            key = find_rkey(report[0], size, rdesc_dict, maybe_numbered)
+            if key in rdesc_dict:
+                plan = rdesc_dict[key]
+                if usages is not None and not plan.fields:
+                    continue
+                event = Event(timestamp, device, report, plan)
+                if tag == hidbin.REPEAT:
+                    event = Repeat(event, count, interval)
+                yield event
+        elif tag == hidbin.RDESC:
+            if devices is not None and device not in devices:
+                continue
+            rdesc_object = load_rdesc(bytes(payload))
+            layouts[device] = load_layouts(rdesc_object, usages)
+            yield Descriptor(device, rdesc_object)
+        else:
+            line = hidbin.format_record(tag, device, timestamp, payload)
+            yield line.decode()
+
+
+def select_time(records, start=None, end=None):
+    """
+    Only keep the records of the events between the timestamps start and
+    end, in microseconds. Timestamps are expected to be increasing.
+
+    The records before start are dropped, except for the report descriptors
+    in use at that point which are given first, each one after a D: line if
+    there are several devices.
+    """
+    descriptors = {} if start is not None else None
+    for record in records:
+        if isinstance(record, Repeat):
+            event = record.event
+            first = 0
+            if start is not None and event.timestamp < start:
+                first = -((event.timestamp - start) // record.interval) \
+                    if record.interval else record.count
+            last = record.count
+            if end is not None and \
+                    event.timestamp + (last - 1) * record.interval > end:
+                last = (end - event.timestamp) // record.interval + 1 \
+                    if record.interval else 0
+            if first >= last:
+                if end is not None and event.timestamp > end:
+                    break
+                continue
+            if first or last != record.count:
+                event = Event(event.timestamp + first * record.interval,
+                              event.device, event.report, event.plan)
+                record = Repeat(event, last - first, record.interval)
+        elif isinstance(record, Event):
+            if start is not None and record.timestamp < start:
+                continue
+            if end is not None and record.timestamp > end:
+                break
+            event = record
+        elif descriptors is not None:
+            if isinstance(record, Descriptor):
+                descriptors[record.device] = record
+            continue
+        else:
+            yield record
+            continue
+        if descriptors is not None:
+            # first selected event, give the state of the devices
+            several = len(descriptors) > 1
+            for device, descriptor in sorted(descriptors.items()):
+                if several:
+                    yield f'D: {device}\n'
+                yield descriptor
+            if several:
+                yield f'D: {event.device}\n'
+            descriptors = None
+        yield record
+
+
+def read_range(filename, start=None, end=None, usages=None):
+    """
+    Same as select_time(read_records()) on the given recording.
+
+    The sidecar index of the recording (see recording_index) is used to
+    start reading at the last checkpoint before start. Compressed
+    recordings can not be indexed and are read from the beginning, as are
+    the binary ones.
+    """
+    with recording.open_recording(filename, 'rb') as f:
+        binary = hidbin.is_binary(f.read(len(hidbin.MAGIC)))
+    if binary or recording.is_compressed(filename):
+        with recording.open_recording(filename, 'rb') as f:
+            yield from select_time(read_any_records(f, usages), start, end)
+        return
+    checkpoint = None
+    if start is not None:
+        index = recording_index.get_index(filename)
+        checkpoint = index.find_time(start)
+    with open(filename, 'rb') as f:
+        rdescs, device = (), 0
+        if checkpoint is not None:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                rdescs, device = index.decoder_state(data, checkpoint)
+            f.seek(checkpoint[1])
+        records = itertools.chain(
+            (Descriptor(dev, load_rdesc(rdesc)) for dev, rdesc in rdescs),
+            read_records(io.TextIOWrapper(f), rdescs, device, usages=usages))
+        yield from select_time(records, start, end)
+
+
+def read_any_records(f_in, usages=None):
+    """
+    Same as read_records(), but f_in is either a text file, or a binary file
+    holding a text or a binary recording (see hidbin). f_in is not closed.
+    """
+    if isinstance(f_in, io.TextIOBase):
+        yield from read_records(f_in, usages=usages)
+        return
+    wrappers = []
+    if not hasattr(f_in, 'peek'):
+        f_in = io.BufferedReader(f_in)
+        wrappers.append(f_in)
+    try:
+        if hidbin.is_binary(f_in.peek(len(hidbin.MAGIC))):
+            yield from read_binary_records(f_in.read(), usages=usages)
+        else:
+            f_in = io.TextIOWrapper(f_in)
+            wrappers.append(f_in)
+            yield from read_records(f_in, usages=usages)
+    finally:
+        # the wrappers would close f_in with them
+        for wrapper in reversed(wrappers):
+            wrapper.detach()
+
+
+def read_events(f_in, usages=None):
+    """
+    Read a recording and yield the decoded Event objects only, the repeated
+    events being expanded. f_in is given to read_any_records().
+    """
+    for record in read_any_records(f_in, usages):
+        if isinstance(record, Event):
+            yield record
+        elif isinstance(record, Repeat):
+            yield from record.events()
+
+
+def write_records(records, f_out):
+    """
+    Write the given records in a human readable format.
+    """
+    for record in records:
+        if isinstance(record, Event):
+            time = recording.format_time(record.timestamp)
+            f_out.write(get_report(time, record.report, record.plan))
+            f_out.write("\n")
+        elif isinstance(record, Change):
+            time = recording.format_time(record.timestamp)
+            f_out.write(get_change(time, record))
+            f_out.write("\n")
+        elif isinstance(record, Repeat):
+            # the report is only translated once, the repetitions only
+            # differ by their timestamp
+            event = record.event
+            width = None
+            for i in range(record.count):
+                time = recording.format_time(event.timestamp +
+                                             i * record.interval)
+                if len(time) != width:
+                    width = len(time)
+                    text = get_report(time, event.report, event.plan)
+                    report = text[max(width, 10):]
+                    f_out.write(text)
+                else:
+                    f_out.write(f'{time:>10s}')
+                    f_out.write(report)
+                f_out.write("\n")
+        elif isinstance(record, Descriptor):
+            record.rdesc_object.dump(f_out)
+            if record.rdesc_object.win8:
+                f_out.write("**** win 8 certified ****\n")
+        elif record.startswith("N:") or \
+                record.startswith("P:") or \
+                record.startswith("I:"):
+            continue
+        else:
+            f_out.write(record)
+
+
+def parse_hid(f_in, f_out, usages=None, delta=False):
+    records = read_records(f_in, usages=usages)
+    if delta:
+        records = delta_records(records)
+    write_records(records, f_out)
+
+
+def parse_hid_stats(f_in, f_out, burst_rate=report_stats.DEFAULT_BURST_RATE):
+    """
+    Print the timing statistics of the reports of each device instead of
+    the reports themselves. The reports are not decoded.
+    """
+    write_stats(read_records(f_in), f_out, burst_rate)
+
+
+def write_stats(records, f_out, burst_rate=report_stats.DEFAULT_BURST_RATE):
+    """
+    Print the timing statistics of the events of the given records.
+    """
+    stats = report_stats.RecordingStats(burst_rate)
+    for record in records:
+        if isinstance(record, Event):
+            stats.add(record)
+        elif isinstance(record, Repeat):
+            stats.add_repeat(record.event, record.count, record.interval)
+    stats.dump(f_out)
+
+
+def write_output(records, f_out, delta=False, stats=False,
+                 burst_rate=report_stats.DEFAULT_BURST_RATE):
+    """
+    Write the given records as parse_hid() would, or their statistics if
+    stats is set.
+    """
+    if stats:
+        write_stats(records, f_out, burst_rate)
+        return
+    if delta:
+        records = delta_records(records)
+    write_records(records, f_out)
+
+
+def parse_hid_binary(filename, f_out, usages=None, delta=False, stats=False,
+                     burst_rate=report_stats.DEFAULT_BURST_RATE,
+                     start=None, end=None):
+    """
+    Same as parse_hid(), or parse_hid_stats() if stats is set, for a binary
+    recording.
+    """
+    if recording.is_compressed(filename):
+        with recording.open_recording(filename, 'rb') as f:
+            data = f.read()
+        records = select_time(read_binary_records(data, usages=usages),
+                              start, end)
+        write_output(records, f_out, delta, stats, burst_rate)
+        return
+    with open(filename, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        records = select_time(read_binary_records(data, usages=usages),
+                              start, end)
+        try:
+            write_output(records, f_out, delta, stats, burst_rate)
+        finally:
+            # release the memoryviews on data before closing it
+            records.close()
+
+
+def scan_recording(data):
+    """
+    Find the headers of data, the content of a recording, without decoding
+    it. Returns:
+     - the list of (position, device, report descriptor) of the R: lines
+     - the list of (position, device) of the D: lines
+    """
+    def find_lines(prefix):
+        positions = []
+        if data[:len(prefix)] == prefix:
+            positions.append(0)
+        pos = data.find(b'\n' + prefix)
+        while pos >= 0:
+            positions.append(pos + 1)
+            pos = data.find(b'\n' + prefix, pos + 1)
+        return positions
+
+    def read_line(pos):
+        end = data.find(b'\n', pos)
+        return data[pos:end if end >= 0 else len(data)]
+
+    device_lines = [(pos, int(read_line(pos)[2:]))
+                    for pos in find_lines(b'D:')]
+    rdesc_lines = []
+    for pos in find_lines(b'R:'):
+        i = bisect.bisect_left(device_lines, (pos, -1))
+        device = device_lines[i - 1][1] if i else 0
+        rdesc = recording.split_rdesc(read_line(pos))[1]
+        rdesc_lines.append((pos, device, rdesc))
+    return rdesc_lines, device_lines
+
+
+def split_recording(data, chunk_size, headers=None):
+    """
+    Split data, the content of a recording, into chunks of about chunk_size
+    bytes aligned on line boundaries.
+    Yields (start, end, rdescs, device) for each chunk, rdescs and device
+    being the state of the decoder at the beginning of the chunk (see
+    read_records()).
+    headers is the result of scan_recording(data), if already known.
+    """
+    if headers is None:
+        headers = scan_recording(data)
+    rdesc_lines, device_lines = headers
+
+    start = 0
+    while start < len(data):
+        end = data.find(b'\n', start + chunk_size)
+        end = len(data) if end < 0 else end + 1
+        rdescs = {}
+        for pos, device, rdesc in rdesc_lines:
+            if pos < start:
+                rdescs[device] = rdesc
+        i = bisect.bisect_left(device_lines, (start, -1))
+        device = device_lines[i - 1][1] if i else 0
+        yield start, end, list(rdescs.items()), device
+        start = end
+
+
+# the state of the processes of parse_hid_parallel(): the recording, the
+# usages to decode and the layouts of each distinct report descriptor
+_decoder = None
+
+
+def _init_decoder(filename, rdescs, usages):
+    global _decoder
+    layouts = [load_layouts(load_rdesc(rdesc), usages) for rdesc in rdescs]
+    _decoder = open(filename, 'rb'), usages, layouts
+
+
+def _decode_chunk(args):
+    start, end, device_layouts, device = args
+    f, usages, layouts = _decoder
+    f.seek(start)
+    # same newline handling as the text file of parse_hid()
+    f_in = io.TextIOWrapper(io.BytesIO(f.read(end - start)))
+    f_out = io.StringIO()
+    records = read_records(f_in, device=device, usages=usages,
+                           layouts={dev: layouts[i]
+                                    for dev, i in device_layouts})
+    write_records(records, f_out)
+    return f_out.getvalue()
+
+
+def parse_hid_parallel(filename, f_out, jobs=None, chunk_size=4 << 20,
+                       usages=None):
+    """
+    Same as parse_hid(), but the recording is split into chunks of about
+    chunk_size bytes decoded in a pool of jobs processes, at most a few
+    chunks per process being in flight.
+    The output is identical to the one of parse_hid().
+    """
+    jobs = jobs or os.cpu_count() or 1
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            headers = scan_recording(data)
+            # each process loads the distinct descriptors once, the chunks
+            # only give their index
+            indexes = {}
+            for pos, device, rdesc in headers[0]:
+                indexes.setdefault(rdesc, len(indexes))
+            with multiprocessing.Pool(jobs, _init_decoder,
+                                      (filename, list(indexes),
+                                       usages)) as pool:
+                pending = collections.deque()
+                for start, end, rdescs, device in \
+                        split_recording(data, chunk_size, headers):
+                    if len(pending) >= 2 * jobs:
+                        f_out.write(pending.popleft().get())
+                    task = (start, end,
+                            [(dev, indexes[rdesc]) for dev, rdesc in rdescs],
+                            device)
+                    pending.append(pool.apply_async(_decode_chunk, (task,)))
+                while pending:
+                    f_out.write(pending.popleft().get())
+
+
+class _SegmentReader(io.RawIOBase):
+    """
+    Read the given (start, end) ranges of f, a binary file, one after the
+    other as a single stream.
+    """
+
+    def __init__(self, f, segments):
+        super().__init__()
+        self.f = f
+        self.segments = collections.deque(segments)
+        self.pos = 0
+        self.end = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.pos >= self.end:
+            if not self.segments:
+                return 0
+            self.pos, self.end = self.segments.popleft()
+            self.f.seek(self.pos)
+        n = self.f.readinto(memoryview(b)[:self.end - self.pos])
+        if not n:
+            # truncated file
+            self.pos = self.end
+            return self.readinto(b)
+        self.pos += n
+        return n
+
+
+def device_segments(data, device_lines):
+    """
+    Return the (start, end) ranges of data, the content of a recording,
+    where each device is the current one, as a dict indexed by device.
+    device_lines is the list of the (position, device) of the D: lines.
+    """
+    segments = {}
+    bounds = [(0, 0)] + device_lines + [(len(data), None)]
+    for (start, device), (end, next_device) in zip(bounds, bounds[1:]):
+        if start == end:
             continue
+        ranges = segments.setdefault(device, [])
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
         else:
-            f_out.write(line)
+            ranges.append((start, end))
+    return segments
+
+
+def _dump_pending(pending, timestamp, f_out):
+    text = ''.join(pending)
+    if text.endswith('\n'):
+        text = text[:-1]
+    pickle.dump((timestamp, text), f_out)
+
+
+def _decode_device(args):
+    filename, device, segments, path, usages, delta = args
+    with open(filename, 'rb') as f, open(path, 'wb') as f_out:
+        # same newline handling as the text file of parse_hid()
+        f_in = io.TextIOWrapper(io.BufferedReader(_SegmentReader(f,
+                                                                 segments)))
+        records = read_records(f_in, devices={device}, usages=usages)
+        if delta:
+            records = delta_records(records)
+        # the other records are written before the next event
+        pending = []
+        first_rdesc = True
+        timestamp = 0
+        for record in records:
+            if isinstance(record, Event):
+                timestamp = record.timestamp
+                time = recording.format_time(record.timestamp)
+                text = get_report(time, record.report, record.plan)
+            elif isinstance(record, Change):
+                timestamp = record.timestamp
+                time = recording.format_time(record.timestamp)
+                text = get_change(time, record)
+            elif isinstance(record, Descriptor) and first_rdesc:
+                # already dumped in the headers
+                first_rdesc = False
+                continue
+            elif isinstance(record, str) and record.startswith("D:"):
+                continue
+            else:
+                output = io.StringIO()
+                write_records([record], output)
+                if output.tell():
+                    pending.append(output.getvalue())
+                continue
+            if pending:
+                _dump_pending(pending, timestamp, f_out)
+                pending = []
+            pickle.dump((timestamp, text), f_out)
+        if pending:
+            _dump_pending(pending, timestamp, f_out)
+    return path
+
+
+def _load_records(path, device):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                timestamp, text = pickle.load(f)
+            except EOFError:
+                break
+            yield timestamp, device, text
+
+
+def parse_hid_devices(filename, f_out, jobs=None, usages=None, delta=False):
+    """
+    Decode each device of a multi-device recording in its own process,
+    and merge the events of all the devices by timestamp.
+    The first report descriptor of each device is dumped first, then the
+    events, a D: line being written each time the device changes. The
+    comments and the later report descriptors of a device are written
+    before its next event.
+    """
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # a single scan of the recording, each process only reads the
+            # parts of its device
+            rdesc_lines, device_lines = scan_recording(data)
+            segments = device_segments(data, device_lines)
+    rdescs = {}
+    for pos, device, rdesc in rdesc_lines:
+        rdescs.setdefault(device, rdesc)
+    devices = sorted(rdescs)
+    for device in devices:
+        f_out.write(f'D: {device}\n')
+        rdesc_object = load_rdesc(rdescs[device])
+        rdesc_object.dump(f_out)
+        if rdesc_object.win8:
+            f_out.write("**** win 8 certified ****\n")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tasks = [(filename, device, segments[device],
+                  os.path.join(tmpdir, str(device)), usages, delta)
+                 for device in devices]
+        with multiprocessing.Pool(jobs) as pool:
+            paths = pool.map(_decode_device, tasks)
+        streams = [_load_records(path, device)
+                   for device, path in zip(devices, paths)]
+        current = None
+        for timestamp, device, text in heapq.merge(*streams):
+            if device != current:
+                f_out.write(f'D: {device}\n')
+                current = device
+            f_out.write(text)
+            f_out.write("\n")
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description="Translate a hid-recorder recording into a human "
+                    "readable format.")
+    parser.add_argument("file", nargs="?",
+                        help="the recording, read from stdin if omitted")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes decoding the recording "
+                             "in parallel (0 for one per CPU)")
+    parser.add_argument("--per-device", action="store_true",
+                        help="decode each device in its own process and "
+                             "merge their events by timestamp")
+    parser.add_argument("-u", "--usages",
+                        type=lambda s: [u.strip() for u in s.split(",")],
+                        help="only decode the given comma separated usages, "
+                             "e.g. 'X,Y,Contact Id,Tip Switch'")
+    parser.add_argument("--delta", action="store_true",
+                        help="only print the fields which changed since "
+                             "the previous report with the same report ID "
+                             "(not split in chunks with --jobs)")
+    parser.add_argument("--stats", action="store_true",
+                        help="print the timing statistics of the reports "
+                             "of each device instead of the reports")
+    parser.add_argument("--burst-rate", type=float,
+                        default=report_stats.DEFAULT_BURST_RATE,
+                        help="report rate in Hz above which events are "
+                             "considered as a burst in --stats "
+                             "(default: %(default)s)")
+    parser.add_argument("--start", type=recording.parse_time,
+                        help="only decode the events from this timestamp, "
+                             "in seconds (the sidecar index of the "
+                             "recording is used to jump there)")
+    parser.add_argument("--end", type=recording.parse_time,
+                        help="only decode the events until this timestamp, "
+                             "in seconds")
+    return parser.parse_args()
 
 
 def main():
+    options = get_options()
+    ranged = options.start is not None or options.end is not None
+    compressed = False
+    if options.file:
+        compressed = recording.is_compressed(options.file)
+        with recording.open_recording(options.file, 'rb') as f:
+            binary = hidbin.is_binary(f.read(len(hidbin.MAGIC)))
+        if binary:
+            parse_hid_binary(options.file, sys.stdout, options.usages,
+                             options.delta, options.stats,
+                             options.burst_rate, options.start, options.end)
+            return
+        if ranged:
+            records = read_range(options.file, options.start, options.end,
+                                 options.usages)
+            write_output(records, sys.stdout, options.delta, options.stats,
+                         options.burst_rate)
+            return
+    elif ranged:
+        records = select_time(read_records(sys.stdin, usages=options.usages),
+                              options.start, options.end)
+        write_output(records, sys.stdout, options.delta, options.stats,
+                     options.burst_rate)
+        return
+    if options.stats:
+        f = sys.stdin
+        if options.file:
+            f = recording.open_recording(options.file)
+        with f:
+            parse_hid_stats(f, sys.stdout, options.burst_rate)
+        return
+    # the parallel decoders need to seek in the recording
+    if options.file and not compressed and options.per_device:
+        parse_hid_devices(options.file, sys.stdout, options.jobs or None,
+                          options.usages, options.delta)
+        return
+    if options.file and not compressed and options.jobs != 1 and \
+            not options.delta:
+        parse_hid_parallel(options.file, sys.stdout, options.jobs or None,
+                           usages=options.usages)
+        return
     f = sys.stdin
-    if len(sys.argv) > 1:
-        f = open(sys.argv[1])
-    parse_hid(f, sys.stdout)
-    f.close()
+    if options.file:
+        f = recording.open_recording(options.file)
+    with f:
+        parse_hid(f, sys.stdout, options.usages, options.delta)
 
 
 if __name__ == "__main__":
@@ -21,7 +21,9 @@
 #
 
 import sys
+from collections.abc import Sequence
 import hid
+import recording
 
 
 def twos_comp(val, bits):
@@ -38,31 +40,58 @@ class ParseError(Exception):
     pass
 
 
+# sizes of the data of a short item, indexed by its 2 lowest bits
+ITEM_SIZES = (0, 1, 2, 4)
+
+# items whose data is a signed value
+SIGNED_ITEMS = ("Logical Minimum",
+                "Physical Minimum",
+                # "Logical Maximum",
+                # "Physical Maximum",
+                )
+
+
+def get_item(value):
+    """
+    Return the name of the item whose prefix is value, an int8.
+    """
+    try:
+        return hid.inv_hid[value & 0xfc]
+    except KeyError:
+        error = f'error while parsing {value:02x}'
+        if value & 0xfc == 0:
+            raise ParseError(error)
+        raise KeyError(error)
+
+
 class raw_item(object):
 
-    def __init__(self, value, index):
+    def __init__(self, value, index, payload=None):
         self.__parse(value)
         self.index_in_report = index
         self.data = None
+        if payload is not None:
+            # the whole payload is already known, no need to feed it
+            self.raw_value = payload
+            self.value = int.from_bytes(payload, "little")
+            self.index = 0
+            self.__finalize()
 
     def __parse(self, value):
         self.r = r = value
         self.raw_value = []
         self.hid = r & 0xfc
-        try:
-            self.item = hid.inv_hid[self.hid]
-        except:
-            error = f'error while parsing {value:02x}'
-            if self.hid == 0:
-                raise ParseError(error)
-            else:
-                raise KeyError(error)
-        self.rsize = r & 0x3
-        if self.rsize == 3:
-            self.rsize = 4
+        self.item = get_item(r)
+        self.rsize = ITEM_SIZES[r & 0x3]
         self.index = self.rsize
         self.value = 0
 
+    def __finalize(self):
+        if self.item in SIGNED_ITEMS:
+            self.twos_comp()
+        if self.item == "Unit Exponent" and self.value > 7:
+            self.value -= 16
+
     def feed(self, value):
         "return True if the value was accepted by the item"
         if self.index <= 0:
@@ -72,14 +101,7 @@ class raw_item(object):
         self.index -= 1
 
         if self.index == 0:
-            if self.item in ("Logical Minimum",
-                             "Physical Minimum",
-                             # "Logical Maximum",
-                             # "Physical Maximum",
-                             ):
-                self.twos_comp()
-            if self.item == "Unit Exponent" and self.value > 7:
-                self.value -= 16
+            self.__finalize()
 
     def completed(self):
         # if index is null, then we have consumed all the incoming data
@@ -101,6 +123,74 @@ class raw_item(object):
         return f'{r} {" ".join(data)}'
 
 
+class Usages(Sequence):
+    """
+    The usages of the count values of a Variable item: the usage of the
+    value i is usages[i], the last usage being repeated for the remaining
+    values.
+
+    usages is usually a range built from Usage Minimum and Usage Maximum,
+    so indexing and membership tests are O(1) whatever the range width.
+    """
+    __slots__ = ("usages", "count")
+
+    def __init__(self, usages, count):
+        self.usages = usages
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError("usage index out of range")
+        if not self.usages:
+            return 0
+        if index >= len(self.usages):
+            return self.usages[-1]
+        return self.usages[index]
+
+    def __contains__(self, usage):
+        if not self.count:
+            return False
+        if not self.usages:
+            return usage == 0
+        return usage in self.usages[:self.count]
+
+    def __repr__(self):
+        return f'Usages({self.usages!r}, {self.count})'
+
+
+class Field(object):
+    """
+    One Input main item of a report, as stored in ReportDescriptor.reports.
+    """
+    __slots__ = ("type", "usage_page", "logical_min", "logical_max",
+                 "size", "count", "usages")
+
+    def __init__(self, type, usage_page, logical_min, logical_max,
+                 size, count, usages=None):
+        self.type = type
+        self.usage_page = usage_page
+        self.logical_min = logical_min
+        self.logical_max = logical_max
+        self.size = size
+        self.count = count
+        self.usages = usages
+
+    def __repr__(self):
+        return (f'Field(type={self.type:#x}, '
+                f'usage_page={self.usage_page:#x}, '
+                f'logical_min={self.logical_min}, '
+                f'logical_max={self.logical_max}, '
+                f'size={self.size}, count={self.count}, '
+                f'usages={self.usages!r})')
+
+
 class ReportDescriptor(object):
 
     def __init__(self):
@@ -120,9 +210,32 @@ class ReportDescriptor(object):
         self.report = []
         self.report_ID = -1
         self.win8 = False
-        self.rdesc_items = []
+        self._rdesc_items = []
+        # chunks parsed by consume_bytes() whose items are not built yet
+        self._unbuilt = []
         self.r_size = 0
         self.current_item = None
+        self._plans = None
+
+    @property
+    def rdesc_items(self):
+        """
+        The raw_item list of the report descriptor. The items parsed by
+        consume_bytes() are only built on the first access, as they are
+        only needed to dump the report descriptor.
+        """
+        for data, index, usage_page, usage_page_list in self._unbuilt:
+            # replay the chunk to get the usage page of each item
+            rdesc_object = ReportDescriptor()
+            rdesc_object.usage_page = usage_page
+            rdesc_object.usage_page_list = usage_page_list
+            for i, size in rdesc_object.split_items(data):
+                payload = data[i + 1:i + 1 + size]
+                rdesc_object.append_item(raw_item(data[i], index + i,
+                                                  payload))
+            self._rdesc_items.extend(rdesc_object._rdesc_items)
+        self._unbuilt = []
+        return self._rdesc_items
 
     def consume(self, value, index):
         """ item is an int8 """
@@ -134,26 +247,78 @@ class ReportDescriptor(object):
             self.current_item.feed(value)
         if self.current_item.completed():
             rdesc_item = self.current_item
-            self.rdesc_items.append(rdesc_item)
-
-            self.parse_item(rdesc_item)
+            self.append_item(rdesc_item)
             self.current_item = None
 
             return rdesc_item
         return None
 
+    @staticmethod
+    def split_items(data):
+        """
+        Yield the position and the data size of each item of data.
+        """
+        end = len(data)
+        i = 0
+        while i < end:
+            value = data[i]
+            if i == end - 1 and value == 0:
+                # some device present a trailing 0, skipping it
+                break
+            size = ITEM_SIZES[value & 0x3]
+            if i + 1 + size > end:
+                # truncated item
+                break
+            yield i, size
+            i += 1 + size
+
+    def consume_bytes(self, data, index=1):
+        """
+        Parse all the items of data, a bytes-like object.
+        index is the position of the first byte of data in the report
+        descriptor.
+        """
+        data = bytes(data)
+        self._unbuilt.append((data, index, self.usage_page,
+                              list(self.usage_page_list)))
+        inv_hid = hid.inv_hid
+        parse_item = self.parse_item
+        # decode each item in place, without building its raw_item
+        for i, size in self.split_items(data):
+            value = data[i]
+            try:
+                item = inv_hid[value & 0xfc]
+            except KeyError:
+                item = get_item(value)
+            if size == 1:
+                value = data[i + 1]
+            else:
+                value = int.from_bytes(data[i + 1:i + 1 + size], "little")
+            if size and item in SIGNED_ITEMS:
+                value = twos_comp(value, size * 8)
+            elif item == "Unit Exponent" and value > 7:
+                value -= 16
+            parse_item(item, value)
+
+    def append_item(self, rdesc_item):
+        self.rdesc_items.append(rdesc_item)
+        # store current usage_page in rdesc_item
+        rdesc_item.usage_page = self.usage_page
+        rdesc_item.data = self.parse_item(rdesc_item.item, rdesc_item.value,
+                                          rdesc_item)
+
     def close_rdesc(self):
         if self.report_ID and self.r_size > 8:
             self.reports[self.report_ID] = self.report, (self.r_size >> 3)
             self.report = []
             self.r_size = 0
 
-    def parse_item(self, rdesc_item):
-        # store current usage_page in rdesc_item
-        rdesc_item.usage_page = self.usage_page
-        item = rdesc_item.item
-        value = rdesc_item.value
-
+    def parse_item(self, item, value, rdesc_item=None):
+        """
+        Update the parser state with the given item, its name and its
+        decoded value. Return the Field of an Input item, None otherwise.
+        """
+        field = None
         if item == "Report ID":
             if self.report_ID and self.r_size > 8:
                 self.reports[self.report_ID] = self.report, (self.r_size >> 3)
@@ -195,48 +360,34 @@ class ReportDescriptor(object):
             # if self.logical_min > self.logical_max:
             #     self.logical_min = self.logical_min_item.twos_comp()
             #     self.logical_max = self.logical_max_item.twos_comp()
-            item = {"type": value,
-                    "usage page": self.usage_page,
-                    "logical min": self.logical_min,
-                    "logical max": self.logical_max,
-                    "size": self.item_size,
-                    "count": self.count}
+            field = item = Field(value,
+                                 self.usage_page,
+                                 self.logical_min,
+                                 self.logical_max,
+                                 self.item_size,
+                                 self.count)
             if value & (0x1 << 0):  # Const item
-                item["size"] = self.item_size * self.count
-                item["count"] = 1
+                item.size = self.item_size * self.count
+                item.count = 1
                 self.report.append(item)
                 self.r_size += self.item_size * self.count
-            elif value & (0x1 << 1):  # Variable item
-                if self.usage_min and self.usage_max:
-                    usage = self.usage_min
-                    for i in range(self.count):
-                        item = item.copy()
-                        item["count"] = 1
-                        item["usage"] = usage
-                        self.report.append(item)
-                        self.r_size += self.item_size
-                        if usage < self.usage_max:
-                            usage += 1
-                else:
-                    for i in range(self.count):
-                        usage_ = 0
-                        if i < len(self.usage):
-                            usage_ = self.usage[i]
-                        else:
-                            usage_ = self.usage[-1]
-                        item = item.copy()
-                        item["count"] = 1
-                        item["usage"] = usage_
-                        self.report.append(item)
-                        self.r_size += self.item_size
-            else:  # Array item
-                if self.usage_min and self.usage_max:
-                    self.usage = list(
-                        range(self.usage_min, self.usage_max + 1))
-                item["usages"] = self.usage
+            else:
+                usages = self.usage
+                if value & (0x1 << 1):  # Variable item
+                    if self.usage_min and self.usage_max:
+                        # a reversed range still gives usage_min
+                        usages = range(self.usage_min,
+                                       max(self.usage_min,
+                                           self.usage_max) + 1)
+                    # one usage per count, the last one being repeated
+                    item.usages = Usages(usages, self.count)
+                else:  # Array item
+                    if self.usage_min and self.usage_max:
+                        # empty if the range is reversed
+                        usages = range(self.usage_min, self.usage_max + 1)
+                    item.usages = usages
                 self.report.append(item)
                 self.r_size += self.item_size * self.count
-            rdesc_item.data = item
             self.usage = []
             self.usage_min = 0
             self.usage_max = 0
@@ -244,6 +395,27 @@ class ReportDescriptor(object):
             if len(self.usage) > 0 and self.usage[-1] == 0xff0000c5:
                 self.win8 = True
             self.usage = []
+        return field
+
+    def plans(self, usages=None):
+        """
+        Compile the decode plan of each report of the descriptor.
+        The plans are only built once per selection of usages and are
+        indexed by (report ID, size in bytes).
+        """
+        if usages is not None:
+            usages = frozenset(usages)
+        if self._plans is None:
+            self._plans = {}
+        plans = self._plans.get(usages)
+        if plans is None:
+            plans = {}
+            for report_ID, (report, size) in self.reports.items():
+                if len(report):
+                    plan = ReportPlan(report_ID, report, size, usages)
+                    plans[(report_ID, size)] = plan
+            self._plans[usages] = plans
+        return plans
 
     def dump(self, dump_file):
         indent = 0
@@ -271,6 +443,225 @@ class ReportDescriptor(object):
         return " ".join([str(i) for i in self.rdesc_items])
 
 
+def get_usage(usage):
+    usage_page = usage >> 16
+    if usage_page in hid.inv_usage_pages and \
+            hid.inv_usage_pages[usage_page] == "Button":
+        usage = f'B{str(usage & 0xFF)}'
+    elif usage in hid.inv_usages:
+        usage = hid.inv_usages[usage]
+    else:
+        usage = f'0x{usage:04x}'
+    return usage
+
+
+class FieldPlan(object):
+    """
+    Precomputed layout of one field of a report: where its values are in
+    the report, how to extract them and how to print them.
+    """
+    __slots__ = ("field", "const", "array", "offset", "size", "count",
+                 "mask", "signed", "index", "usage", "usage_name",
+                 "usages", "logical_min", "logical_max", "usage_page_name",
+                 "vendor", "value_format", "prefix", "linebreak",
+                 "name", "array_names")
+
+    def __init__(self, field, usage=None):
+        self.field = field
+        self.const = field.type & (0x1 << 0)
+        self.array = not (field.type & (0x1 << 1))  # Variable
+        self.offset = 0
+        self.size = field.size
+        self.count = field.count if self.array else 1
+        self.mask = (1 << self.size) - 1
+        self.signed = field.logical_min < 0 and self.size > 1
+        self.index = 0
+        self.usage = usage
+        self.usage_name = None
+        if self.usage is not None:
+            self.usage_name = get_usage(self.usage)
+        self.usages = field.usages
+        self.logical_min = field.logical_min
+        self.logical_max = field.logical_max
+        self.usage_page_name = ''
+        usage_page = field.usage_page >> 16
+        if usage_page in hid.inv_usage_pages:
+            self.usage_page_name = hid.inv_usage_pages[usage_page]
+        if self.array and not self.usage_page_name:
+            self.usage_page_name = "Array"
+        self.vendor = 'vendor' in self.usage_page_name.lower()
+        self.value_format = "{:d}"
+        if self.size > 1:
+            self.value_format = f'{{:{str(len(str(1 << self.size)) + 1)}d}}'
+        self.prefix = ''
+        self.linebreak = False
+        self.name = self.usage_page_name if self.array else self.usage_name
+        self.array_names = {}
+
+    def array_name(self, value):
+        """
+        Return the printable usage of the given value of an Array field.
+        """
+        try:
+            return self.array_names[value]
+        except KeyError:
+            pass
+        if value < self.logical_min or value > self.logical_max:
+            name = ''
+        else:
+            name = f'{value:02x}'
+            if not self.vendor and 0 < value < len(self.usages):
+                name = get_usage(self.usages[value])
+                if "no event indicated" in name.lower():
+                    name = ''
+        self.array_names[value] = name
+        return name
+
+    def active_name(self, value):
+        """
+        Return the usage of the given value of an Array field if it is an
+        active one, '' if the value is an empty slot: 0, out of the logical
+        range or without a usage.
+        """
+        if value == 0:
+            return ''
+        if not self.vendor and value >= len(self.usages):
+            return ''
+        return self.array_name(value)
+
+
+class ReportPlan(object):
+    """
+    Compiled decode plan of one report layout.
+
+    The bit offsets, masks and signedness of each field are computed once
+    and turned into a specialized decode() function which returns the tuple
+    of all the non constant values of the report.
+
+    If usages is given, only the fields whose name is in it are kept: the
+    other bit ranges are not extracted at all.
+    """
+
+    def __init__(self, report_ID, report, size, usages=None):
+        self.report_ID = report_ID
+        self.size = size
+        self.numbered = report_ID != -1
+        self.usages = usages
+        self.fields = []
+        # first byte is report ID, actual data starts at 8
+        offset = 8 if self.numbered else 0
+        for item in report:
+            if item.type & (0x3 << 0) == 0x2:  # Data Variable item
+                # one field per value, each with its own usage
+                fields = [FieldPlan(item, usage) for usage in item.usages]
+            else:
+                fields = [FieldPlan(item)]
+            for field in fields:
+                field.offset = offset
+                offset += field.size * field.count
+                if field.const:
+                    field.count = 0
+                self.fields.append(field)
+        if usages is not None:
+            # projection: the other fields are neither extracted nor printed
+            self.fields = [f for f in self.fields
+                           if not f.const and f.name in usages]
+        index = 0
+        sep = '/' if self.numbered else ''
+        prev = None
+        usages_printed = {}
+        for field in self.fields:
+            field.index = index
+            if field.const:
+                field.prefix = f'{sep} # '
+            elif not field.array:
+                usage = f' {field.usage_name}:'
+                # if the usage has already been printed, this is a
+                # duplicate in this report descriptor and we need a
+                # linebreak
+                if usage in usages_printed:
+                    usages_printed = {}
+                    field.linebreak = True
+                usages_printed[usage] = True
+                if (prev and
+                   prev.field.type == field.field.type and
+                   prev.usage == field.usage):
+                    sep = ","
+                    usage = ""
+                field.prefix = f'{sep}{usage}'
+            else:
+                field.prefix = f'{sep}{field.usage_page_name} ['
+            index += field.count
+            sep = '|'
+            prev = field
+        self.data_fields = [f for f in self.fields if not f.const]
+        # usages appearing several times in the layout (one per touch on
+        # multitouch devices for instance) are suffixed by their index
+        names = {}
+        for field in self.data_fields:
+            names[field.name] = names.get(field.name, 0) + 1
+        seen = {}
+        for field in self.data_fields:
+            if names[field.name] > 1:
+                n = seen.get(field.name, 0)
+                seen[field.name] = n + 1
+                field.name = f'{field.name}[{n}]'
+        self.decode = self.compile()
+
+    def values(self, report):
+        """
+        Decode the given report into a dict of values indexed by the name
+        of each field. Array fields give the list of their active usages,
+        without the empty slots.
+        """
+        values = self.decode(report)
+        result = {}
+        for field in self.data_fields:
+            if field.array:
+                usages = []
+                for v in values[field.index:field.index + field.count]:
+                    if not isinstance(v, str):
+                        v = field.active_name(v)
+                        if v:
+                            usages.append(v)
+                result[field.name] = usages
+            else:
+                value = values[field.index]
+                if not isinstance(value, str):
+                    result[field.name] = value
+        return result
+
+    def compile(self):
+        """
+        Generate the decode function of the report: the whole report is
+        converted into a single int and each value is extracted with a
+        precomputed shift and mask.
+        """
+        values = []
+        guard = False
+        for field in self.fields:
+            for i in range(field.count):
+                offset = field.offset + i * field.size
+                value = f'((v >> {offset}) & {field.mask:#x})'
+                if field.signed:
+                    sign = 1 << (field.size - 1)
+                    value = f'(({value} ^ {sign:#x}) - {sign:#x})'
+                if offset >> 3 >= self.size:
+                    # the report may be too short to hold the value
+                    guard = True
+                    value = f'({value} if n > {offset >> 3} else "<.>")'
+                values.append(value)
+        src = 'def decode(data):\n'
+        src += '    v = int.from_bytes(data, "little")\n'
+        if guard:
+            src += '    n = len(data)\n'
+        src += f'    return ({"".join(v + ", " for v in values)})\n'
+        namespace = {}
+        name = f'<report {self.report_ID}:{self.size}>'
+        exec(compile(src, name, 'exec'), namespace)
+        return namespace['decode']
+
+
 def dump_rdesc(rdesc_item, indent, dump_file):
     """
     Format the hid item in a lsusb -v format.
@@ -432,25 +823,15 @@ def dump_rdesc_array(rdesc_item, indent, dump_file):
     return indent
 
 
-def parse_rdesc(rdesc_str, dump_file=None):
+def parse_rdesc_bytes(data, dump_file=None):
     """
-    Parse the given report descriptor and outputs it to stdout if show is True.
-    Returns:
-     - a parsed dict of each report indexed by their report ID
-     - the id of the multitouch collection, or -1
-     - if the multitouch device has been Win 8 certified
+    Parse the given report descriptor, provided as bytes, bytearray or
+    memoryview (straight from HIDIOCGRDESC for instance), and outputs it
+    to dump_file if not None.
+    Returns the ReportDescriptor object.
     """
-
-    rdesc = [int(r, 16) for r in rdesc_str.split()]
-
     rdesc_object = ReportDescriptor()
-    for i in range(1, len(rdesc)):
-        v = rdesc[i]
-        if i == len(rdesc) - 1 and v == 0:
-            # some device present a trailing 0, skipping it
-            break
-        rdesc_object.consume(v, i)
-
+    rdesc_object.consume_bytes(data)
     rdesc_object.close_rdesc()
 
     if dump_file:
@@ -459,14 +840,28 @@ def parse_rdesc(rdesc_str, dump_file=None):
     return rdesc_object
 
 
+def parse_rdesc(rdesc_str, dump_file=None):
+    """
+    Parse the given report descriptor and outputs it to stdout if show is True.
+    The report descriptor is given in hexadecimal, prefixed by its size and
+    optionally by "R:".
+    Returns:
+     - a parsed dict of each report indexed by their report ID
+     - the id of the multitouch collection, or -1
+     - if the multitouch device has been Win 8 certified
+    """
+    size, rdesc = recording.split_rdesc(rdesc_str)
+    return parse_rdesc_bytes(rdesc, dump_file)
+
+
 def main():
-    f = open(sys.argv[1])
+    f = recording.open_recording(sys.argv[1])
     if len(sys.argv) > 2:
         global type_output
         type_output = sys.argv[2]
     for line in f.readlines():
         if line.startswith("R:"):
-            parse_rdesc(line.lstrip("R: "), sys.stdout)
+            parse_rdesc(line, sys.stdout)
             break
     f.close()
 
@@ -21,6 +21,7 @@
 #
 
 import sys
+import recording
 import matplotlib.pyplot as pyplot
 
 def retrieve_t_x_y_from_evtest(f):
@@ -59,7 +60,7 @@ def retrieve_t_x_y_from_evtest(f):
 def main():
 	f = sys.stdin
 	if len(sys.argv) > 1:
-		f = open(sys.argv[1])
+		f = recording.open_recording(sys.argv[1])
 	times, xs, ys = retrieve_t_x_y_from_evtest(f)
 	f.close()
 
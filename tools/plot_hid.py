@@ -21,49 +21,55 @@
 #
 
 import sys
-import os
 import parse_hid
+import recording
 import matplotlib.pyplot as pyplot
 import plot_evtest
 
 def retrieve_t_x_y_from_hid(f):
+	return retrieve_t_x_y(parse_hid.read_events(f))
+
+def retrieve_t_x_y(events):
 	times = []
 	xs = []
 	ys = []
 	start_time = -1
-	tmp_out = os.tmpfile()
-	parse_hid.parse_hid(f, tmp_out)
-	tmp_out.seek(0)
-	while True:
-		try:
-			line = tmp_out.readline()
-		except KeyboardInterrupt:
-			break
-		if "X:" in line:
-			line = line.strip()
-			data = line.split()
-			time = float(data[0])
-			if start_time < 0:
-				start_time = time
-			time -= start_time
-			x = int(data[data.index("X:") + 1])
-			y = int(data[data.index("Y:") + 1])
-			times.append(time)
-			xs.append(x)
-			ys.append(y)
-		elif line == '':
-			# End of file
-			break
-	tmp_out.close()
+	for event in events:
+		if not isinstance(event, parse_hid.Event):
+			continue
+		values = event.values
+		# multitouch devices report one X per touch, use the first one
+		x = values.get("X", values.get("X[0]"))
+		y = values.get("Y", values.get("Y[0]"))
+		if x is None or y is None:
+			continue
+		time = event.timestamp / 1000000.0
+		if start_time < 0:
+			start_time = time
+		time -= start_time
+		times.append(time)
+		xs.append(x)
+		ys.append(y)
 	return times, xs, ys
 
 
 def main():
-	f = sys.stdin
-	if len(sys.argv) > 1:
-		f = open(sys.argv[1])
-	times, xs, ys = retrieve_t_x_y_from_hid(f)
-	f.close()
+	if len(sys.argv) > 2:
+		# plot_hid.py file start [end]: only plot the given time range, the
+		# recording index is used to jump there
+		start = recording.parse_time(sys.argv[2])
+		end = None
+		if len(sys.argv) > 3:
+			end = recording.parse_time(sys.argv[3])
+		events = parse_hid.read_range(sys.argv[1], start, end)
+		times, xs, ys = retrieve_t_x_y(events)
+	else:
+		# binary, the recording may be a text or a binary one
+		f = sys.stdin.buffer
+		if len(sys.argv) > 1:
+			f = recording.open_recording(sys.argv[1], 'rb')
+		times, xs, ys = retrieve_t_x_y_from_hid(f)
+		f.close()
 
 	pyplot.plot(times, xs, label="X")
 	pyplot.hold(True)
@@ -23,21 +23,19 @@
 import sys
 import os
 import parse_hid
+import recording
 import matplotlib.pyplot as pyplot
 import plot_evtest
 import plot_hid
 
 def main():
 	plots = []
-	files = []
-	if len(sys.argv) > 1:
-		files = [open(f) for f in sys.argv]
-
-	for i in xrange(len(files)):
-		f = files[i]
+	for i, filename in enumerate(sys.argv[1:]):
 		times, xs, ys = [], [], []
 		try:
-			times, xs, ys = plot_hid.retrieve_t_x_y_from_hid(f)
+			# binary, the recording may be a text or a binary one
+			with recording.open_recording(filename, 'rb') as f:
+				times, xs, ys = plot_hid.retrieve_t_x_y_from_hid(f)
 		except:
 			pass
 		if len(times) > 0:
@@ -46,9 +44,10 @@ def main():
 			pyplot.plot(times, ys, label="Y_hid" + str(i))
 			continue
 
-		f.seek(0)
+		# the compressed recordings can not be rewound, open it again
 		try:
-			times, xs, ys = plot_evtest.retrieve_t_x_y_from_evtest(f)
+			with recording.open_recording(filename) as f:
+				times, xs, ys = plot_evtest.retrieve_t_x_y_from_evtest(f)
 		except:
 			pass
 		if len(times) > 0:
@@ -0,0 +1,321 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Hid replay / rdesc_cache.py: persistent cache of parsed report descriptors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import binascii
+import hashlib
+import io
+import json
+import os
+import tempfile
+import hid
+import parse_hut
+import parse_rdesc
+import recording
+
+CACHE_VERSION = 3
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+# the cache directory is only scanned for eviction once this fraction of
+# its maximum size has been written since the previous scan
+EVICT_FRACTION = 16
+
+# set HID_REPLAY_CACHE to the cache directory to use, or to an empty
+# string to disable the cache
+CACHE_ENV = "HID_REPLAY_CACHE"
+
+_default_cache = None
+_version_stamp = None
+
+
+def version_stamp():
+    """
+    Compute a stamp of the parser: any change in the parser or in the usage
+    tables invalidates the entries written by a previous version.
+
+    The stamp is computed on the first call only.
+    """
+    global _version_stamp
+    if _version_stamp is not None:
+        return _version_stamp
+    sha = hashlib.sha1(str(CACHE_VERSION).encode())
+    files = [parse_rdesc.__file__, hid.__file__, parse_hut.__file__]
+    files += sorted(os.path.join(parse_hut.DATA_DIR, f)
+                    for f in os.listdir(parse_hut.DATA_DIR)
+                    if f.endswith('.hut'))
+    for filename in files:
+        with open(filename, 'rb') as f:
+            sha.update(f.read())
+    _version_stamp = sha.hexdigest()
+    return _version_stamp
+
+
+def usages_state(usages):
+    """
+    Convert the usages of a Field into a JSON serializable value.
+    """
+    if isinstance(usages, parse_rdesc.Usages):
+        return {"usages": usages_state(usages.usages), "count": usages.count}
+    if isinstance(usages, range):
+        return {"range": [usages.start, usages.stop]}
+    if usages is None:
+        return None
+    return list(usages)
+
+
+def usages_from_state(state):
+    if state is None:
+        return None
+    if isinstance(state, list):
+        return [int(usage) for usage in state]
+    if "range" in state:
+        start, stop = state["range"]
+        return range(int(start), int(stop))
+    return parse_rdesc.Usages(usages_from_state(state["usages"]),
+                              int(state["count"]))
+
+
+def reports_state(reports):
+    """
+    Convert the reports of a ReportDescriptor, the Field layout and the
+    size of each report ID, into a JSON serializable value.
+    """
+    return [[report_ID, size,
+             [[field.type, field.usage_page, field.logical_min,
+               field.logical_max, field.size, field.count,
+               usages_state(field.usages)] for field in report]]
+            for report_ID, (report, size) in reports.items()]
+
+
+def reports_from_state(state):
+    reports = {}
+    for report_ID, size, fields in state:
+        report = []
+        for (field_type, usage_page, logical_min, logical_max, field_size,
+             count, usages) in fields:
+            report.append(parse_rdesc.Field(int(field_type), int(usage_page),
+                                            int(logical_min),
+                                            int(logical_max),
+                                            int(field_size), int(count),
+                                            usages_from_state(usages)))
+        reports[int(report_ID)] = report, int(size)
+    return reports
+
+
+class CachedReportDescriptor(parse_rdesc.ReportDescriptor):
+    """
+    A ReportDescriptor whose layouts and dumps are kept in the cache.
+
+    When reports is given, the descriptor is rebuilt from it and win8
+    without parsing data: its items are only parsed if rdesc_items is
+    needed. The text output is only produced once per output type.
+    """
+
+    def __init__(self, data, dumps=None, cache=None, key=None,
+                 reports=None, win8=False):
+        super(CachedReportDescriptor, self).__init__()
+        if reports is None:
+            self.consume_bytes(data)
+            self.close_rdesc()
+        else:
+            self._unbuilt.append((data, 1, 0, []))
+            self.reports = reports
+            self.win8 = win8
+        self.raw_data = data
+        self.dumps = dumps if dumps is not None else {}
+        self.cache = cache
+        self.key = key
+
+    def dump(self, dump_file):
+        type_output = parse_rdesc.type_output
+        if type_output not in self.dumps:
+            output = io.StringIO()
+            parse_rdesc.ReportDescriptor.dump(self, output)
+            self.dumps[type_output] = output.getvalue()
+            if self.cache:
+                self.cache.store(self.key, self)
+        dump_file.write(self.dumps[type_output])
+
+
+class RDescCache(object):
+    """
+    On-disk cache of parsed report descriptors, indexed by the SHA-256 of
+    the descriptor bytes.
+
+    Each entry is stored in its own JSON file, holding the descriptor in
+    hexadecimal, its report layouts, its win8 flag and its dumps. The
+    modification time of the files is updated on each hit, and the least
+    recently used entries are removed once the cache grows above max_size
+    bytes.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        # bytes written since the last eviction, None until the first one
+        self.written = None
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def stamp(self):
+        return version_stamp()
+
+    @classmethod
+    def key(cls, data):
+        return hashlib.sha256(data).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def load(self, key):
+        """
+        Return the CachedReportDescriptor stored for key, or None if there
+        is no such entry or if it can not be read.
+        """
+        filename = self.filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                entry = json.load(f)
+            if entry["version"] != self.stamp:
+                return None
+            data = binascii.unhexlify(entry["data"])
+            dumps = {str(k): str(v) for k, v in entry["dumps"].items()}
+            reports = reports_from_state(entry["reports"])
+            win8 = bool(entry["win8"])
+            os.utime(filename)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+        if self.key(data) != key:
+            return None
+        return CachedReportDescriptor(data, dumps, self, key, reports, win8)
+
+    def store(self, key, rdesc_object):
+        """
+        Store the layouts and the dumps of rdesc_object. The file is
+        written atomically so several processes can share the cache.
+        """
+        entry = {
+            "version": self.stamp,
+            "data": rdesc_object.raw_data.hex(),
+            "reports": reports_state(rdesc_object.reports),
+            "win8": rdesc_object.win8,
+            "dumps": rdesc_object.dumps,
+        }
+        content = json.dumps(entry).encode()
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, self.filename(key))
+        except OSError:
+            return
+        if self.written is not None:
+            self.written += len(content)
+        if self.written is None or \
+                self.written >= self.max_size // EVICT_FRACTION:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in
+        max_size.
+        """
+        self.written = 0
+        entries = []
+        total = 0
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.pickle'):
+                # written by the first versions of the cache
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+                continue
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def parse_bytes(self, data, dump_file=None):
+        """
+        Same as parse_rdesc.parse_rdesc_bytes() but only dumps the report
+        descriptor if it is not in the cache yet.
+        """
+        data = bytes(data)
+        key = self.key(data)
+        rdesc_object = self.load(key)
+        if rdesc_object is None:
+            rdesc_object = CachedReportDescriptor(data, None, self, key)
+            rdesc_object.dump(io.StringIO())
+        if dump_file:
+            rdesc_object.dump(dump_file)
+        return rdesc_object
+
+
+def get_cache():
+    """
+    Return the default cache, in $XDG_CACHE_HOME/hid-replay/rdesc unless
+    overwritten by $HID_REPLAY_CACHE, or None if it is disabled.
+    """
+    global _default_cache
+    if _default_cache is None:
+        path = os.environ.get(CACHE_ENV)
+        if path is None:
+            cache_home = os.environ.get('XDG_CACHE_HOME',
+                                        os.path.expanduser('~/.cache'))
+            path = os.path.join(cache_home, 'hid-replay', 'rdesc')
+        if not path:
+            _default_cache = False
+        else:
+            try:
+                _default_cache = RDescCache(path)
+            except OSError:
+                _default_cache = False
+    return _default_cache or None
+
+
+def parse_bytes(data, dump_file=None):
+    """
+    Parse the given report descriptor through the default cache.
+    """
+    cache = get_cache()
+    if cache is None:
+        return parse_rdesc.parse_rdesc_bytes(data, dump_file)
+    return cache.parse_bytes(data, dump_file)
+
+
+def parse(rdesc_str, dump_file=None):
+    """
+    Parse the given report descriptor, in hexadecimal prefixed by its size,
+    through the default cache.
+    """
+    size, rdesc = recording.split_rdesc(rdesc_str)
+    return parse_bytes(rdesc, dump_file)
@@ -0,0 +1,203 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Hid replay / recording.py: tokenizer of the hid-recorder file format
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# The lines handled here are the ones written by hid-recorder:
+#
+#   R: size dump_of_report_descriptor_in_hexadecimal
+#   E: timestamp size report_in_hexadecimal
+#
+# All the functions accept both str and bytes lines, so a recording can be
+# read from a binary file handle without decoding it first.
+#
+# Recordings compressed with gzip, xz or bzip2 can be opened directly with
+# open_recording().
+#
+
+import bz2
+import gzip
+import io
+import lzma
+import queue
+import sys
+import threading
+
+CHUNK_SIZE = 256 * 1024
+QUEUE_SIZE = 16
+
+_compressions = (
+    (b'\x1f\x8b', gzip.open),
+    (b'\xfd7zXZ\x00', lzma.open),
+    (b'BZh', bz2.open),
+)
+
+
+def parse_time(time):
+    """
+    Convert the "seconds.microseconds" timestamp of an event into an
+    integer number of microseconds, without going through a float.
+    """
+    if isinstance(time, bytes):
+        time = time.decode('ascii')
+    sec, _, usec = time.partition('.')
+    if usec and not usec.isdigit():
+        raise ValueError(f'invalid timestamp: {time!r}')
+    return int(sec) * 1000000 + int((usec + '000000')[:6])
+
+
+def format_time(timestamp):
+    """
+    Format a timestamp in microseconds the way hid-recorder does.
+    """
+    return f'{timestamp // 1000000}.{timestamp % 1000000:06d}'
+
+
+def parse_hex(data):
+    """
+    Convert a string of space separated hexadecimal bytes into bytes.
+    """
+    if isinstance(data, bytes):
+        data = data.decode('ascii')
+    return bytes.fromhex(data)
+
+
+def split_event(line):
+    """
+    Split an "E:" line into (timestamp in microseconds, size, report).
+    The report is returned as bytes, size is the declared one and is not
+    checked against it.
+    """
+    tokens = line.split(None, 3)
+    if len(tokens) < 3:
+        raise ValueError(f'invalid event line: {line!r}')
+    report = parse_hex(tokens[3]) if len(tokens) > 3 else b''
+    return parse_time(tokens[1]), int(tokens[2]), report
+
+
+def split_rdesc(line):
+    """
+    Split an "R:" line, or its content after the "R:" prefix, into
+    (size, report descriptor). The report descriptor is returned as bytes,
+    size is the declared one: as in the tools, the payload prevails.
+    """
+    tokens = line.split(None, 1)
+    if tokens and tokens[0] in ('R:', b'R:', 'O:', b'O:'):
+        tokens = tokens[1].split(None, 1) if len(tokens) > 1 else []
+    if not tokens:
+        raise ValueError(f'invalid report descriptor line: {line!r}')
+    rdesc = parse_hex(tokens[1]) if len(tokens) > 1 else b''
+    return int(tokens[0]), rdesc
+
+
+class ThreadedReader(io.RawIOBase):
+    """
+    Read f_in, a binary file, in a background thread which stays at most
+    queue_size chunks ahead of the reader.
+
+    The decompressors release the GIL, so a compressed file is inflated
+    while the previous chunks are being parsed.
+    """
+
+    def __init__(self, f_in, chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE):
+        super().__init__()
+        self.f_in = f_in
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(queue_size)
+        self.chunk = b''
+        self.pos = 0
+        self.eof = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                chunk = self.f_in.read(self.chunk_size)
+                self.put(chunk)
+                if not chunk:
+                    break
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.pos >= len(self.chunk):
+            if self.eof:
+                return 0
+            chunk = self.queue.get()
+            if isinstance(chunk, Exception):
+                self.eof = True
+                raise chunk
+            if not chunk:
+                self.eof = True
+                return 0
+            self.chunk = chunk
+            self.pos = 0
+        n = min(len(b), len(self.chunk) - self.pos)
+        b[:n] = self.chunk[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed and not sys.is_finalizing():
+            self.stopped.set()
+            self.thread.join()
+            self.f_in.close()
+        super().close()
+
+
+def compression(filename):
+    """
+    Return the function opening the given file if it is compressed, None
+    otherwise.
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(6)
+    for prefix, opener in _compressions:
+        if magic.startswith(prefix):
+            return opener
+    return None
+
+
+def is_compressed(filename):
+    return compression(filename) is not None
+
+
+def open_recording(filename, mode='r'):
+    """
+    Open a recording for reading, in text ('r') or binary ('rb') mode.
+    Compressed recordings are decompressed on the fly, in a background
+    thread.
+    """
+    opener = compression(filename)
+    if opener is None:
+        return open(filename, mode)
+    f = io.BufferedReader(ThreadedReader(opener(filename, 'rb')), CHUNK_SIZE)
+    if mode == 'rb':
+        return f
+    return io.TextIOWrapper(f)
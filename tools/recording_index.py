@@ -0,0 +1,264 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Hid replay / recording_index.py: sidecar time index of recordings
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# The index of "foo.hid" is stored next to it in "foo.hid.idx". It holds a
+# checkpoint every step events:
+#
+#   (timestamp, offset, device, rdesc offset)
+#
+# timestamp being the one of the E: line at offset, device the device
+# index at that point and rdesc offset the position of the R: line in
+# use for this device (-1 if none). The positions of all the R: lines are
+# also stored, so the decoder state of every device can be restored.
+#
+# When the recording grew since the index was written, only the new lines
+# are scanned. The index is not scanned at all if the size and the
+# modification time of the recording did not change.
+#
+# The index file is a JSON object, any index file which can not be read is
+# simply rebuilt.
+#
+
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import recording
+
+INDEX_VERSION = 2
+DEFAULT_STEP = 4096
+FINGERPRINT_SIZE = 4096
+
+
+class RecordingIndex(object):
+    """
+    Checkpoints of a text recording, to start decoding it anywhere.
+    """
+
+    def __init__(self, filename, step=DEFAULT_STEP):
+        self.filename = filename
+        self.step = step
+        self.reset()
+
+    def reset(self):
+        self.checkpoints = []
+        self.timestamps = []
+        self.rdescs = []
+        # state of the scan at offset
+        self.offset = 0
+        self.device = 0
+        self.events = 0
+        self.active = {}
+        self.fingerprint = None
+        # stat of the recording when it was scanned
+        self.size = None
+        self.mtime = None
+
+    @property
+    def index_filename(self):
+        return self.filename + '.idx'
+
+    @staticmethod
+    def fingerprint_at(data, offset):
+        """
+        Hash the end of the indexed part of data, to find out whether the
+        recording was only appended to.
+        """
+        start = max(0, offset - FINGERPRINT_SIZE)
+        return hashlib.sha1(data[start:offset]).hexdigest()
+
+    def scan(self, data):
+        """
+        Index the lines of data, the content of the recording, after the
+        already indexed part. An unterminated last line is left for later.
+        """
+        end = data.rfind(b'\n', self.offset) + 1
+        pos = self.offset
+        while pos < end:
+            eol = data.find(b'\n', pos)
+            prefix = data[pos:pos + 2]
+            if prefix == b'E:':
+                if self.events % self.step == 0:
+                    try:
+                        time = data[pos:eol].split(None, 2)[1]
+                        timestamp = recording.parse_time(time)
+                    except (IndexError, ValueError):
+                        pos = eol + 1
+                        continue
+                    self.checkpoints.append((timestamp, pos, self.device,
+                                             self.active.get(self.device,
+                                                             -1)))
+                    self.timestamps.append(timestamp)
+                self.events += 1
+            elif prefix == b'R:':
+                self.rdescs.append((pos, self.device))
+                self.active[self.device] = pos
+            elif prefix == b'D:':
+                try:
+                    self.device = int(data[pos + 2:eol])
+                except ValueError:
+                    pass
+            pos = eol + 1
+        if end > self.offset:
+            self.offset = end
+            self.fingerprint = self.fingerprint_at(data, end)
+
+    def update(self):
+        """
+        Bring the index up to date with the recording. Returns True if the
+        index changed.
+        """
+        with open(self.filename, 'rb') as f:
+            st = os.fstat(f.fileno())
+            stat = (st.st_size, st.st_mtime_ns)
+            if stat == (self.size, self.mtime):
+                return False
+            if st.st_size == 0:
+                self.reset()
+            else:
+                with mmap.mmap(f.fileno(), 0,
+                               access=mmap.ACCESS_READ) as data:
+                    if st.st_size < self.offset or \
+                            self.fingerprint_at(data, self.offset) != \
+                            self.fingerprint:
+                        # the recording has been rewritten
+                        self.reset()
+                    self.scan(data)
+            self.size, self.mtime = stat
+            return True
+
+    def load(self):
+        """
+        Load the index file. Returns False if there is none, if it was
+        written for another step or version, or if it can not be read; the
+        index is then empty.
+        """
+        try:
+            with open(self.index_filename, 'rb') as f:
+                entry = json.load(f)
+            if entry["version"] != INDEX_VERSION or \
+                    entry["step"] != self.step:
+                return False
+            checkpoints = [(int(timestamp), int(offset), int(device),
+                            int(rdesc_offset))
+                           for timestamp, offset, device, rdesc_offset
+                           in entry["checkpoints"]]
+            rdescs = [(int(pos), int(device))
+                      for pos, device in entry["rdescs"]]
+            active = {int(device): int(pos)
+                      for device, pos in entry["active"]}
+            offset = int(entry["offset"])
+            device = int(entry["device"])
+            events = int(entry["events"])
+            fingerprint = entry["fingerprint"]
+            size = int(entry["size"])
+            mtime = int(entry["mtime"])
+            if fingerprint is not None and not isinstance(fingerprint, str):
+                raise TypeError("invalid fingerprint")
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        self.checkpoints = checkpoints
+        self.timestamps = [c[0] for c in checkpoints]
+        self.rdescs = rdescs
+        self.active = active
+        self.offset = offset
+        self.device = device
+        self.events = events
+        self.fingerprint = fingerprint
+        self.size = size
+        self.mtime = mtime
+        return True
+
+    def save(self):
+        """
+        Write the index file atomically. Errors are ignored, the index is
+        then simply rebuilt next time.
+        """
+        entry = {
+            "version": INDEX_VERSION,
+            "step": self.step,
+            "size": self.size,
+            "mtime": self.mtime,
+            "offset": self.offset,
+            "device": self.device,
+            "events": self.events,
+            "fingerprint": self.fingerprint,
+            "active": sorted(self.active.items()),
+            "rdescs": self.rdescs,
+            "checkpoints": self.checkpoints,
+        }
+        path = os.path.dirname(os.path.abspath(self.index_filename))
+        try:
+            fd, tmp = tempfile.mkstemp(dir=path, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f, separators=(',', ':'))
+            os.replace(tmp, self.index_filename)
+        except OSError:
+            pass
+
+    def find_time(self, timestamp):
+        """
+        Return the last checkpoint at or before timestamp, or the first one.
+        None if the recording has no events.
+        """
+        if not self.checkpoints:
+            return None
+        i = bisect.bisect_right(self.timestamps, timestamp)
+        return self.checkpoints[max(i - 1, 0)]
+
+    def find_event(self, n):
+        """
+        Return (checkpoint, number of events to skip after it) to reach the
+        n-th event of the recording, or (None, n).
+        """
+        if not self.checkpoints:
+            return None, n
+        i = min(n // self.step, len(self.checkpoints) - 1)
+        return self.checkpoints[i], n - i * self.step
+
+    def decoder_state(self, data, checkpoint):
+        """
+        Return the state of the decoder at the given checkpoint, as expected
+        by parse_hid.read_records(): the list of the (device, report
+        descriptor) in use and the current device.
+        """
+        timestamp, offset, device, rdesc_offset = checkpoint
+        active = {}
+        for pos, dev in self.rdescs:
+            if pos >= offset:
+                break
+            active[dev] = pos
+        rdescs = []
+        for dev, pos in sorted(active.items()):
+            eol = data.find(b'\n', pos)
+            rdescs.append((dev, recording.split_rdesc(data[pos:eol])[1]))
+        return rdescs, device
+
+
+def get_index(filename, step=DEFAULT_STEP):
+    """
+    Return the up to date RecordingIndex of the given recording, loading
+    and saving its sidecar file.
+    """
+    index = RecordingIndex(filename, step)
+    index.load()
+    if index.update():
+        index.save()
+    return index
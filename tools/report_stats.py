@@ -0,0 +1,283 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Hid replay / report_stats.py: timing statistics of the reports of a
+# recording
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# All the statistics are computed in a single pass and in constant memory:
+# the inter-arrival times are accumulated in log-linear histograms (8
+# buckets per power of two, so a percentile is known within 12.5%), only
+# the longest gaps are kept.
+#
+
+import heapq
+import recording
+
+DEFAULT_BURST_RATE = 2000  # Hz, faster than a 1 ms polling
+DEFAULT_GAPS = 5
+PERCENTILES = (50, 90, 99, 99.9)
+
+SUB_BITS = 3
+
+
+def bucket(value):
+    """
+    Return the index of the histogram bucket of value, an integer >= 0.
+    """
+    if value < 2 << SUB_BITS:
+        return value
+    shift = value.bit_length() - SUB_BITS - 1
+    return (shift << SUB_BITS) + (value >> shift)
+
+
+def bucket_range(index):
+    """
+    Return the (lowest, highest) values of the given bucket.
+    """
+    if index < 2 << SUB_BITS:
+        return index, index
+    shift = (index >> SUB_BITS) - 1
+    low = (index - (shift << SUB_BITS)) << shift
+    return low, low + (1 << shift) - 1
+
+
+def format_us(value):
+    """
+    Format a duration in microseconds as milliseconds.
+    """
+    return f'{value / 1000:.3f} ms'
+
+
+class IntervalStats(object):
+    """
+    Statistics of the inter-arrival times of one stream of reports.
+
+    The jitter is the difference between two consecutive intervals. A burst
+    is a run of intervals shorter than burst_interval.
+    """
+
+    def __init__(self, burst_interval, gaps=DEFAULT_GAPS):
+        self.burst_interval = burst_interval
+        self.max_gaps = gaps
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.last_interval = None
+        self.intervals = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = {}
+        self.jitter = {}
+        self.gaps = []
+        self.bursts = 0
+        self.burst_start = None
+        self.burst_count = 0
+        self.longest_burst = None
+
+    def add(self, timestamp):
+        self.count += 1
+        if self.first is None:
+            self.first = timestamp
+        last = self.last
+        self.last = timestamp
+        if last is None:
+            return
+        interval = timestamp - last
+        if interval < 0:
+            # timestamps went back, the recording has been restarted
+            self.last_interval = None
+            self.end_burst(last)
+            return
+
+        # Welford's online mean and variance
+        self.intervals += 1
+        delta = interval - self.mean
+        self.mean += delta / self.intervals
+        self.m2 += delta * (interval - self.mean)
+        if self.min is None or interval < self.min:
+            self.min = interval
+        if self.max is None or interval > self.max:
+            self.max = interval
+
+        b = bucket(interval)
+        self.histogram[b] = self.histogram.get(b, 0) + 1
+        if self.last_interval is not None:
+            jitter = abs(interval - self.last_interval)
+            b = jitter.bit_length()
+            self.jitter[b] = self.jitter.get(b, 0) + 1
+        self.last_interval = interval
+
+        gap = (interval, timestamp)
+        if len(self.gaps) < self.max_gaps:
+            heapq.heappush(self.gaps, gap)
+        elif gap > self.gaps[0]:
+            heapq.heapreplace(self.gaps, gap)
+
+        if interval < self.burst_interval:
+            if self.burst_start is None:
+                self.burst_start = last
+                self.burst_count = 1
+            self.burst_count += 1
+        else:
+            self.end_burst(last)
+
+    def add_repeat(self, timestamp, count, interval):
+        """
+        Same as calling add() with timestamp, timestamp + interval, ... for
+        count events, in constant time.
+        """
+        if count <= 0:
+            return
+        self.add(timestamp)
+        count -= 1
+        if not count:
+            return
+        self.count += count
+        self.last = timestamp + count * interval
+
+        # merge count intervals of the same value in the mean and variance
+        n = self.intervals + count
+        delta = interval - self.mean
+        self.mean += delta * count / n
+        self.m2 += delta * delta * self.intervals * count / n
+        self.intervals = n
+        if self.min is None or interval < self.min:
+            self.min = interval
+        if self.max is None or interval > self.max:
+            self.max = interval
+
+        b = bucket(interval)
+        self.histogram[b] = self.histogram.get(b, 0) + count
+        if self.last_interval is not None:
+            b = abs(interval - self.last_interval).bit_length()
+            self.jitter[b] = self.jitter.get(b, 0) + 1
+        if count > 1:
+            self.jitter[0] = self.jitter.get(0, 0) + count - 1
+        self.last_interval = interval
+
+        # only the latest repetitions may be among the longest gaps
+        for i in range(min(count, self.max_gaps)):
+            gap = (interval, self.last - i * interval)
+            if len(self.gaps) < self.max_gaps:
+                heapq.heappush(self.gaps, gap)
+            elif gap > self.gaps[0]:
+                heapq.heapreplace(self.gaps, gap)
+
+        if interval < self.burst_interval:
+            if self.burst_start is None:
+                self.burst_start = timestamp
+                self.burst_count = 1
+            self.burst_count += count
+        else:
+            self.end_burst(timestamp)
+
+    def end_burst(self, end):
+        if self.burst_start is None:
+            return
+        self.bursts += 1
+        burst = (self.burst_count, self.burst_start, end)
+        if self.longest_burst is None or burst[0] > self.longest_burst[0]:
+            self.longest_burst = burst
+        self.burst_start = None
+        self.burst_count = 0
+
+    def percentile(self, p):
+        """
+        Return the approximate p-th percentile of the intervals: the middle
+        of its histogram bucket, clamped to the extreme intervals so that
+        a constant interval gives exact percentiles.
+        """
+        rank = p * self.intervals / 100
+        seen = 0
+        for b in sorted(self.histogram):
+            seen += self.histogram[b]
+            if seen >= rank:
+                low, high = bucket_range(b)
+                return min(max((low + high) // 2, self.min), self.max)
+        return self.max
+
+    def dump(self, f_out, indent='  '):
+        self.end_burst(self.last)
+        duration = self.last - self.first
+        f_out.write(f'{indent}events: {self.count}')
+        if duration > 0:
+            f_out.write(f' ({self.intervals * 1000000 / duration:.1f} Hz)')
+        f_out.write('\n')
+        if not self.intervals:
+            return
+        std = (self.m2 / self.intervals) ** 0.5
+        f_out.write(f'{indent}interval: mean {format_us(self.mean)}, '
+                    f'std {format_us(std)}, min {format_us(self.min)}, '
+                    f'max {format_us(self.max)}\n')
+        percentiles = ', '.join(f'p{p:g} {format_us(self.percentile(p))}'
+                                for p in PERCENTILES)
+        f_out.write(f'{indent}percentiles: {percentiles}\n')
+        if self.jitter:
+            f_out.write(f'{indent}jitter:\n')
+            for b in sorted(self.jitter):
+                high = (1 << b) - 1 if b else 0
+                f_out.write(f'{indent}  <= {format_us(high):>12s}: '
+                            f'{self.jitter[b]}\n')
+        f_out.write(f'{indent}longest gaps:\n')
+        for interval, timestamp in sorted(self.gaps, reverse=True):
+            f_out.write(f'{indent}  {format_us(interval):>12s} '
+                        f'before {recording.format_time(timestamp)}\n')
+        f_out.write(f'{indent}bursts: {self.bursts}')
+        if self.longest_burst:
+            count, start, end = self.longest_burst
+            f_out.write(f', longest: {count} events from '
+                        f'{recording.format_time(start)} to '
+                        f'{recording.format_time(end)}')
+        f_out.write('\n')
+
+
+class RecordingStats(object):
+    """
+    Statistics of all the reports of a recording, per device and report ID.
+    """
+
+    def __init__(self, burst_rate=DEFAULT_BURST_RATE, gaps=DEFAULT_GAPS):
+        self.burst_interval = 1000000 / burst_rate
+        self.max_gaps = gaps
+        self.streams = {}
+
+    def stream(self, event):
+        key = (event.device, event.report_ID)
+        try:
+            return self.streams[key]
+        except KeyError:
+            stats = IntervalStats(self.burst_interval, self.max_gaps)
+            self.streams[key] = stats
+            return stats
+
+    def add(self, event):
+        self.stream(event).add(event.timestamp)
+
+    def add_repeat(self, event, count, interval):
+        """
+        Account for count repetitions of event, every interval microseconds,
+        event being the first one.
+        """
+        self.stream(event).add_repeat(event.timestamp, count, interval)
+
+    def dump(self, f_out):
+        for (device, report_ID), stats in sorted(self.streams.items()):
+            report = f'report ID {report_ID}' if report_ID != -1 \
+                else 'unnumbered reports'
+            f_out.write(f'device {device}, {report}:\n')
+            stats.dump(f_out)
@@ -0,0 +1,249 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Hid replay / slice_hid.py: cut a time window out of a recording
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# The events are never decoded: the sidecar index of the recording gives
+# the position to start from, the lines are then only looked at for their
+# prefix and timestamp, and copied verbatim.
+#
+# Compressed and binary recordings can not be mapped: they are read
+# sequentially as text and indexed in memory, without a sidecar index.
+#
+
+import argparse
+import io
+import mmap
+import os
+import sys
+import hidbin
+import recording
+import recording_index
+
+HEADERS = (b'R:', b'N:', b'P:', b'I:')
+COPY_SIZE = 1 << 20
+
+
+class Window(object):
+    """
+    The part of a recording selected by a time or an event range.
+
+    start and end are the byte offsets of the selected lines, device the
+    device index at start, devices the devices having events in the window
+    and headers the offset of the R: line in use for each of them at start,
+    if any.
+    """
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.device = 0
+        self.devices = set()
+        self.headers = {}
+        self.first_timestamp = None
+
+
+def find_window(data, index, start=None, end=None, first=None, count=None):
+    """
+    Find the window of data, the content of the recording, containing the
+    events between the timestamps start and end (in microseconds), or the
+    count events starting at the first-th one.
+    """
+    skip = 0
+    if first is not None:
+        checkpoint, skip = index.find_event(first)
+    elif start is not None:
+        checkpoint = index.find_time(start)
+    else:
+        checkpoint = index.checkpoints[0] if index.checkpoints else None
+    window = Window()
+    if checkpoint is None:
+        return window
+
+    timestamp, pos, device, rdesc_offset = checkpoint
+    active = {}
+    for offset, dev in index.rdescs:
+        if offset >= pos:
+            break
+        active[dev] = offset
+
+    selected = 0
+    size = len(data)
+    while pos < size:
+        eol = data.find(b'\n', pos)
+        eol = size if eol < 0 else eol + 1
+        prefix = data[pos:pos + 2]
+        if prefix == b'E:':
+            if window.start is None:
+                if skip:
+                    skip -= 1
+                    pos = eol
+                    continue
+                timestamp = recording.parse_time(data[pos:eol].split()[1])
+                if start is not None and timestamp < start:
+                    pos = eol
+                    continue
+                window.start = pos
+                window.device = device
+                window.first_timestamp = timestamp
+            if count is not None and selected >= count:
+                break
+            if end is not None:
+                timestamp = recording.parse_time(data[pos:eol].split()[1])
+                if timestamp > end:
+                    break
+            selected += 1
+            window.end = eol
+            if device not in window.devices:
+                window.devices.add(device)
+                if device in active:
+                    window.headers[device] = active[device]
+        elif prefix == b'R:':
+            # the R: lines inside the window are copied with it, only the
+            # ones before it are headers
+            if window.start is None:
+                active[device] = pos
+        elif prefix == b'D:':
+            device = int(data[pos + 2:eol])
+        pos = eol
+    return window
+
+
+def write_headers(data, offset, f_out):
+    """
+    Write the header lines of a device, R:, N:, P: and I:, starting at the
+    R: line at offset.
+    """
+    pos = offset
+    while data[pos:pos + 2] in HEADERS:
+        eol = data.find(b'\n', pos)
+        eol = len(data) if eol < 0 else eol + 1
+        f_out.write(data[pos:eol])
+        pos = eol
+
+
+def write_window(data, window, f_out, several=False, rebase=False):
+    """
+    Write the window as a standalone recording to f_out, a binary file.
+    """
+    if window.start is None:
+        return
+    for device in sorted(window.devices):
+        if several:
+            f_out.write(f'D: {device}\n'.encode())
+        if device in window.headers:
+            write_headers(data, window.headers[device], f_out)
+    if several:
+        f_out.write(f'D: {window.device}\n'.encode())
+
+    if not rebase:
+        for pos in range(window.start, window.end, COPY_SIZE):
+            f_out.write(data[pos:min(pos + COPY_SIZE, window.end)])
+        return
+
+    pos = window.start
+    while pos < window.end:
+        eol = data.find(b'\n', pos, window.end)
+        eol = window.end if eol < 0 else eol + 1
+        line = data[pos:eol]
+        if line.startswith(b'E:'):
+            tokens = line.split(None, 2)
+            timestamp = recording.parse_time(tokens[1])
+            time = recording.format_time(timestamp - window.first_timestamp)
+            line = b' '.join((tokens[0], time.encode(), tokens[2]))
+        f_out.write(line)
+        pos = eol
+
+
+def read_text(filename):
+    """
+    Return the content of the recording, as text, if it is compressed or
+    binary, None if it is a plain text recording.
+    """
+    if not recording.is_compressed(filename):
+        with open(filename, 'rb') as f:
+            if not hidbin.is_binary(f.read(len(hidbin.MAGIC))):
+                return None
+    with recording.open_recording(filename, 'rb') as f:
+        data = f.read()
+    if hidbin.is_binary(data):
+        text = io.BytesIO()
+        hidbin.binary_to_text(data, text)
+        data = text.getvalue()
+    return data
+
+
+def slice_data(data, index, f_out, start=None, end=None, first=None,
+               count=None, rebase=False):
+    several = len({device for offset, device in index.rdescs}) > 1
+    window = find_window(data, index, start, end, first, count)
+    write_window(data, window, f_out, several, rebase)
+
+
+def slice_hid(filename, f_out, start=None, end=None, first=None,
+              count=None, rebase=False):
+    """
+    Write the events of the recording between the timestamps start and end,
+    in microseconds, or the count events starting at the first-th one, as
+    a standalone recording with the headers of the devices involved.
+    If rebase is set, the timestamps start at 0.
+    """
+    data = read_text(filename)
+    if data is not None:
+        index = recording_index.RecordingIndex(filename)
+        index.scan(data)
+        slice_data(data, index, f_out, start, end, first, count, rebase)
+        return
+    index = recording_index.get_index(filename)
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            slice_data(data, index, f_out, start, end, first, count, rebase)
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description="Cut a time window or a range of events out of a "
+                    "hid-recorder recording.")
+    parser.add_argument("file", help="the recording")
+    parser.add_argument("-o", "--output",
+                        help="the recording to write, stdout if omitted")
+    parser.add_argument("--start", type=recording.parse_time,
+                        help="timestamp of the first event, in seconds")
+    parser.add_argument("--end", type=recording.parse_time,
+                        help="timestamp of the last event, in seconds")
+    parser.add_argument("--first", type=int,
+                        help="index of the first event, instead of --start")
+    parser.add_argument("--count", type=int,
+                        help="number of events to keep")
+    parser.add_argument("--rebase", action="store_true",
+                        help="make the timestamps start at 0")
+    return parser.parse_args()
+
+
+def main():
+    options = get_options()
+    f_out = sys.stdout.buffer
+    if options.output:
+        f_out = open(options.output, 'wb')
+    slice_hid(options.file, f_out, options.start, options.end,
+              options.first, options.count, options.rebase)
+    f_out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/conftest.py: make the tools importable from the tests
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# keep the tests away from the cache of the user
+os.environ["HID_REPLAY_CACHE"] = ""
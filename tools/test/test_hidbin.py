@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_hidbin.py: binary recordings
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import pytest
+import hidbin
+
+
+def event_record(delta, device, report):
+    delta = delta << 1 if delta >= 0 else (-delta << 1) - 1
+    return bytes((hidbin.EVENT,)) + hidbin.encode_varint(delta) + \
+        hidbin.encode_varint(device) + \
+        hidbin.encode_varint(len(report)) + report
+
+
+def repeat_record(count, interval):
+    return bytes((hidbin.REPEAT,)) + hidbin.encode_varint(count) + \
+        hidbin.encode_varint(interval)
+
+
+def make_records():
+    """
+    Return a binary recording and the positions of its records: an event,
+    repeated 3 times every 10 microseconds, then another event.
+    """
+    records = [
+        bytes((hidbin.DEVICE,)) + hidbin.encode_varint(1),
+        event_record(100, 1, b"\x01\x02"),
+        repeat_record(3, 10),
+        event_record(5, 1, b"\x03"),
+    ]
+    data = hidbin.MAGIC + bytes((hidbin.VERSION,))
+    positions = []
+    for record in records:
+        positions.append(len(data))
+        data += record
+    return data, positions
+
+
+def as_tuples(records):
+    return [(tag, device, timestamp,
+             payload if isinstance(payload, tuple) else bytes(payload or b""))
+            for tag, device, timestamp, payload in hidbin.expand(records)]
+
+
+def test_read_records():
+    data, positions = make_records()
+    assert as_tuples(hidbin.read_records(data)) == [
+        (hidbin.DEVICE, 1, None, b""),
+        (hidbin.EVENT, 1, 100, b"\x01\x02"),
+        (hidbin.EVENT, 1, 110, b"\x01\x02"),
+        (hidbin.EVENT, 1, 120, b"\x01\x02"),
+        (hidbin.EVENT, 1, 130, b"\x01\x02"),
+        (hidbin.EVENT, 1, 135, b"\x03"),
+    ]
+
+
+def test_read_records_from_position():
+    data, positions = make_records()
+    full = as_tuples(hidbin.read_records(data))
+    # starting at the event, timestamp being the one of the previous one
+    assert as_tuples(hidbin.read_records(data, positions[1], 0)) == full[1:]
+    # after the repetitions, their last timestamp is the one to give
+    assert as_tuples(hidbin.read_records(data, positions[3], 130)) == \
+        full[-1:]
+
+
+def test_read_records_from_repeat():
+    data, positions = make_records()
+    # the event repeated by the 'X' record is not known
+    with pytest.raises(ValueError, match="repeat without event"):
+        list(hidbin.read_records(data, positions[2], 100))
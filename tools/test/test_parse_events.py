@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_parse_events.py: batch decoding of the events
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import random
+import pytest
+import hidbin
+import parse_hid
+
+numpy = pytest.importorskip("numpy")
+
+# 3 buttons on 1 bit each, signed 8 bits X and Y, not numbered
+MOUSE = bytes.fromhex(
+    "05010902a1010901a100050919012903150025019503750181029505750181030501"
+    "093009311581257f750895028106c0c0")
+
+# report ID 2: signed 12 bits X and Y, 3 bits of padding, 5 buttons, an
+# array of 2 keys and an unsigned 16 bits vendor value
+NUMBERED = bytes.fromhex(
+    "05010902a10185020930093116" "01f826ff07750c95028102"
+    "750395018103"
+    "05091901290515002501750195058102"
+    "0507190029651500256575089502" "8100"
+    "0600ff09011500" "27ffff0000" "751095018102"
+    "c0")
+
+# report ID 3: an unsigned 96 bits value and a signed 72 bits one
+WIDE = bytes.fromhex(
+    "0600ff0902a101850309031500" "27ffffff7f" "756095018102"
+    "0904" "1700000080" "27ffffff7f" "75488102"
+    "c0")
+
+
+def decode_lines(rdesc, reports):
+    rdesc_dict, maybe_numbered = parse_hid.load_layouts(
+        parse_hid.load_rdesc(rdesc))
+    lines = [hidbin.format_event(i * 1000, report).decode()
+             for i, report in enumerate(reports)]
+    return rdesc_dict, maybe_numbered, lines
+
+
+def random_reports(report_ID, size, count=50):
+    rng = random.Random(size)
+    reports = []
+    for i in range(count):
+        report = bytes(rng.randrange(256) for i in range(size))
+        if report_ID != -1:
+            report = bytes((report_ID,)) + report[1:]
+        reports.append(report)
+    return reports
+
+
+@pytest.mark.parametrize("rdesc,report_ID,size", [
+    (MOUSE, -1, 3),
+    (NUMBERED, 2, 9),
+    (WIDE, 3, 22),
+], ids=["mouse", "numbered", "wide"])
+def test_columns_match_parse_event(rdesc, report_ID, size):
+    reports = random_reports(report_ID, size)
+    rdesc_dict, maybe_numbered, lines = decode_lines(rdesc, reports)
+    columns = parse_hid.parse_events(lines, rdesc_dict, maybe_numbered)
+    key = (report_ID, size)
+    assert list(columns) == [key]
+    plan = rdesc_dict[key]
+    batch = columns[key]
+    assert list(batch["timestamp"]) == [i * 1000 for i in range(len(lines))]
+    for row, (line, report) in enumerate(zip(lines, reports)):
+        # the text output is decoded from the same values
+        assert parse_hid.parse_event(line, None, rdesc_dict, maybe_numbered)
+        values = plan.decode(report)
+        for field in plan.data_fields:
+            expected = values[field.index:field.index + field.count]
+            column = batch[field.name]
+            if field.array:
+                got = list(column[row])
+            else:
+                got = [column[row]]
+            assert [int(v) for v in got] == list(expected), field.name
+
+
+def test_signed_and_unaligned_values():
+    # X = -1 and Y = 2047 on 12 bits, all the buttons pressed
+    report = bytes((2,)) + (0xfff | 0x7ff << 12).to_bytes(3, 'little') + \
+        bytes((0xf8, 4, 5, 0x34, 0x12))
+    rdesc_dict, maybe_numbered, lines = decode_lines(NUMBERED, [report])
+    batch = parse_hid.parse_events(lines, rdesc_dict, maybe_numbered)[(2, 9)]
+    assert batch["X"][0] == -1
+    assert batch["Y"][0] == 2047
+    assert batch["X"].dtype == numpy.int16
+    assert [batch[f"B{i}"][0] for i in range(1, 6)] == [1] * 5
+    assert batch["Vendor Usage 1"][0] == 0x1234
+    assert batch["Vendor Usage 1"].dtype == numpy.uint16
+
+
+def test_wide_fields():
+    high = (1 << 96) - 1
+    low = -(1 << 71)
+    report = bytes((3,)) + high.to_bytes(12, 'little') + \
+        (low & ((1 << 72) - 1)).to_bytes(9, 'little')
+    rdesc_dict, maybe_numbered, lines = decode_lines(WIDE, [report])
+    batch = parse_hid.parse_events(lines, rdesc_dict, maybe_numbered)[(3, 22)]
+    plan = rdesc_dict[(3, 22)]
+    wide, signed = plan.data_fields
+    assert batch[wide.name].dtype == object
+    assert batch[wide.name][0] == high
+    assert batch[signed.name][0] == low
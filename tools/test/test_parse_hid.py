@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_parse_hid.py: decoding of whole recordings
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import io
+import random
+import pytest
+import hidbin
+import parse_hid
+
+# 3 buttons on 1 bit each, signed 8 bits X and Y, not numbered
+MOUSE = bytes.fromhex(
+    "05010902a1010901a100050919012903150025019503750181029505750181030501"
+    "093009311581257f750895028106c0c0")
+
+# report ID 1: 8 keys modifiers and an array of 2 keys
+KEYBOARD = bytes.fromhex(
+    "05010906a1018501050719e029e71500250175019508810295027508150025ff"
+    "05071900" "29ff8100c0")
+
+
+def make_recording(count=300):
+    """
+    A recording of two devices: a mouse whose report descriptor changes to
+    a keyboard halfway, and a keyboard. Comments are spread in the events.
+    """
+    rng = random.Random(count)
+    lines = [b"# hid-replay test recording\n"]
+    for device, rdesc in enumerate((MOUSE, KEYBOARD)):
+        lines += [f"D: {device}\n".encode(), b"N: test device\n",
+                  hidbin.format_rdesc(rdesc)]
+    for i in range(count):
+        device = rng.randrange(2)
+        if device == 0 and i == count // 2:
+            lines += [b"D: 0\n", hidbin.format_rdesc(KEYBOARD)]
+        if device == 0 and i < count // 2:
+            report = bytes(rng.randrange(256) for i in range(3))
+        else:
+            report = bytes([1]) + bytes(rng.randrange(256) for i in range(3))
+        lines += [f"D: {device}\n".encode(),
+                  hidbin.format_event(i * 997, report)]
+        if i % 50 == 0:
+            lines.append(f"# comment {i}\n".encode())
+    return b"".join(lines)
+
+
+def parse_serial(path):
+    output = io.StringIO()
+    with open(path) as f:
+        parse_hid.parse_hid(f, output)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("newline", [b"\n", b"\r\n"], ids=["lf", "crlf"])
+@pytest.mark.parametrize("chunk_size", [1, 200, 1 << 20])
+def test_parallel_matches_serial(tmp_path, newline, chunk_size):
+    path = str(tmp_path / "test.hid")
+    with open(path, "wb") as f:
+        f.write(make_recording().replace(b"\n", newline))
+    expected = parse_serial(path)
+    assert "# comment 50" in expected and "\r" not in expected
+    output = io.StringIO()
+    parse_hid.parse_hid_parallel(path, output, 2, chunk_size)
+    assert output.getvalue() == expected
+
+
+@pytest.mark.parametrize("newline", [b"\n", b"\r\n"], ids=["lf", "crlf"])
+def test_per_device_matches_serial(tmp_path, newline):
+    path = str(tmp_path / "test.hid")
+    with open(path, "wb") as f:
+        f.write(make_recording().replace(b"\n", newline))
+    expected = parse_serial(path)
+    output = io.StringIO()
+    parse_hid.parse_hid_devices(path, output, 2)
+    lines = output.getvalue().splitlines()
+    assert sorted(line for line in lines if not line.startswith("D:")) == \
+        sorted(line for line in expected.splitlines()
+               if not line.startswith("D:"))
+
+
+def test_per_device_later_descriptor(tmp_path):
+    path = str(tmp_path / "test.hid")
+    with open(path, "wb") as f:
+        f.write(make_recording())
+    output = io.StringIO()
+    parse_hid.parse_hid_devices(path, output, 2)
+    # the keyboard descriptor of device 0 is dumped before its first
+    # keyboard report, the one of device 1 being in the headers
+    device = None
+    dumped = []
+    for line in output.getvalue().splitlines():
+        if line.startswith("D:"):
+            device = int(line[2:])
+        elif "Usage (Keyboard)" in line:
+            dumped.append(device)
+        elif "ReportID: 1" in line and device == 0:
+            break
+    else:
+        assert False, "no keyboard report on device 0"
+    assert dumped == [1, 0]
+
+
+def non_canonical(recording):
+    """
+    Rewrite some lines of recording so they are stored verbatim in 'T'
+    records by hidbin: extra spaces, short timestamps, wrong sizes and
+    non canonical device numbers.
+    """
+    lines = recording.splitlines(keepends=True)
+    for i, line in enumerate(lines):
+        if line.startswith(b"E: ") and i % 7 == 0:
+            lines[i] = line.replace(b" ", b"  ", 2)
+        elif line.startswith(b"E: ") and i % 7 == 1:
+            timestamp, size, report = line.split(b" ", 3)[1:]
+            lines[i] = b" ".join([b"E:", timestamp.rstrip(b"0"),
+                                  size, report])
+        elif line.startswith(b"E: ") and i % 7 == 2:
+            # declares a shorter report than the actual one
+            timestamp, size, report = line.split(b" ", 3)[1:]
+            lines[i] = b" ".join([b"E:", timestamp,
+                                  str(int(size) - 1).encode(), report])
+        elif line.startswith(b"R: "):
+            size, rdesc = line.split(b" ", 2)[1:]
+            lines[i] = b"R: 9999 " + rdesc
+        elif line == b"D: 1\n" and i % 2:
+            lines[i] = b"D: 01\n"
+    return b"".join(lines)
+
+
+@pytest.mark.parametrize("run_length", [False, True])
+def test_binary_matches_text(tmp_path, run_length):
+    text = non_canonical(make_recording())
+    binary = io.BytesIO()
+    hidbin.text_to_binary(io.BytesIO(text), binary, run_length)
+    records = list(hidbin.read_records(binary.getvalue()))
+    for tag in (hidbin.EVENT, hidbin.RDESC, hidbin.DEVICE):
+        assert any(record[0] == hidbin.TEXT and
+                   bytes(record[3]).startswith(bytes((tag,)) + b":")
+                   for record in records)
+
+    expected = io.StringIO()
+    parse_hid.write_records(
+        parse_hid.read_records(io.StringIO(text.decode())), expected)
+    output = io.StringIO()
+    parse_hid.write_records(
+        parse_hid.read_binary_records(binary.getvalue()), output)
+    assert output.getvalue() == expected.getvalue()
+
+
+def event_tuples(events):
+    return [(event.timestamp, event.device, event.report)
+            for event in events]
+
+
+@pytest.mark.parametrize("run_length", [False, True])
+def test_read_events_binary(tmp_path, run_length):
+    text = make_recording()
+    # runs of identical reports, collapsed in 'X' records in binary
+    text += b"D: 1\n" + b"".join(
+        hidbin.format_event(1000000 + i * 8000, b"\x01\x00\x04\x00")
+        for i in range(20))
+    binary = io.BytesIO()
+    hidbin.text_to_binary(io.BytesIO(text), binary, run_length)
+    assert (bytes((hidbin.REPEAT,)) + bytes((19,)) in binary.getvalue()) \
+        == run_length
+
+    expected = event_tuples(
+        parse_hid.read_events(io.StringIO(text.decode())))
+    assert len(expected) > 300
+    assert event_tuples(parse_hid.read_events(io.BytesIO(text))) == expected
+    binary.seek(0)
+    assert event_tuples(parse_hid.read_events(binary)) == expected
+
+    path = tmp_path / "test.hidb"
+    path.write_bytes(binary.getvalue())
+    with open(str(path), "rb") as f:
+        assert event_tuples(parse_hid.read_events(f)) == expected
+    events = parse_hid.read_range(str(path), 1000000 + 4 * 8000,
+                                  1000000 + 10 * 8000)
+    selected = []
+    for record in events:
+        if isinstance(record, parse_hid.Event):
+            selected.append(record)
+        elif isinstance(record, parse_hid.Repeat):
+            selected.extend(record.events())
+    assert event_tuples(selected) == \
+        [t for t in expected if 1032000 <= t[0] <= 1080000]
+
+
+def test_event_values_skip_empty_slots():
+    text = b"".join([b"D: 0\n", hidbin.format_rdesc(KEYBOARD),
+                     hidbin.format_event(0, b"\x01\x02\x04\x00"),
+                     hidbin.format_event(1000, b"\x01\x00\x00\x00"),
+                     hidbin.format_event(2000, b"\x01\x00\x00\x05")])
+    events = list(parse_hid.read_events(io.BytesIO(text)))
+    assert [event.values["Keyboard"] for event in events] == \
+        [["a and A"], [], ["b and B"]]
+    assert events[0].values["LeftShift"] == 1
+    # the text output keeps the empty slots
+    event = events[0]
+    assert "Keyboard [a and A, 00]" in \
+        parse_hid.get_report("0.000000", event.report, event.plan)
+
+
+def test_delta_key_press_and_release():
+    reports = [b"\x01\x00\x00\x00",
+               b"\x01\x00\x04\x00",  # a pressed
+               b"\x01\x00\x04\x05",  # b pressed, all the slots are used
+               b"\x01\x02\x05\x00",  # a released, shift pressed
+               b"\x01\x02\x05\x00",  # repeated
+               b"\x01\x00\x00\x00"]  # all released
+    text = b"".join([b"D: 0\n", hidbin.format_rdesc(KEYBOARD)] +
+                    [hidbin.format_event(i * 1000, report)
+                     for i, report in enumerate(reports)])
+    output = io.StringIO()
+    parse_hid.parse_hid(io.StringIO(text.decode()), output, delta=True)
+    lines = [line.split(" / ", 1)[1] for line in output.getvalue().splitlines()
+             if line.startswith("  ")]
+    # the empty slots of the first report are not pressed keys
+    assert "Keyboard" not in lines[0]
+    assert lines[1:] == [
+        "Keyboard +[a and A]",
+        "Keyboard +[b and B]",
+        "LeftShift: 1 | Keyboard -[a and A]",
+        "LeftShift: 0 | Keyboard -[b and B]",
+    ]
+
+
+@pytest.mark.parametrize("binary", [False, True], ids=["text", "binary"])
+def test_usages_projection(binary):
+    text = make_recording()
+    data = text
+    if binary:
+        output = io.BytesIO()
+        hidbin.text_to_binary(io.BytesIO(text), output)
+        data = output.getvalue()
+    full = list(parse_hid.read_events(io.BytesIO(text)))
+    for usages in ({"LeftShift"}, {"X", "LeftShift"}, {"Keyboard"}):
+        expected = []
+        for event in full:
+            values = {name: value for name, value in event.values.items()
+                      if name in usages}
+            if values:
+                expected.append((event.timestamp, event.device, values))
+        events = parse_hid.read_events(io.BytesIO(data), usages)
+        assert [(event.timestamp, event.device, event.values)
+                for event in events] == expected
+
+    # the text output only prints the selected fields
+    output = io.StringIO()
+    parse_hid.parse_hid(io.StringIO(text.decode()), output, {"LeftShift"})
+    events = [line for line in output.getvalue().splitlines()
+              if line.startswith("  ")]
+    assert len(events) == len([e for e in full if e.report_ID == 1])
+    for line in events:
+        assert line.split(" / ")[1].split(":")[0] == "LeftShift"
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_parse_rdesc.py: parsing of the report descriptors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import io
+import parse_rdesc
+
+
+def fields(rdesc):
+    rdesc_object = parse_rdesc.parse_rdesc_bytes(bytes.fromhex(rdesc))
+    report, size = rdesc_object.reports[-1]
+    return report
+
+
+def test_array_usage_range():
+    # Usage Minimum 4, Usage Maximum 6, 2 values of 8 bits, Array
+    field, = fields("050719042906150025ff750895028100")
+    assert list(field.usages) == [0x70004, 0x70005, 0x70006]
+
+
+def test_array_reversed_usage_range_is_empty():
+    # Usage Minimum 6, Usage Maximum 4, Array
+    field, = fields("050719062904150025ff750895028100")
+    assert list(field.usages) == []
+
+
+def test_variable_reversed_usage_range():
+    # Usage Minimum 6, Usage Maximum 4, 3 values of 1 bit, Variable,
+    # followed by 13 bits of padding
+    field, padding = fields("05091906290415002501750195038102"
+                            "750d95018101")
+    assert list(field.usages) == [0x90006, 0x90006, 0x90006]
+
+
+def test_variable_usages_repeat_the_last_one():
+    # Usage 0x30, Usage 0x31, 3 values of 8 bits, Variable
+    field, = fields("0501093009311581257f750895038102")
+    assert list(field.usages) == [0x10030, 0x10031, 0x10031]
+
+
+RDESCS = [
+    "050719042906150025ff750895028100",
+    "050719062904150025ff750895028100",
+    "05091906290415002501750195038102750d95018101",
+    "0501093009311581257f750895038102",
+    # Report ID, Push/Pop, negative Logical Minimum, Unit Exponent and a
+    # Win 8 certification blob, with a trailing 0
+    "05010902a101850105091901290315002501750195038102750595018101"
+    "a40501093016018026ff7f550e6511751095018102b4"
+    "0600ff09c5150026ff007508960101b102c000",
+]
+
+
+def dump(rdesc_object, type_output):
+    output = io.StringIO()
+    saved = parse_rdesc.type_output
+    parse_rdesc.type_output = type_output
+    try:
+        rdesc_object.dump(output)
+    finally:
+        parse_rdesc.type_output = saved
+    return output.getvalue()
+
+
+def test_hex_and_bytes_paths_match_the_item_path():
+    for rdesc in RDESCS:
+        data = bytes.fromhex(rdesc)
+        # reference: one raw_item per item, fed byte per byte
+        expected = parse_rdesc.ReportDescriptor()
+        for i, value in enumerate(data):
+            if i == len(data) - 1 and value == 0 and \
+                    expected.current_item is None:
+                # trailing 0
+                break
+            expected.consume(value, i + 1)
+        expected.close_rdesc()
+
+        hex_rdesc = " ".join(f'{v:02x}' for v in data)
+        from_hex = parse_rdesc.parse_rdesc(f'R: {len(data)} {hex_rdesc}')
+        from_bytes = parse_rdesc.parse_rdesc_bytes(bytearray(data))
+        for rdesc_object in (from_hex, from_bytes):
+            assert repr(rdesc_object.reports) == repr(expected.reports)
+            assert rdesc_object.win8 == expected.win8
+            assert rdesc_object.data_txt() == expected.data_txt()
+            assert rdesc_object.size() == expected.size()
+            for type_output in ("default", "kernel"):
+                assert dump(rdesc_object, type_output) == \
+                    dump(expected, type_output)
+
+
+def test_trailing_zero_is_skipped():
+    data = bytes.fromhex(RDESCS[-1])
+    rdesc_object = parse_rdesc.parse_rdesc_bytes(data)
+    assert rdesc_object.size() == len(data) - 1
+    assert rdesc_object.data_txt().endswith("b1 02 c0")
+    assert rdesc_object.win8
+    # a 0 which is the data of the last item is kept
+    rdesc_object = parse_rdesc.parse_rdesc_bytes(bytes.fromhex(RDESCS[0]))
+    assert rdesc_object.data_txt().endswith("81 00")
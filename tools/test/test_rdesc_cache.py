@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_rdesc_cache.py: persistent cache of parsed report
+# descriptors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import io
+import os
+import parse_rdesc
+import rdesc_cache
+
+MOUSE = bytes.fromhex(
+    "05010902a1010901a100050919012903150025019503750181029505750181030501"
+    "093009311581257f750895028106c0c0")
+
+
+def dump(rdesc_object):
+    output = io.StringIO()
+    rdesc_object.dump(output)
+    return output.getvalue()
+
+
+# a keyboard, with an Array field, followed by the Win 8 certification blob
+KEYBOARD = bytes.fromhex(
+    "05010906a101050719e029e71500250175019508810295017508810395067508"
+    "150025650507190029658100c0"
+    "0600ff09c5150026ff007508960101b102")
+
+
+def test_hit_is_a_parsed_descriptor(tmp_path, monkeypatch):
+    for rdesc in (MOUSE, KEYBOARD):
+        cache = rdesc_cache.RDescCache(str(tmp_path))
+        expected = parse_rdesc.parse_rdesc_bytes(rdesc)
+        first = cache.parse_bytes(rdesc)
+        assert os.path.exists(cache.filename(cache.key(rdesc)))
+
+        # a hit is rebuilt from the stored layouts, without parsing
+        with monkeypatch.context() as m:
+            m.setattr(rdesc_cache.CachedReportDescriptor, "consume_bytes",
+                      None)
+            hit = rdesc_cache.RDescCache(str(tmp_path)).load(cache.key(rdesc))
+            assert hit is not None
+            assert dump(hit) == dump(first) == dump(expected)
+            assert hit.win8 == expected.win8
+            assert repr(hit.reports) == repr(expected.reports)
+            plans = expected.plans()
+            assert hit.plans().keys() == plans.keys()
+            for (report_ID, size), plan in plans.items():
+                report = bytes(range(1, size + 1))
+                assert hit.plans()[(report_ID, size)].decode(report) == \
+                    plan.decode(report)
+        assert hit.data_txt() == expected.data_txt()
+
+
+def test_invalid_entries_are_misses(tmp_path):
+    cache = rdesc_cache.RDescCache(str(tmp_path))
+    cache.parse_bytes(MOUSE)
+    key = cache.key(MOUSE)
+    for content in (b"", b"garbage", b"[]", b'{"version": 1}',
+                    b'{"version": "%s", "data": "zz", "dumps": {}}'
+                    % cache.stamp.encode(),
+                    b'{"version": "%s", "data": "00", "dumps": {}}'
+                    % cache.stamp.encode(),
+                    b'{"version": "%s", "data": "%s", "dumps": {}, '
+                    b'"win8": false, "reports": [[1, 2, [[2]]]]}'
+                    % (cache.stamp.encode(), MOUSE.hex().encode())):
+        with open(cache.filename(key), "wb") as f:
+            f.write(content)
+        assert cache.load(key) is None
+        assert dump(cache.parse_bytes(MOUSE)) == \
+            dump(parse_rdesc.parse_rdesc_bytes(MOUSE))
+
+
+def test_eviction(tmp_path):
+    cache = rdesc_cache.RDescCache(str(tmp_path), max_size=4096)
+    for i in range(64):
+        cache.parse_bytes(MOUSE + bytes((0x09, i)))
+    size = sum(e.stat().st_size for e in os.scandir(str(tmp_path)))
+    assert size <= 4096 + 4096 // rdesc_cache.EVICT_FRACTION
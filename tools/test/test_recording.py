@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_recording.py: parsing of the recorded lines
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import pytest
+import recording
+
+
+@pytest.mark.parametrize("text,timestamp", [
+    ("0.000000", 0),
+    ("0.000001", 1),
+    ("1.000000", 1000000),
+    ("12.345678", 12345678),
+    ("1.5", 1500000),
+    ("7", 7000000),
+    ("4294967296.999999", 4294967296999999),
+    ("123456789012345.000001", 123456789012345000001),
+])
+def test_parse_time(text, timestamp):
+    assert recording.parse_time(text) == timestamp
+    assert recording.parse_time(text.encode()) == timestamp
+
+
+@pytest.mark.parametrize("timestamp", [
+    0, 1, 999999, 1000000, 1000001, 1600000000123456,
+    123456789012345000001,
+])
+def test_time_round_trip(timestamp):
+    text = recording.format_time(timestamp)
+    assert len(text.split(".")[1]) == 6
+    assert recording.parse_time(text) == timestamp
+    assert recording.parse_time(text.encode()) == timestamp
+
+
+@pytest.mark.parametrize("text", ["", ".", "x.000001", "1.-5", "1.0x",
+                                  "1.2.3", b"\xff.0"])
+def test_parse_time_invalid(text):
+    with pytest.raises(ValueError):
+        recording.parse_time(text)
+
+
+@pytest.mark.parametrize("line", [
+    "E: 0.000001 3 01 02 03\n",
+    "E: 0.000001 3 01 02 03",
+    "E: 0.000001 3 01 02 03\r\n",
+    "E:  0.000001  3  01 02 03 \n",
+])
+def test_split_event(line):
+    expected = (1, 3, b"\x01\x02\x03")
+    assert recording.split_event(line) == expected
+    assert recording.split_event(line.encode()) == expected
+
+
+def test_split_event_empty_report():
+    assert recording.split_event("E: 2.5 0\n") == (2500000, 0, b"")
+    assert recording.split_event(b"E: 2.5 0") == (2500000, 0, b"")
+
+
+def test_split_event_size_is_not_checked():
+    assert recording.split_event("E: 1.0 4 01 02\n") == \
+        (1000000, 4, b"\x01\x02")
+    assert recording.split_event(b"E: 1.0 1 01 02\n") == \
+        (1000000, 1, b"\x01\x02")
+
+
+@pytest.mark.parametrize("line", [
+    "", "\n", "E:", "E: 1.000000", "E: 1.000000\n", "E: x 3 01 02 03",
+    "E: 1.000000 three 01", "E: 1.000000 1 0", "E: 1.000000 1 zz",
+])
+def test_split_event_invalid(line):
+    with pytest.raises(ValueError):
+        recording.split_event(line)
+    with pytest.raises(ValueError):
+        recording.split_event(line.encode())
+
+
+@pytest.mark.parametrize("line", [
+    "R: 3 05 01 09\n",
+    "R: 3 05 01 09",
+    "R: 3 05 01 09\r\n",
+    "3 05 01 09",
+    "O: 3 05 01 09\n",
+])
+def test_split_rdesc(line):
+    expected = (3, b"\x05\x01\x09")
+    assert recording.split_rdesc(line) == expected
+    assert recording.split_rdesc(line.encode()) == expected
+
+
+def test_split_rdesc_size_mismatch():
+    # the declared size is returned as is, the payload prevails
+    assert recording.split_rdesc("R: 5 05 01 09\n") == (5, b"\x05\x01\x09")
+    assert recording.split_rdesc(b"R: 1 05 01\n") == (1, b"\x05\x01")
+    assert recording.split_rdesc("R: 0\n") == (0, b"")
+
+
+@pytest.mark.parametrize("line", [
+    "", "\n", "R:", "R: \n", "R: x 05", "R: 2 05 0", "R: 2 zz 01",
+])
+def test_split_rdesc_invalid(line):
+    with pytest.raises(ValueError):
+        recording.split_rdesc(line)
+    with pytest.raises(ValueError):
+        recording.split_rdesc(line.encode())
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_recording_index.py: sidecar time index of
+# recordings
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import json
+import os
+import pickle
+import pytest
+import hidbin
+import recording_index
+
+RDESC = bytes.fromhex("05010902a101150025017501950381020509c0")
+
+
+def make_recording(count, first=0):
+    lines = []
+    if not first:
+        lines += [b"D: 0\n", hidbin.format_rdesc(RDESC)]
+    for i in range(first, first + count):
+        lines.append(hidbin.format_event(i * 1000, bytes((i & 7,))))
+    return b"".join(lines)
+
+
+def state(index):
+    return (index.checkpoints, index.timestamps, index.rdescs, index.offset,
+            index.device, index.events, index.active, index.fingerprint)
+
+
+def test_save_and_load(tmp_path):
+    path = tmp_path / "test.hid"
+    path.write_bytes(make_recording(100))
+    index = recording_index.get_index(str(path), step=10)
+    assert len(index.checkpoints) == 10
+    assert index.find_time(55000) == index.checkpoints[5]
+
+    with open(index.index_filename) as f:
+        assert json.load(f)["version"] == recording_index.INDEX_VERSION
+    loaded = recording_index.RecordingIndex(str(path), step=10)
+    assert loaded.load()
+    assert state(loaded) == state(index)
+    assert not loaded.update()
+
+    # another step, the index is rebuilt
+    assert not recording_index.RecordingIndex(str(path), step=20).load()
+
+
+def test_append_and_rewrite(tmp_path):
+    path = tmp_path / "test.hid"
+    path.write_bytes(make_recording(100))
+    recording_index.get_index(str(path), step=10)
+    with open(str(path), "ab") as f:
+        f.write(make_recording(50, 100))
+    index = recording_index.get_index(str(path), step=10)
+    assert len(index.checkpoints) == 15
+    assert index.checkpoints[-1][0] == 140000
+
+    path.write_bytes(make_recording(30))
+    index = recording_index.get_index(str(path), step=10)
+    assert len(index.checkpoints) == 3
+    assert index.events == 30
+
+
+@pytest.mark.parametrize("content", [
+    b"", b"garbage", b"[]", b"{}", b'{"version": 2, "step": 10}',
+    b'{"version": 2, "step": 10, "checkpoints": [[1, 2]], "rdescs": [],'
+    b' "active": [], "offset": 0, "device": 0, "events": 0,'
+    b' "fingerprint": null, "size": 0, "mtime": 0}',
+    b'{"version": 2, "step": 10, "checkpoints": [], "rdescs": [],'
+    b' "active": {}, "offset": "x", "device": 0, "events": 0,'
+    b' "fingerprint": 3, "size": 0, "mtime": 0}',
+])
+def test_invalid_index_is_stale(tmp_path, content):
+    path = tmp_path / "test.hid"
+    path.write_bytes(make_recording(100))
+    expected = state(recording_index.get_index(str(path), step=10))
+    index = recording_index.RecordingIndex(str(path), step=10)
+    with open(index.index_filename, "wb") as f:
+        f.write(content)
+    assert not index.load()
+    assert state(recording_index.get_index(str(path), step=10)) == expected
+
+
+class Exploit(object):
+    def __reduce__(self):
+        return (open, (os.environ["EXPLOIT_MARKER"], "w"))
+
+
+def test_pickle_is_not_loaded(tmp_path, monkeypatch):
+    path = tmp_path / "test.hid"
+    path.write_bytes(make_recording(100))
+    marker = tmp_path / "marker"
+    monkeypatch.setenv("EXPLOIT_MARKER", str(marker))
+    index = recording_index.RecordingIndex(str(path), step=10)
+    with open(index.index_filename, "wb") as f:
+        pickle.dump({"version": 1, "step": 10, "state": Exploit()}, f)
+    assert not index.load()
+    assert not marker.exists()
+    assert recording_index.get_index(str(path), step=10).events == 100
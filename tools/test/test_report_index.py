@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_report_index.py: index of the decode plans
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import parse_hid
+
+
+def check_sizes(index):
+    sizes = {}
+    for report_ID, size in index:
+        sizes.setdefault(report_ID, []).append(size)
+    assert index.sizes == {k: sorted(v) for k, v in sizes.items()}
+
+
+def test_sizes_follow_the_plans():
+    index = parse_hid.ReportIndex({(1, 8): "a", (1, 4): "b"})
+    check_sizes(index)
+    index.update({(2, 3): "c"}, **{})
+    index.update([((1, 6), "d")])
+    index[(1, 4)] = "e"
+    assert index.setdefault((3, 2), "f") == "f"
+    assert index.setdefault((3, 2), "g") == "f"
+    check_sizes(index)
+    assert index.sizes[1] == [4, 6, 8]
+
+    assert index.pop((1, 6)) == "d"
+    del index[(2, 3)]
+    check_sizes(index)
+    assert 2 not in index.sizes
+    assert index.popitem() is not None
+    check_sizes(index)
+
+    index.clear()
+    assert len(index) == 0 and index.sizes == {}
+
+
+def test_find_rkey_after_removal():
+    index = parse_hid.ReportIndex({(1, 4): "a", (1, 8): "b"})
+    assert parse_hid.find_rkey(1, 10, index, False) == (1, 8)
+    del index[(1, 8)]
+    assert parse_hid.find_rkey(1, 10, index, False) == (1, 4)
+    assert index.get((1, 8)) is None
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_report_stats.py: timing statistics of the reports
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import io
+import random
+import pytest
+import report_stats
+
+BURST_INTERVAL = 1000000 / report_stats.DEFAULT_BURST_RATE
+
+
+def interval_stats(timestamps):
+    stats = report_stats.IntervalStats(BURST_INTERVAL)
+    for timestamp in timestamps:
+        stats.add(timestamp)
+    return stats
+
+
+def test_constant_interval_percentiles():
+    stats = interval_stats(range(0, 100000, 1000))
+    assert stats.min == stats.max == 1000
+    for p in report_stats.PERCENTILES:
+        assert stats.percentile(p) == 1000
+
+
+def test_percentiles():
+    rng = random.Random(0)
+    intervals = [rng.randrange(1, 20000) for i in range(10000)]
+    timestamps = [0]
+    for interval in intervals:
+        timestamps.append(timestamps[-1] + interval)
+    stats = interval_stats(timestamps)
+    intervals.sort()
+    for p in report_stats.PERCENTILES:
+        exact = intervals[int(p * len(intervals) / 100) - 1]
+        assert stats.percentile(p) == pytest.approx(exact, rel=0.125)
+        assert stats.min <= stats.percentile(p) <= stats.max
+
+
+def test_jitter():
+    # intervals: 1000, 1000, 1500, 1000, 1003
+    stats = interval_stats([0, 1000, 2000, 3500, 4500, 5503])
+    # one bucket per bit length of the jitter
+    assert stats.jitter == {0: 1, 9: 2, 2: 1}
+    output = io.StringIO()
+    stats.dump(output)
+    assert "<=     0.511 ms: 2" in output.getvalue()
+
+
+def test_bursts():
+    # 8000 us between the bursts, 100 us in the bursts
+    timestamps = [0, 8000, 8100, 8200, 16200, 24200, 24300, 24400, 24500,
+                  24600, 32600]
+    stats = interval_stats(timestamps)
+    stats.end_burst(stats.last)
+    assert stats.bursts == 2
+    assert stats.longest_burst == (5, 24200, 24600)
+    gaps = sorted(stats.gaps, reverse=True)
+    assert gaps[0] == (8000, 32600)
+
+
+@pytest.mark.parametrize("interval", [100, 1000, 8000])
+def test_add_repeat_matches_add(interval):
+    # more gaps than pauses between the repeats
+    expected = report_stats.IntervalStats(BURST_INTERVAL, gaps=20)
+    stats = report_stats.IntervalStats(BURST_INTERVAL, gaps=20)
+    timestamp = 0
+    for count in (1, 3, 20, 1, 2, 50):
+        for i in range(count):
+            expected.add(timestamp + i * interval)
+        stats.add_repeat(timestamp, count, interval)
+        timestamp += count * interval + 7000
+    for attr in ("count", "first", "last", "last_interval", "intervals",
+                 "min", "max", "histogram", "jitter", "bursts",
+                 "burst_start", "burst_count", "longest_burst"):
+        assert getattr(stats, attr) == getattr(expected, attr), attr
+    assert sorted(stats.gaps) == sorted(expected.gaps)
+    assert stats.mean == pytest.approx(expected.mean)
+    assert stats.m2 == pytest.approx(expected.m2)
+    output = io.StringIO()
+    stats.dump(output)
+    expected_output = io.StringIO()
+    expected.dump(expected_output)
+    assert output.getvalue() == expected_output.getvalue()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_slice_hid.py: windows of recordings
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import gzip
+import io
+import os
+import pytest
+import hidbin
+import slice_hid
+
+RDESC_A = bytes.fromhex("05010902a101150025017501950881020509c0")
+RDESC_B = bytes.fromhex("05010906a101150025017501950881020507c0")
+
+
+def make_recording():
+    """
+    Device 0 has its descriptor from the start and a new one at 5s,
+    device 1 only gets its descriptor at 5s.
+    """
+    lines = [b"D: 0\n", hidbin.format_rdesc(RDESC_A), b"N: zero\n"]
+    for i in range(10):
+        if i == 5:
+            lines += [b"D: 0\n", hidbin.format_rdesc(RDESC_B),
+                      b"D: 1\n", hidbin.format_rdesc(RDESC_A),
+                      b"N: one\n"]
+        for device in (0, 1):
+            lines += [f"D: {device}\n".encode(),
+                      hidbin.format_event(i * 1000000 + device, bytes((i,)))]
+    return b"".join(lines)
+
+
+def slice_lines(tmp_path, start, end):
+    path = tmp_path / "test.hid"
+    path.write_bytes(make_recording())
+    output = io.BytesIO()
+    slice_hid.slice_hid(str(path), output, start, end)
+    return output.getvalue().splitlines()
+
+
+def rdescs(lines):
+    """
+    Return the (device, rdesc) of the R: lines, in order.
+    """
+    device = 0
+    result = []
+    for line in lines:
+        if line.startswith(b"D:"):
+            device = int(line[2:])
+        elif line.startswith(b"R:"):
+            result.append((device, line))
+    return result
+
+
+def test_descriptor_inside_window(tmp_path):
+    lines = slice_lines(tmp_path, 3000000, 7000001)
+    a = hidbin.format_rdesc(RDESC_A).rstrip()
+    b = hidbin.format_rdesc(RDESC_B).rstrip()
+    # device 0 gets its header, then its new descriptor in place; device 1
+    # only has the one in the window
+    assert rdescs(lines) == [(0, a), (0, b), (1, a)]
+    assert lines.count(b"N: one") == 1
+    assert len([line for line in lines if line.startswith(b"E:")]) == 10
+
+
+def test_descriptors_before_window(tmp_path):
+    lines = slice_lines(tmp_path, 6000000, 7000001)
+    a = hidbin.format_rdesc(RDESC_A).rstrip()
+    b = hidbin.format_rdesc(RDESC_B).rstrip()
+    assert rdescs(lines) == [(0, b), (1, a)]
+    assert lines.count(b"N: one") == 1
+
+
+@pytest.mark.parametrize("kind", ["gz", "hidb", "hidb.gz"])
+def test_compressed_and_binary(tmp_path, kind):
+    expected = slice_lines(tmp_path, 3000000, 7000001)
+    text = make_recording()
+    if kind.startswith("hidb"):
+        binary = io.BytesIO()
+        hidbin.text_to_binary(io.BytesIO(text), binary)
+        text = binary.getvalue()
+    if kind.endswith("gz"):
+        text = gzip.compress(text)
+    path = tmp_path / f"test.{kind}"
+    path.write_bytes(text)
+    output = io.BytesIO()
+    slice_hid.slice_hid(str(path), output, 3000000, 7000001)
+    assert output.getvalue().splitlines() == expected
+    # no sidecar index, it would not match the content of the file
+    assert not os.path.exists(f"{path}.idx")
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_usbmon.py: readers of usbmon captures
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import io
+import struct
+import pytest
+import usbmon
+
+CAPTURE = b"".join(line + b"\n" for line in (
+    b"ffff8800aabbcc00 1000000 S Ci:3:002:0 s 80 06 0100 0000 0012 18 <",
+    b"ffff8800aabbcc00 1000997 C Ci:3:002:0 0 18 = 12010002 00000040 "
+    b"6d042ac5 00010102 0001",
+    b"ffff8800aabbcc00 1001994 S Co:3:002:0 s 21 09 0200 0001 0001 1 = 02",
+    b"ffff8800aabbcc00 1002991 C Co:3:002:0 0 1 >",
+    b"ffff8800aabbcc00 1003988 S Ii:3:002:1 -115:8 8 <",
+    b"ffff8800aabbcc00 1004985 C Ii:3:002:1 0:8 3 = 000b16",
+    # only the first 8 bytes of the report are captured
+    b"ffff8800aabbcc00 2005982 C Ii:3:002:2 0:8 16 = 25303b46 515c6772",
+    b"ffff8800aabbcc00 2006979 C Ii:3:002:2 -108:8 0",
+))
+
+
+def urb_tuples(urbs):
+    return [tuple(bytes(v) if isinstance(v, memoryview) else v
+                  for v in (getattr(urb, slot) for slot in urb.__slots__))
+            for urb in urbs]
+
+
+def text_urbs():
+    return list(usbmon.read_text(io.BytesIO(CAPTURE)))
+
+
+def mon_bin(urb, endian="=", header_size=48):
+    """
+    Return the binary record of urb: its struct mon_bin_hdr and its data.
+    """
+    epnum = urb.endpoint | (0x80 if urb.direction_in else 0)
+    header = struct.pack(endian + usbmon.MON_BIN_FORMAT, 0xffff8800aabbcc00,
+                         urb.event_type, urb.transfer_type, epnum,
+                         urb.device, urb.bus,
+                         b"\0" if urb.setup else b"-",
+                         b"\0" if urb.data else b"<",
+                         urb.timestamp // 1000000, urb.timestamp % 1000000,
+                         urb.status, urb.length, len(urb.data),
+                         urb.setup or bytes(8))
+    if header_size == 64:
+        # interval, start_frame, xfer_flags, ndesc
+        header += struct.pack(endian + "iiII", 8, 0, 0, 0)
+    return header + urb.data
+
+
+def pcap(urbs, endian, linktype):
+    header_size = usbmon.link_header_size(linktype)
+    data = struct.pack(endian + "IHHiIII", usbmon.PCAP_MAGICS[0], 2, 4, 0, 0,
+                       65535, linktype)
+    for urb in urbs:
+        packet = mon_bin(urb, endian, header_size)
+        data += struct.pack(endian + "IIII", urb.timestamp // 1000000,
+                            urb.timestamp % 1000000, len(packet),
+                            len(packet))
+        data += packet
+    return data
+
+
+def pcapng_block(endian, block_type, body):
+    body += bytes(-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack(endian + "II", block_type, length) + body + \
+        struct.pack(endian + "I", length)
+
+
+def pcapng(urbs, endian, simple=False):
+    data = pcapng_block(endian, usbmon.PCAPNG_SECTION_HEADER,
+                        struct.pack(endian + "IHHq",
+                                    usbmon.PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1))
+    interface = 0
+    if not simple:
+        # an ethernet interface, whose packets are skipped
+        data += pcapng_block(endian, usbmon.PCAPNG_INTERFACE_DESCRIPTION,
+                             struct.pack(endian + "HHI", 1, 0, 0))
+        data += pcapng_block(endian, usbmon.PCAPNG_ENHANCED_PACKET,
+                             struct.pack(endian + "IIIII", 0, 0, 0, 60, 60) +
+                             bytes(60))
+        interface = 1
+    data += pcapng_block(endian, usbmon.PCAPNG_INTERFACE_DESCRIPTION,
+                         struct.pack(endian + "HHI",
+                                     usbmon.LINKTYPE_USB_LINUX_MMAPPED, 0, 0))
+    for urb in urbs:
+        packet = mon_bin(urb, endian, 64)
+        if simple:
+            data += pcapng_block(endian, usbmon.PCAPNG_SIMPLE_PACKET,
+                                 struct.pack(endian + "I", len(packet)) +
+                                 packet)
+        else:
+            data += pcapng_block(endian, usbmon.PCAPNG_ENHANCED_PACKET,
+                                 struct.pack(endian + "IIIII", interface,
+                                             0, urb.timestamp, len(packet),
+                                             len(packet)) + packet)
+    return data
+
+
+def captures():
+    urbs = text_urbs()
+    result = {"text": ("text", CAPTURE)}
+    for header_size in usbmon.MON_BIN_SIZES:
+        result[f"mon_bin{header_size}"] = \
+            ("mon_bin", b"".join(mon_bin(urb, "=", header_size)
+                                 for urb in urbs))
+    for endian, name in (("<", "le"), (">", "be")):
+        result[f"pcap_{name}"] = \
+            ("pcap", pcap(urbs, endian, usbmon.LINKTYPE_USB_LINUX))
+        result[f"pcap_mmapped_{name}"] = \
+            ("pcap", pcap(urbs, endian, usbmon.LINKTYPE_USB_LINUX_MMAPPED))
+        result[f"pcapng_{name}"] = ("pcapng", pcapng(urbs, endian))
+    result["pcapng_simple"] = ("pcapng", pcapng(urbs, "<", simple=True))
+    return result
+
+
+CAPTURES = captures()
+
+
+def test_text():
+    urbs = text_urbs()
+    assert len(urbs) == 8
+    setup, answer, out, out_answer, submit, report, truncated, error = urbs
+    assert setup.setup == bytes.fromhex("8006000100001200")
+    assert setup.status == -usbmon.EINPROGRESS
+    assert answer.data == \
+        bytes.fromhex("12010002000000406d042ac5000101020001")
+    assert out.setup is not None and out.data == b"\x02"
+    assert not out.direction_in and answer.direction_in
+    assert report.transfer_type == usbmon.TRANSFER_INTERRUPT
+    assert (report.bus, report.device, report.endpoint) == (3, 2, 1)
+    assert (truncated.length, truncated.data) == \
+        (16, bytes.fromhex("25303b46515c6772"))
+    assert (error.status, error.length, error.data) == (-108, 0, b"")
+
+
+@pytest.mark.parametrize("name", sorted(CAPTURES))
+def test_capture_format(name):
+    fmt, data = CAPTURES[name]
+    assert usbmon.capture_format(data[:16]) == fmt
+
+
+@pytest.mark.parametrize("header_size", usbmon.MON_BIN_SIZES)
+def test_mon_bin(header_size):
+    fmt, data = CAPTURES[f"mon_bin{header_size}"]
+    assert usbmon.guess_mon_bin_size(data) == header_size
+    # a single record
+    record = mon_bin(text_urbs()[1], "=", header_size)
+    assert usbmon.guess_mon_bin_size(record) == header_size
+    assert urb_tuples(usbmon.read_mon_bin(data)) == urb_tuples(text_urbs())
+
+
+@pytest.mark.parametrize("name", sorted(CAPTURES))
+def test_read_capture_matches_text(tmp_path, name):
+    fmt, data = CAPTURES[name]
+    expected = urb_tuples(text_urbs())
+    # read at once from a pipe, memory mapped from a file
+    f_in = io.BufferedReader(io.BytesIO(data))
+    assert urb_tuples(usbmon.read_capture(f_in)) == expected
+    path = tmp_path / name
+    path.write_bytes(data)
+    with open(str(path), "rb") as f:
+        assert urb_tuples(usbmon.read_capture(f)) == expected
+
+
+def test_pcap_unsupported_link_type():
+    data = pcap(text_urbs(), "<", 1)
+    with pytest.raises(ValueError):
+        list(usbmon.read_pcap(data))
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#
+# Hid replay / test/test_usbmon2hid_replay.py: conversion of usbmon captures
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+
+import importlib.util
+import io
+import os
+import subprocess
+import sys
+import pytest
+import usbmon
+
+TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONVERTER = os.path.join(TOOLS, "usbmon2hid-replay.py")
+PARSE_HID = os.path.join(TOOLS, "parse_hid.py")
+
+# 3 buttons, X and Y
+MOUSE = bytes.fromhex(
+    "05010902a1010901a100050919012903150025019503750181029505750181030501"
+    "093009311581257f750895028106c0c0")
+
+# 8 modifiers, a reserved byte and 6 keys
+KEYBOARD = bytes.fromhex(
+    "05010906a101050719e029e715002501750195088102950175088101950675081500"
+    "25650507190029658100c0")
+
+
+def string_descriptor(string):
+    string = string.encode("utf-16-le")
+    return bytes((len(string) + 2, 3)) + string
+
+
+def make_capture(rdescs=(MOUSE, KEYBOARD), captured=None):
+    """
+    A text usbmon capture of a device on bus 3, with one interface per
+    report descriptor of rdescs, each one sending a few reports. Only the
+    first captured bytes of the report descriptors are replied, if set.
+    """
+    lines = []
+
+    def urb(event, address, text):
+        timestamp = 1000000 + 997 * len(lines)
+        lines.append(f"ffff8800aabbcc00 {timestamp} {event} {address} {text}")
+
+    def control(setup, reply):
+        urb("S", "Ci:3:002:0", f"s {setup} <")
+        urb("C", "Ci:3:002:0", f"0 {len(reply)} = {reply.hex(' ', -4)}")
+
+    control("80 06 0100 0000 0012 18",
+            bytes.fromhex("12010002000000406d042ac5000101020001"))
+    configuration = b""
+    for i, rdesc in enumerate(rdescs):
+        configuration += bytes((9, 4, i, 0, 1, 3, 1, 2, 0))
+        configuration += bytes((9, 0x21, 0x11, 0x01, 0, 1, 0x22,
+                                len(rdesc) & 0xff, len(rdesc) >> 8))
+        configuration += bytes((7, 5, 0x81 + i, 3, 8, 0, 10))
+    configuration = bytes((9, 2, 9 + len(configuration), 0, len(rdescs),
+                           1, 0, 0xa0, 0x32)) + configuration
+    control("80 06 0200 0000 0009 9", configuration[:9])
+    control(f"80 06 0200 0000 {len(configuration):04x} "
+            f"{len(configuration)}", configuration)
+    control("80 06 0300 0000 00ff 255", bytes.fromhex("04030904"))
+    control("80 06 0301 0409 00ff 255", string_descriptor("Logitech"))
+    control("80 06 0302 0409 00ff 255", string_descriptor("USB Receiver"))
+    for i, rdesc in enumerate(rdescs):
+        control(f"81 06 2200 {i:04x} {len(rdesc) + 64:04x} {len(rdesc) + 64}",
+                rdesc[:captured])
+    urb("S", "Co:3:002:0", "s 21 09 0200 0001 0001 1 = 02")
+    urb("C", "Co:3:002:0", "0 1 >")
+    for k in range(12):
+        i = k % len(rdescs)
+        size = 3 if rdescs[i] is MOUSE else 8
+        report = bytes((k * 37 + j * 11) & 0xff for j in range(size))
+        if k % 5 == 0:
+            urb("S", f"Ii:3:002:{i + 1}", "-115:8 8 <")
+        urb("C", f"Ii:3:002:{i + 1}",
+            f"0:8 {size} = {report.hex(' ', -4)}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+# the recording of make_capture(), as written before the control requests
+# were dispatched through register_command()
+BASELINE = (
+    "# 002:0 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:0\n"
+    "R: 50 05 01 09 02 a1 01 09 01 a1 00 05 09 19 01 29 03 15 00 25 01 95 "
+    "03 75 01 81 02 95 05 75 01 81 03 05 01 09 30 09 31 15 81 25 7f 75 08 "
+    "95 02 81 06 c0 c0\n"
+    "N: Logitech USB Receiver\n"
+    "I: 3 046D C52A\n"
+    "# 002:1 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:1\n"
+    "R: 45 05 01 09 06 a1 01 05 07 19 e0 29 e7 15 00 25 01 75 01 95 08 81 "
+    "02 95 01 75 08 81 01 95 06 75 08 15 00 25 65 05 07 19 00 29 65 81 00 c0\n"
+    "N: Logitech USB Receiver\n"
+    "I: 3 046D C52A\n"
+    "# SET_REPORT (Output) ID: 00 -> 02 (length 1)\n"
+    "# 002:0 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:0\n"
+    "E: 0.000000 3 00 0b 16\n"
+    "# 002:1 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:1\n"
+    "E: 0.000997 8 25 30 3b 46 51 5c 67 72\n"
+    "# 002:0 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:0\n"
+    "E: 0.001994 3 4a 55 60\n"
+    "# 002:1 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:1\n"
+    "E: 0.002991 8 6f 7a 85 90 9b a6 b1 bc\n"
+    "# 002:0 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:0\n"
+    "E: 0.003988 3 94 9f aa\n"
+    "# 002:1 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:1\n"
+    "E: 0.005982 8 b9 c4 cf da e5 f0 fb 06\n"
+    "# 002:0 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:0\n"
+    "E: 0.006979 3 de e9 f4\n"
+    "# 002:1 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:1\n"
+    "E: 0.007976 8 03 0e 19 24 2f 3a 45 50\n"
+    "# 002:0 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:0\n"
+    "E: 0.008973 3 28 33 3e\n"
+    "# 002:1 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:1\n"
+    "E: 0.009970 8 4d 58 63 6e 79 84 8f 9a\n"
+    "# 002:0 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:0\n"
+    "E: 0.011964 3 72 7d 88\n"
+    "# 002:1 -> 046D:C52A / Logitech | USB Receiver\n"
+    "D:1\n"
+    "E: 0.012961 8 97 a2 ad b8 c3 ce d9 e4\n"
+)
+
+
+def run(script, path, *args):
+    """
+    Run script on the file at path, return its output and its errors.
+    """
+    result = subprocess.run([sys.executable, script, str(path)] + list(args),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            check=True)
+    return result.stdout.decode(), result.stderr.decode()
+
+
+def convert(path, *args):
+    """
+    Run the converter on the capture at path, return its output.
+    """
+    return run(CONVERTER, path, *args)[0]
+
+
+def test_demux_matches_intf(tmp_path):
+    path = tmp_path / "capture.usbmon"
+    path.write_bytes(make_capture())
+    assert convert(path, "--demux", str(tmp_path / "intf_{0}.hid")) == ""
+    for i in range(2):
+        with open(str(tmp_path / f"intf_{i}.hid")) as f:
+            demuxed = f.read()
+        assert "E: " in demuxed
+        assert demuxed == convert(path, "--intf", str(i))
+    assert not os.path.exists(str(tmp_path / "intf_2.hid"))
+
+
+def load_converter():
+    """
+    Import a fresh instance of the converter, whose devices and commands
+    are module globals.
+    """
+    spec = importlib.util.spec_from_file_location("usbmon2hid_replay",
+                                                  CONVERTER)
+    converter = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(converter)
+    return converter
+
+
+def convert_in_process(converter, capture):
+    output = io.StringIO()
+    urbs = usbmon.read_capture(io.BufferedReader(io.BytesIO(capture)))
+    converter.usbmon2hid_replay(urbs, converter.Outputs(output))
+    return output.getvalue()
+
+
+def test_dispatch_matches_baseline(tmp_path):
+    capture = make_capture()
+    assert convert_in_process(load_converter(), capture) == BASELINE
+    path = tmp_path / "capture.usbmon"
+    path.write_bytes(capture)
+    assert convert(path) == BASELINE
+
+
+def test_register_command():
+    converter = load_converter()
+    # replaces the SET_REPORT handler
+    converter.register_command(converter.HidCommand(
+        0x21, 0x09, None, name="ignored SET REPORT Request",
+        request_host=converter.null_request,
+        request_device=converter.null_request))
+    output = convert_in_process(converter, make_capture())
+    assert output == BASELINE.replace(
+        "# SET_REPORT (Output) ID: 00 -> 02 (length 1)\n", "")
+    assert output != BASELINE
+
+
+@pytest.mark.parametrize("args", [[], ["--delta"], ["--stats"],
+                                  ["-u", "X,Keyboard"], ["--intf", "1"]])
+def test_decode_matches_parse_hid(tmp_path, args):
+    path = tmp_path / "capture.usbmon"
+    path.write_bytes(make_capture())
+    intf = args if args[:1] == ["--intf"] else []
+    recording = tmp_path / "capture.hid"
+    recording.write_text(convert(path, *intf))
+    expected = run(PARSE_HID, recording,
+                   *[arg for arg in args if arg not in intf])[0]
+    assert "E: " not in expected
+    assert convert(path, "--decode", *args) == expected
+
+
+def test_short_report_descriptor(tmp_path):
+    path = tmp_path / "capture.usbmon"
+    path.write_bytes(make_capture(captured=20))
+    output, errors = run(CONVERTER, path)
+    assert "warning: the report descriptor of 002:0 is 20 bytes long, " \
+        "50 expected" in errors
+    assert "warning: the report descriptor of 002:1 is 20 bytes long, " \
+        "45 expected" in errors
+    assert "R: 20 05 01 09 02" in output
+    output, errors = run(CONVERTER, path, "--decode")
+    assert "warning: the report descriptor of 002:0 is 20 bytes long, " \
+        "50 expected" in errors
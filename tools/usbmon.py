@@ -0,0 +1,332 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Hid replay / usbmon.py: readers of usbmon captures
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# The captures can be given:
+# - in the text format of usbmon ("usbmon -fu"),
+# - as the binary records read from /dev/usbmonN: the struct mon_bin_hdr
+#   of the kernel (48 bytes, or 64 with the fields added for the mmap
+#   interface) followed by the captured data,
+# - as pcap or pcapng files of the USB Linux link types, as saved by
+#   wireshark or tcpdump.
+#
+# All of them are turned into Urb objects. The binary formats are read in
+# place from a memory mapping of the file.
+#
+
+import binascii
+import io
+import mmap
+import struct
+
+TRANSFER_ISO = 0
+TRANSFER_INTERRUPT = 1
+TRANSFER_CONTROL = 2
+TRANSFER_BULK = 3
+
+_text_transfer_types = {
+    ord('Z'): TRANSFER_ISO,
+    ord('I'): TRANSFER_INTERRUPT,
+    ord('C'): TRANSFER_CONTROL,
+    ord('B'): TRANSFER_BULK,
+}
+
+EINPROGRESS = 115
+
+# the setup packet, as sent on the wire
+SETUP_PACKET = struct.Struct('<BBHHH')
+
+# struct mon_bin_hdr, without its byte order
+MON_BIN_FORMAT = 'QcBBBHccqiiII8s'
+MON_BIN_SIZES = (48, 64)
+
+LINKTYPE_USB_LINUX = 189
+LINKTYPE_USB_LINUX_MMAPPED = 220
+_link_header_sizes = {
+    LINKTYPE_USB_LINUX: 48,
+    LINKTYPE_USB_LINUX_MMAPPED: 64,
+}
+
+PCAP_MAGICS = (0xa1b2c3d4, 0xa1b23c4d)  # microseconds, nanoseconds
+PCAPNG_SECTION_HEADER = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_SIMPLE_PACKET = 0x00000003
+PCAPNG_ENHANCED_PACKET = 0x00000006
+
+
+class Urb(object):
+    """
+    One usbmon event: the submission ('S'), the completion ('C') or the
+    submission error ('E') of an URB.
+
+    setup is the setup packet of the control requests, as sent on the
+    wire, None if it has not been captured. length is the length of the
+    transfer and data the captured part of it, possibly shorter.
+    """
+    __slots__ = ('timestamp', 'event_type', 'transfer_type', 'direction_in',
+                 'bus', 'device', 'endpoint', 'status', 'setup', 'length',
+                 'data')
+
+    def __init__(self, timestamp, event_type, transfer_type, direction_in,
+                 bus, device, endpoint, status, setup, length, data):
+        self.timestamp = timestamp
+        self.event_type = event_type
+        self.transfer_type = transfer_type
+        self.direction_in = direction_in
+        self.bus = bus
+        self.device = device
+        self.endpoint = endpoint
+        self.status = status
+        self.setup = setup
+        self.length = length
+        self.data = data
+
+    def __repr__(self):
+        setup = f' setup {self.setup.hex(" ")}' if self.setup else ''
+        return (f'{self.timestamp} {self.event_type.decode()} '
+                f'{self.bus}:{self.device:03d}:{self.endpoint} '
+                f'{"in" if self.direction_in else "out"} '
+                f'type {self.transfer_type} status {self.status}{setup} '
+                f'{self.length} = {self.data.hex(" ")}')
+
+
+def parse_text_data(text):
+    """
+    Return (length, data) from the end of a line of a text capture:
+    "length = hexadecimal data", or "length" followed by a flag when the
+    data has not been captured.
+    """
+    words = text.split(b' ', 2)
+    if not words[0]:
+        return 0, b''
+    length = int(words[0])
+    if len(words) > 2 and words[1] == b'=':
+        return length, binascii.unhexlify(words[2].replace(b' ', b''))
+    return length, b''
+
+
+def read_text(f_in):
+    """
+    Yield the Urbs of the text capture read from f_in, a binary file.
+
+    The payloads of the isochronous and bulk transfers are not parsed.
+    """
+    for line in f_in:
+        tokens = line.rstrip().split(b' ', 5)
+        if len(tokens) < 5:
+            continue
+        if len(tokens) == 5:
+            tokens.append(b'')
+        tag, timestamp, event_type, address, status, text = tokens
+        urb_type, bus, device, endpoint = address.split(b':')
+        transfer_type = _text_transfer_types.get(urb_type[0])
+        setup = None
+        length = None
+        data = b''
+        if status == b's':
+            # "bb bb wwww wwww wwww", the 16 bits fields printed as numbers
+            setup = SETUP_PACKET.pack(*(int(v, 16) for v in text[:20].split()))
+            text = text[21:]
+            status = -EINPROGRESS
+        else:
+            status = int(status.split(b':', 1)[0])
+        if transfer_type in (TRANSFER_CONTROL, TRANSFER_INTERRUPT):
+            length, data = parse_text_data(text)
+        yield Urb(int(timestamp), event_type, transfer_type,
+                  urb_type[1:2] == b'i', int(bus), int(device), int(endpoint),
+                  status, setup, length, data)
+
+
+def mon_bin_urb(fields, data, start, end):
+    """
+    Return the Urb of the unpacked struct mon_bin_hdr fields, its data
+    being captured in data[start:end], possibly truncated.
+    """
+    (urb_id, event_type, transfer_type, epnum, devnum, busnum, flag_setup,
+     flag_data, ts_sec, ts_usec, status, length, captured, setup) = fields
+    payload = b''
+    if flag_data == b'\0':
+        payload = data[start:min(start + captured, end)]
+    return Urb(ts_sec * 1000000 + ts_usec, event_type, transfer_type,
+               bool(epnum & 0x80), busnum, devnum, epnum & 0x7f, status,
+               setup if flag_setup == b'\0' else None, length, payload)
+
+
+def guess_mon_bin_size(data):
+    """
+    Return the size of the headers of the binary records in data, 48 or 64,
+    by looking for the second record after the first one.
+    """
+    header = struct.Struct('=' + MON_BIN_FORMAT)
+    captured = header.unpack_from(data)[12]
+    for size in MON_BIN_SIZES:
+        end = size + captured
+        if end == len(data):
+            return size
+        if end + header.size <= len(data) and \
+                data[end + 8:end + 9] in (b'S', b'C', b'E') and \
+                data[end + 9] <= TRANSFER_BULK:
+            return size
+    raise ValueError('not a binary usbmon capture')
+
+
+def read_mon_bin(data, header_size=None):
+    """
+    Yield the Urbs of data, binary records in the byte order of the host,
+    their header being of header_size bytes (guessed when None).
+    """
+    if not len(data):
+        return
+    if header_size is None:
+        header_size = guess_mon_bin_size(data)
+    header = struct.Struct('=' + MON_BIN_FORMAT)
+    pos = 0
+    end = len(data)
+    while pos + header_size <= end:
+        fields = header.unpack_from(data, pos)
+        start = pos + header_size
+        pos = start + fields[12]
+        yield mon_bin_urb(fields, data, start, end)
+
+
+def link_header_size(linktype):
+    """
+    Return the size of the usbmon header of the packets of the given link
+    type, None if it is not a USB Linux one.
+    """
+    # the upper bits may hold the FCS length
+    return _link_header_sizes.get(linktype & 0xffff)
+
+
+def read_pcap(data):
+    """
+    Yield the Urbs of data, the content of a pcap file of a USB Linux link
+    type.
+    """
+    for endian in '<>':
+        if struct.unpack_from(endian + 'I', data)[0] in PCAP_MAGICS:
+            break
+    else:
+        raise ValueError('not a pcap file')
+    linktype = struct.unpack_from(endian + 'I', data, 20)[0]
+    header_size = link_header_size(linktype)
+    if header_size is None:
+        raise ValueError(f'unsupported link type {linktype}')
+    record = struct.Struct(endian + 'IIII')
+    header = struct.Struct(endian + MON_BIN_FORMAT)
+    pos = 24
+    end = len(data)
+    while pos + record.size <= end:
+        ts_sec, ts_frac, captured, length = record.unpack_from(data, pos)
+        start = pos + record.size
+        pos = start + captured
+        if captured >= header.size:
+            fields = header.unpack_from(data, start)
+            yield mon_bin_urb(fields, data, start + header_size,
+                              min(pos, end))
+
+
+def read_pcapng(data):
+    """
+    Yield the Urbs of data, the content of a pcapng file. The packets of
+    the interfaces which are not of a USB Linux link type are skipped.
+    """
+    endian = '<'
+    interfaces = []
+    pos = 0
+    end = len(data)
+    while pos + 12 <= end:
+        block_type = struct.unpack_from(endian + 'I', data, pos)[0]
+        if block_type == PCAPNG_SECTION_HEADER:
+            # the byte order may change with every section
+            for endian in '<>':
+                magic = struct.unpack_from(endian + 'I', data, pos + 8)[0]
+                if magic == PCAPNG_BYTE_ORDER_MAGIC:
+                    break
+            else:
+                raise ValueError(f'invalid section header at {pos}')
+            interfaces = []
+        block_length = struct.unpack_from(endian + 'I', data, pos + 4)[0]
+        if block_length < 12:
+            raise ValueError(f'invalid block at {pos}')
+        body = pos + 8
+        block_end = min(pos + block_length - 4, end)
+        pos += block_length
+        if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+            linktype = struct.unpack_from(endian + 'H', data, body)[0]
+            interfaces.append(link_header_size(linktype))
+            continue
+        if block_type == PCAPNG_ENHANCED_PACKET:
+            interface, ts_high, ts_low, captured, length = \
+                struct.unpack_from(endian + 'IIIII', data, body)
+            start = body + 20
+        elif block_type == PCAPNG_SIMPLE_PACKET:
+            interface = 0
+            start = body + 4
+            captured = block_end - start
+        else:
+            continue
+        if interface >= len(interfaces) or interfaces[interface] is None:
+            continue
+        header = struct.Struct(endian + MON_BIN_FORMAT)
+        if captured < header.size:
+            continue
+        fields = header.unpack_from(data, start)
+        yield mon_bin_urb(fields, data, start + interfaces[interface],
+                          min(start + captured, block_end))
+
+
+def capture_format(magic):
+    """
+    Return the format of the capture starting with magic, at least its
+    first 16 bytes: 'pcap', 'pcapng', 'mon_bin' or 'text'.
+    """
+    if len(magic) >= 4:
+        value = struct.unpack_from('<I', magic)[0]
+        if value == PCAPNG_SECTION_HEADER:
+            return 'pcapng'
+        if value in PCAP_MAGICS or \
+                struct.unpack_from('>I', magic)[0] in PCAP_MAGICS:
+            return 'pcap'
+    # the text captures start with the URB tag, in hexadecimal
+    if len(magic) >= 10 and magic[8:9] in (b'S', b'C', b'E') and \
+            magic[9] <= TRANSFER_BULK:
+        return 'mon_bin'
+    return 'text'
+
+
+def read_capture(f_in):
+    """
+    Yield the Urbs of the capture read from f_in, a binary file, whatever
+    its format. The binary captures are memory mapped when f_in is a
+    regular file, and read at once otherwise.
+    """
+    fmt = capture_format(f_in.peek(16)[:16])
+    if fmt == 'text':
+        yield from read_text(f_in)
+        return
+    try:
+        data = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        data = f_in.read()
+    if fmt == 'pcap':
+        yield from read_pcap(data)
+    elif fmt == 'pcapng':
+        yield from read_pcapng(data)
+    else:
+        yield from read_mon_bin(data)
@@ -1,10 +1,16 @@
-#!/bin/env python
+#!/bin/env python3
 # -*- coding: utf-8 -*-
 #
 # Hid replay / usbmon2hid-replay.py
 #
-# must be run with: sudo usbmon -i 3 -fu -s 256 | python usbmon2hid-replay.py
-# or: python usbmon2hid-replay.py file.txt
+# must be run with: sudo usbmon -i 3 -fu -s 256 | python3 usbmon2hid-replay.py
+# or: python3 usbmon2hid-replay.py file.txt
+# file.txt may also be a binary usbmon capture, or a pcap / pcapng file
+# saved by wireshark or tcpdump (see usbmon.py).
+# or, to write each interface to its own file in a single pass:
+#     python3 usbmon2hid-replay.py file.txt --demux "file_{0}.hid"
+# or, to decode the reports as parse_hid.py would, in the same process:
+#     sudo usbmon -i 3 -fu -s 256 | python3 usbmon2hid-replay.py --decode
 #
 # Copyright (c) 2014 Benjamin Tissoires <benjamin.tissoires@gmail.com>
 # Copyright (c) 2014 Red Hat, Inc.
@@ -22,11 +28,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+# The payloads of the capture are handled as bytes, and only rendered in
+# hexadecimal when written.
+#
 
+import struct
 import sys
+import hidbin
+import parse_hid
+import usbmon
 from optparse import OptionParser
 
-current_device = None
+BUFFER_SIZE = 64 * 1024
+
 known_devices = []
 hid_devices = {}
 
@@ -48,36 +62,148 @@ class HID_Device(object):
 		self.bNumConfiguration = None
 		self.wLANGID = None
 		self.rdesc = {}
-		self.incomming_data = {}
-		self.init_timestamp = None
+		# the report descriptor lengths of the HID descriptors, by interface
+		self.rdesc_length = {}
 		self.endpointMapping = {}
 
-def extract_bytes(string):
-	data = string.replace(" ", "")
-	return [ data[i*2]+data[i*2+1] for i in xrange(len(data) / 2)]
+class HidOutput(object):
+	"""A hid recording being written, keeps track of the last device written
+	in it and of its first timestamp."""
+	def __init__(self, f_out):
+		self.f_out = f_out
+		self.current_device = None
+		self.init_timestamp = None
 
-def prep_incoming_data(data):
-	length, content = data.split(" = ")
-	length = int(length)
-	content = extract_bytes(content)
-	return length, content
+	def write(self, line):
+		self.f_out.write(line + "\n")
 
-def null_request(params, data, device, intf):
+	def write_device(self, device, index):
+		"switch to the given interface, if it is not the current one"
+		desc = get_description(self, device, index)
+		if desc:
+			self.write(desc)
+
+	def write_rdesc(self, device, index):
+		length, rdesc = device.rdesc[index]
+		if len(rdesc) < length:
+			warn("only {0} of the {1} bytes of the report descriptor of {2}:{3} were captured, the missing ones are written as **".format(len(rdesc), length, device.id, index))
+		self.write(get_rdesc(device, index))
+
+	def write_header(self, device):
+		"write the N: and I: lines of the device"
+		name = get_name(device)
+		if name:
+			self.write(name)
+		self.write(str(get_devinfo(device)))
+
+	def write_event(self, timestamp, length, data):
+		self.write(get_event(self, timestamp, length, data))
+
+class RecordOutput(HidOutput):
+	"""A hid recording given as the (tag, device, timestamp, payload) records
+	of hidbin instead of text, device being the interface number and the
+	timestamps in microseconds. The records are queued in self.records."""
+	def __init__(self):
+		HidOutput.__init__(self, None)
+		self.records = []
+
+	def write(self, line):
+		self.records.append((hidbin.TEXT, None, None, (line + "\n").encode()))
+
+	def write_device(self, device, index):
+		if self.current_device == index:
+			return
+		self.current_device = index
+		self.write(get_comment(device, index))
+		# written as the text output does, so the decoded output is the
+		# same as the one of parse_hid.py on the recording
+		self.write("D:" + str(index))
+
+	def write_rdesc(self, device, index):
+		length, rdesc = device.rdesc[index]
+		if len(rdesc) < length:
+			# the layouts would be wrong
+			warn("only {0} of the {1} bytes of the report descriptor of {2}:{3} were captured, its events are not decoded".format(len(rdesc), length, device.id, index))
+			return
+		self.records.append((hidbin.RDESC, index, None, rdesc))
+
+	def write_header(self, device):
+		name = get_name(device)
+		if name:
+			self.records.append((hidbin.NAME, None, None, name[3:].encode()))
+		info = get_devinfo(device)
+		if info:
+			self.records.append((hidbin.INFO, None, None, info[3:].encode()))
+
+	def write_event(self, timestamp, length, data):
+		if not self.init_timestamp:
+			self.init_timestamp = timestamp
+		self.records.append((hidbin.EVENT, self.current_device, timestamp - self.init_timestamp, data))
+
+class Outputs(object):
+	"""Write all the interfaces in the same recording, or only the given
+	interface number if intf is set."""
+	def __init__(self, f_out, intf = None):
+		self.output = HidOutput(f_out)
+		self.intf = intf
+
+	def get(self, index):
+		"return the HidOutput of the given interface, None if it is filtered out"
+		if self.intf != None and index != self.intf:
+			return None
+		return self.output
+
+	def close(self):
+		pass
+
+class RecordOutputs(Outputs):
+	"""Same as Outputs, for a RecordOutput."""
+	def __init__(self, intf = None):
+		self.output = RecordOutput()
+		self.intf = intf
+
+class DemuxOutputs(object):
+	"""Write each interface in its own recording, template being the file
+	name with {0} standing for the interface number. The files are only
+	created once the report descriptor of their interface is known."""
+	def __init__(self, template):
+		self.template = template
+		self.outputs = {}
+
+	def get(self, index):
+		"return the HidOutput of the given interface"
+		if index not in self.outputs:
+			f = open(self.template.format(index), "w", BUFFER_SIZE)
+			self.outputs[index] = HidOutput(f)
+		return self.outputs[index]
+
+	def close(self):
+		for output in self.outputs.values():
+			output.f_out.close()
+
+def warn(message):
+	print("warning: " + message, file=sys.stderr)
+
+def format_bytes(data):
+	"render bytes the way the hid recordings expect them"
+	return data.hex(" ")
+
+def null_request(params, urb, device, outputs):
 	return
 
-def print_request(params, data, device):
-	print data
+def print_request(params, urb, device):
+	print(urb)
 
-def parse_desc_request(data):
+def parse_desc_request(urb):
 	result = []
 	length = 0
-	total_length, value = data.split(" = ")
-	total_length = int(total_length)
-	content = extract_bytes(value)
-	while length < total_length:
-		length_v = int(content[0], 16)
+	total_length = urb.length
+	content = urb.data
+	# the descriptors may have been truncated by the capture
+	while length < total_length and content:
+		length_v = content[0]
 		if length_v + length > total_length:
-	#		print "MALFORMED USB DESC PACKET"
+	#		print("MALFORMED USB DESC PACKET")
 			return [[None, None, None]]
 		type = content[1]
 		result.append( (length_v, type, content[2:length_v]) )
@@ -85,28 +211,33 @@ def parse_desc_request(data):
 		length += length_v
 	return result
 
-def parse_desc_device_request(params, data, device, intf):
-	length, type, content = parse_desc_request(data)[0]
+# the device descriptor, without its length and type
+DEVICE_DESCRIPTOR = struct.Struct("<HBBBBHHHBBBB")
+
+def parse_desc_device_request(params, urb, device, outputs):
+	length, type, content = parse_desc_request(urb)[0]
 	if not length:
 		return
 
-	device.bcdUSB = int(content[1] + content[0], 16)
-	device.bdeviceClass = int(content[2], 16)
-	device.bdeviceSubClass = int(content[3], 16)
-	device.bdeviceProtocol = int(content[4], 16)
-	device.bMaxPacketSize0 = int(content[5], 16)
-	device.idVendor = (content[7] + content[6]).upper()
-	device.idProduct = (content[9] + content[8]).upper()
-	device.bcdDevice = int(content[11] + content[10], 16)
-	device.iManufacturer = int(content[12], 16)
-	device.iProduct = int(content[13], 16)
-	device.iSerialNumber = int(content[14], 16)
-	device.bNumConfiguration = int(content[15], 16)
-
-	#print device.bcdUSB, device.bdeviceClass, device.bdeviceSubClass, device.bdeviceProtocol, device.bMaxPacketSize0, "0x{0}:0x{1}".format(device.idVendor, device.idProduct), device.bcdDevice, device.iManufacturer, device.iProduct, device.iSerialNumber, device.bNumConfiguration
-
-def parse_desc_configuration_request(params, data, device, intf):
-	confs = parse_desc_request(data)
+	(device.bcdUSB,
+	 device.bdeviceClass,
+	 device.bdeviceSubClass,
+	 device.bdeviceProtocol,
+	 device.bMaxPacketSize0,
+	 idVendor,
+	 idProduct,
+	 device.bcdDevice,
+	 device.iManufacturer,
+	 device.iProduct,
+	 device.iSerialNumber,
+	 device.bNumConfiguration) = DEVICE_DESCRIPTOR.unpack_from(content)
+	device.idVendor = "{0:04X}".format(idVendor)
+	device.idProduct = "{0:04X}".format(idProduct)
+
+	#print(device.bcdUSB, device.bdeviceClass, device.bdeviceSubClass, device.bdeviceProtocol, device.bMaxPacketSize0, "0x{0}:0x{1}".format(device.idVendor, device.idProduct), device.bcdDevice, device.iManufacturer, device.iProduct, device.iSerialNumber, device.bNumConfiguration)
+
+def parse_desc_configuration_request(params, urb, device, outputs):
+	confs = parse_desc_request(urb)
 	if not confs[0][0]:
 		return
 
@@ -118,48 +249,54 @@ def parse_desc_configuration_request(params, data, device, intf):
 	hid_class = False
 
 	for length, type, content in confs[1:]:
-		if type == '04': # INTERFACE
-			current_intf_number = int(content[0], 16)
+		if type == 0x04: # INTERFACE
+			current_intf_number = content[0]
 			intfClass = content[3]
-			hid_class = (intfClass == '03') # HID
-		elif type == '05': # ENDPOINT
-			endpointAddress = int(content[0], 16)
+			hid_class = (intfClass == 0x03) # HID
+		elif type == 0x21 and hid_class: # HID
+			# bcdHID, bCountryCode, bNumDescriptors, then the type and
+			# length of the report descriptor
+			if len(content) >= 7 and content[4] == 0x22:
+				device.rdesc_length[current_intf_number] = content[5] | content[6] << 8
+		elif type == 0x05: # ENDPOINT
+			endpointAddress = content[0]
 			if hid_class and endpointAddress & 0x80:
 				device.endpointMapping[endpointAddress & 0x0f] = current_intf_number
 
 def utf16s_to_utf8s(length, string):
-	# TODO: do something much better
-	result = ""
-	for i in xrange(len(string) / 2):
-		result += chr(int(string[i*2], 16))
-	missings = (length / 2) - len(result)
+	# the string may have been truncated by the capture
+	result = string[:len(string) & ~1].decode("utf-16-le", "replace")
+	missings = (length // 2) - len(result)
 	result += "."*missings
 	return result
 
-def read_le8(array):
-	return int(array[0], 16)
-
-def read_le16(array):
-	return int(array[1], 16) | (int(array[0], 16) << 8)
+REQUEST_TYPE_MASK = 0x60
+REQUEST_TYPE_STANDARD = 0x00
+GET_DESCRIPTOR = 0x06
 
 class Ctrl(object):pass
 
 def parse_ctrl_parts(ctrl):
 	out = Ctrl()
-	out.bmRequestType = read_le8(ctrl[0:])
-	out.bRequest = read_le8(ctrl[1:])
-	out.wValue = read_le16(ctrl[2:])
-	out.wIndex = read_le16(ctrl[4:])
-	out.wLength = read_le16(ctrl[6:])
+	(out.bmRequestType,
+	 out.bRequest,
+	 out.wValue,
+	 out.wIndex,
+	 out.wLength) = usbmon.SETUP_PACKET.unpack_from(ctrl)
+	descriptor_type = None
+	if out.bRequest == GET_DESCRIPTOR and \
+	   out.bmRequestType & REQUEST_TYPE_MASK == REQUEST_TYPE_STANDARD:
+		descriptor_type = out.wValue >> 8
+	out.key = out.bmRequestType, out.bRequest, descriptor_type
 	return out
 
-def parse_desc_string_request(ctrl, data, device, intf):
-	length, type, content = parse_desc_request(data)[0]
+def parse_desc_string_request(ctrl, urb, device, outputs):
+	length, type, content = parse_desc_request(urb)[0]
 	if not length:
 		return
 
 	if ctrl.wIndex == 0:
-		device.wLANGID = "".join(content)
+		device.wLANGID = content.hex()
 		return
 
 	length -= 2 # remove 2 bytes of prefix (length + type)
@@ -173,172 +310,200 @@ def parse_desc_string_request(ctrl, data, device, intf):
 	elif index == device.iSerialNumber:
 		device.iSerialNumber = utf16s_to_utf8s(length, content)
 #	else:
-#		print params, length, type, utf16s_to_utf8s(length, content)
+#		print(params, length, type, utf16s_to_utf8s(length, content))
 
-def parse_desc_rdesc_request(ctrl, data, device, intf):
-	if data == "0":
+def parse_desc_rdesc_request(ctrl, urb, device, outputs):
+	if not urb.length:
 		return
 	if ctrl.wIndex in known_devices:
 		return
-	if intf != None and str(ctrl.wIndex) != intf:
+	output = outputs.get(ctrl.wIndex)
+	if not output:
 		return
-	length, content = prep_incoming_data(data)
+	length, content = urb.length, urb.data
+	# some hosts ask for more than the length given by the HID descriptor
+	expected = device.rdesc_length.get(ctrl.wIndex, ctrl.wLength)
+	if length < expected:
+		warn("the report descriptor of {0}:{1} is {2} bytes long, {3} expected".format(device.id, ctrl.wIndex, length, expected))
 	device.rdesc[ctrl.wIndex] = length, content
-#	device.incomming_data.append((timestamp, length, " ".join(content)))
-	desc = get_description(device, ctrl.wIndex)
-	if desc:
-		print desc
-	print get_rdesc(device, ctrl.wIndex)
-	name = get_name(device)
-	if name:
-		print name
-	print get_devinfo(device)
+	output.write_device(device, ctrl.wIndex)
+	output.write_rdesc(device, ctrl.wIndex)
+	output.write_header(device)
 	known_devices.append(ctrl.wIndex)
 
-def parse_set_report_request(ctrl, data, device, intf):
+def parse_set_report_request(ctrl, urb, device, outputs):
 	type_dict = {
 		0x01: "Input",
 		0x02: "Output",
 		0x03: "Feature",
 	}
-	if data == "0":
-		return
-	content = extract_bytes(data)
+	content = urb.data
 	reportID = ctrl.wValue & 0xff
 	type = (ctrl.wValue >> 8) & 0xff
 	type = type_dict[type]
 	# we do not store them for later like we do for the others
 	if not ctrl.wIndex in known_devices:
 		return
-	desc = get_description(device, ctrl.wIndex)
-	if desc:
-		print desc
-	print "# SET_REPORT (%s) ID: %02x -> %s (length %d)"% (type, reportID, " ".join(content), ctrl.wLength)
+	output = outputs.get(ctrl.wIndex)
+	if not output:
+		return
+	output.write_device(device, ctrl.wIndex)
+	output.write("# SET_REPORT (%s) ID: %02x -> %s (length %d)"% (type, reportID, format_bytes(content), ctrl.wLength))
 
-def interrupt(timestamp, address, data, device, intf):
-	if data == "0":
+def interrupt(urb, device, outputs):
+	"""write the event straight away: nothing is kept from one interrupt to
+	the other, so the memory used does not depend on the capture length"""
+	if not urb.length:
 		return
-	length, content = prep_incoming_data(data)
-	endpoint = address.split(":")[-1]
-	endpoint = int(endpoint)
+	endpoint = urb.endpoint
 	pipe = endpoint
-	if device.endpointMapping.has_key(endpoint):
+	if endpoint in device.endpointMapping:
 		pipe = device.endpointMapping[endpoint]
-	if not device.incomming_data.has_key(pipe):
-		device.incomming_data[pipe] = []
 	if not pipe in known_devices:
 		return
-	device.incomming_data[pipe].append((timestamp, length, " ".join(content)))
-	if intf == None or int(intf) == pipe:
-		desc = get_description(device, pipe)
-		if desc:
-			print desc
-		print get_event(device, pipe, -1)
+	output = outputs.get(pipe)
+	if not output:
+		return
+	output.write_device(device, pipe)
+	output.write_event(urb.timestamp, urb.length, urb.data)
 
 class HidCommand(object):
-	def __init__(self, prefix, name, request_host, request_device, debug = False):
-		self.prefix = prefix
+	"""The handlers of a control request: request_host is called with the
+	setup packet, request_device with the answer of the device.
+	descriptor_type is only used by the GET_DESCRIPTOR requests, and is
+	the high byte of wValue."""
+	def __init__(self, bmRequestType, bRequest, descriptor_type, name, request_host, request_device, debug = False):
+		self.key = bmRequestType, bRequest, descriptor_type
 		self.name = name
 		self.request_host = request_host
 		self.request_device = request_device
 		self.debug = debug
 
 HID_COMMANDS = (
-	HidCommand("80 06 01",
+	HidCommand(0x80, GET_DESCRIPTOR, 0x01,
 		name = "GET DESCRIPTOR Request DEVICE",
 		request_host = null_request,
 		request_device = parse_desc_device_request),
-	HidCommand("80 06 02",
+	HidCommand(0x80, GET_DESCRIPTOR, 0x02,
 		name = "GET DESCRIPTOR Request CONFIGURATION",
 		request_host = null_request,
 		request_device = parse_desc_configuration_request),
-	HidCommand("80 06 03",
+	HidCommand(0x80, GET_DESCRIPTOR, 0x03,
 		name = "GET DESCRIPTOR Request STRING",
 		request_host = null_request,
 		request_device = parse_desc_string_request),
-	HidCommand("80 06 06",
+	HidCommand(0x80, GET_DESCRIPTOR, 0x06,
 		name = "GET DESCRIPTOR Request DEVICE",
 		request_host = null_request,
 		request_device = null_request),
-	HidCommand("81 06 22",
+	HidCommand(0x81, GET_DESCRIPTOR, 0x22,
 		name = "GET DESCRIPTOR Request Reports Descriptor",
 		request_host = null_request,
 		request_device = parse_desc_rdesc_request),
-	HidCommand("a1 01",
+	HidCommand(0xa1, 0x01, None,
 		name = "GET REPORT Request",
 		request_host = null_request,
 		request_device = null_request),
-	HidCommand("21 09",
+	HidCommand(0x21, 0x09, None,
 		name = "SET REPORT Request",
 		request_host = parse_set_report_request,
 		request_device = null_request),
 )
 
-def usbmon2hid_replay(f_in, intf):
+commands = {}
+
+def register_command(command):
+	"""make usbmon2hid_replay() use command for the control requests it
+	matches, replacing the one previously registered for them if any"""
+	commands[command.key] = command
+
+for command in HID_COMMANDS:
+	register_command(command)
+
+def convert_urbs(urbs, outputs):
+	"""Convert the usbmon.Urb of a capture one at a time, writing the
+	interfaces to outputs. Each urb is yielded back once handled."""
 	current_request = null_request
 	current_params = None
-	while True:
-		try:
-			line = f_in.readline()
-		except KeyboardInterrupt:
-			break
-		if line == "":
-			break
-		tag, timestamp, event_type, address, status, usbmon_data = line.rstrip().split(" ", 5)
-		URB_type, bus, dev_address, endpoint = address.split(":")
-		if not hid_devices.has_key(dev_address):
-			hid_devices[dev_address] = HID_Device(bus, dev_address)
-
-		if URB_type in ('Ci', 'Co'): # synchronous control
-			if event_type == 'C': # answer
+	for urb in urbs:
+		key = urb.bus, urb.device
+		if key not in hid_devices:
+			hid_devices[key] = HID_Device(str(urb.bus), "{0:03d}".format(urb.device))
+		device = hid_devices[key]
+
+		if urb.transfer_type == usbmon.TRANSFER_CONTROL: # synchronous control
+			if urb.event_type == b'C': # answer
 				if not current_params:
 					continue
 				ctrl, debug = current_params
 				if debug:
-					print "<---", line,
-				current_request(ctrl, usbmon_data, hid_devices[dev_address], intf)
+					print("<---", urb)
+				current_request(ctrl, urb, device, outputs)
 				current_params = None
 			else:
-				for command in HID_COMMANDS:
-					if usbmon_data.startswith(command.prefix):
-						req_name = command.name
-						current_request = command.request_device
-						host_request = command.request_host
-						debug = command.debug
-
-						# the ctrl prefix is 8 bytes
-						params = usbmon_data.rstrip(" <").replace(" ", "")[:16]
-						params = extract_bytes(params)
-						ctrl = parse_ctrl_parts(params)
-						data = ""
-						if "=" in usbmon_data:
-							data = usbmon_data.split("=")[1]
-						current_params = ctrl, debug
-						if debug:
-							print "--->", line,
-							print "    ", req_name, dev_address, current_params
-						host_request(ctrl, data, hid_devices[dev_address], intf)
-						break
-				else:
+				command = None
+				if urb.setup:
+					ctrl = parse_ctrl_parts(urb.setup)
+					command = commands.get(ctrl.key)
+				if not command:
 					current_request = null_request
-		elif URB_type == 'Ii': # Interrupt
-			if event_type == 'C': # data from device
-				interrupt(timestamp, address, usbmon_data, hid_devices[dev_address], intf)
+					continue
+				current_request = command.request_device
+				debug = command.debug
+				current_params = ctrl, debug
+				if debug:
+					print("--->", urb)
+					print("    ", command.name, device.id, current_params)
+				command.request_host(ctrl, urb, device, outputs)
+		elif urb.transfer_type == usbmon.TRANSFER_INTERRUPT and urb.direction_in: # Interrupt
+			if urb.event_type == b'C': # data from device
+				interrupt(urb, device, outputs)
+		yield urb
+
+def usbmon2hid_replay(urbs, outputs):
+	"""Convert the usbmon capture in a single pass, urbs being the
+	usbmon.Urb of the capture, writing the interfaces to outputs (an Outputs
+	or a DemuxOutputs)."""
+	try:
+		for urb in convert_urbs(urbs, outputs):
+			pass
+	except KeyboardInterrupt:
+		pass
 
 	return hid_devices
 
+def hid_records(urbs, intf = None):
+	"""Yield the hid recording of the capture as the (tag, device, timestamp,
+	payload) records of hidbin, nothing being rendered as text but the
+	comments. device is the interface number, and only the given interface
+	is kept if intf is set."""
+	outputs = RecordOutputs(intf)
+	records = outputs.output.records
+	for urb in convert_urbs(urbs, outputs):
+		if records:
+			yield from records
+			del records[:]
+	yield from records
+
+def decode_capture(urbs, f_out, intf = None, usages = None, delta = False, stats = False):
+	"""Decode the reports of the capture as parse_hid.py does from a
+	recording, in the same process: the usbmon records are converted into
+	hid records, demuxed by interface and decoded, the text being only
+	rendered for the decoded reports written to f_out."""
+	records = parse_hid.decode_records(hid_records(urbs, intf), usages = usages)
+	try:
+		parse_hid.write_output(records, f_out, delta, stats)
+	except KeyboardInterrupt:
+		pass
+
 def get_rdesc(device, index):
 	length, rdesc = device.rdesc[index]
 	missing_chars = length - len(rdesc)
-	rdesc.extend( ("**",) * missing_chars)
-	return "R: " + str(length) + " " + " ".join(rdesc)
-
-def get_description(device, index):
-	global current_device
-	if current_device == index:
-		return None
+	dump = [format_bytes(rdesc)] if rdesc else []
+	dump.extend( ("**",) * missing_chars)
+	return "R: " + str(length) + " " + " ".join(dump)
 
-	current_device = index
+def get_comment(device, index):
 	desc = "# " + device.id + ":" + str(index) + " -> "
 	if device.idVendor and device.idProduct:
 		desc += device.idVendor + ":" + device.idProduct
@@ -346,6 +511,14 @@ def get_description(device, index):
 			desc += " / " + device.iManufacturer
 		if isinstance(device.iProduct, str):
 			desc += " | " + device.iProduct
+	return desc
+
+def get_description(output, device, index):
+	if output.current_device == index:
+		return None
+
+	output.current_device = index
+	desc = get_comment(device, index)
 
 	desc += '\nD:' + str(index)
 
@@ -366,26 +539,50 @@ def get_devinfo(device):
 		return "I: {0} {1} {2}".format(device.bus, device.idVendor, device.idProduct)
 	return None
 
-def get_event(device, index, num):
-	ts, length, data = device.incomming_data[index][num]
-	if not device.init_timestamp:
-		for d in hid_devices.values():
-			d.init_timestamp = long(ts)
-	ts = long(ts) - device.init_timestamp
-	return "E: {0:.06f} {1} {2}".format(ts / 1000000.0, length, data)
+def get_event(output, ts, length, data):
+	if not output.init_timestamp:
+		output.init_timestamp = int(ts)
+	ts = int(ts) - output.init_timestamp
+	return "E: {0:.06f} {1} {2}".format(ts / 1000000.0, length, format_bytes(data))
 
 def get_options():
 	parser = OptionParser()
 	parser.add_option("", "--intf", dest="intf",
 			help="capture only the given interface number, omit if you don't want to filter")
+	parser.add_option("", "--demux", dest="demux", metavar="TEMPLATE",
+			help="write each interface to its own file, {0} in TEMPLATE standing for the interface number")
+	parser.add_option("", "--decode", dest="decode", action="store_true",
+			help="decode the reports as parse_hid.py would instead of writing the hid recording")
+	parser.add_option("-u", "--usages", dest="usages",
+			help="with --decode, only decode the given comma separated usages")
+	parser.add_option("", "--delta", dest="delta", action="store_true",
+			help="with --decode, only print the fields which changed since the previous report")
+	parser.add_option("", "--stats", dest="stats", action="store_true",
+			help="with --decode, print the timing statistics of the reports instead")
 	return parser.parse_args()
 
 def main():
-	f = sys.stdin
+	f = sys.stdin.buffer
 	(options, args) = get_options()
 	if len(args) > 0:
-		f = open(args[0])
-	devs = usbmon2hid_replay(f, options.intf)
+		f = open(args[0], "rb")
+	intf = None
+	if options.intf != None:
+		intf = int(options.intf)
+	urbs = usbmon.read_capture(f)
+	if options.decode:
+		usages = None
+		if options.usages:
+			usages = [u.strip() for u in options.usages.split(",")]
+		decode_capture(urbs, sys.stdout, intf, usages, options.delta, options.stats)
+		f.close()
+		return
+	if options.demux:
+		outputs = DemuxOutputs(options.demux)
+	else:
+		outputs = Outputs(sys.stdout, intf)
+	devs = usbmon2hid_replay(urbs, outputs)
+	outputs.close()
 	f.close()
 
 if __name__ == "__main__":